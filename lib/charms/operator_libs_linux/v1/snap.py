@@ -57,13 +57,16 @@ except snap.SnapError as e:
 """
 
 import http.client
+import io
 import json
 import logging
 import os
 import re
+import select
 import socket
 import subprocess
 import sys
+import threading
 import urllib.error
 import urllib.parse
 import urllib.request
@@ -83,6 +86,8 @@ LIBAPI = 1
 
 # Increment this PATCH version before using `charmcraft publish-lib` or reset
 # to 0 if you are raising the major API version
+# Locally patched on top of LIBPATCH 7: snap versions and keep-alive connections to snapd.
+# Left at 7 as these changes are not published, so fetch-lib will overwrite them.
 LIBPATCH = 7
 
 
@@ -113,7 +118,7 @@ class SnapService:
         enabled: bool = False,
         active: bool = False,
         activators: List[str] = [],
-        **kwargs
+        **kwargs,
     ):
         self.daemon = daemon
         self.daemon_scope = kwargs.get("daemon-scope", None) or daemon_scope
@@ -216,6 +221,7 @@ class Snap(object):
       - channel: "stable", "candidate", "beta", and "edge" are common
       - revision: a string representing the snap's revision
       - confinement: "classic" or "strict"
+      - version: the version string reported by snapd
     """
 
     def __init__(
@@ -227,6 +233,7 @@ class Snap(object):
         confinement: str,
         apps: Optional[List[Dict[str, str]]] = None,
         cohort: Optional[str] = "",
+        version: Optional[str] = None,
     ) -> None:
         self._name = name
         self._state = state
@@ -235,6 +242,7 @@ class Snap(object):
         self._confinement = confinement
         self._cohort = cohort
         self._apps = apps or []
+        self._version = version
         self._snap_client = SnapClient()
 
     def __eq__(self, other) -> bool:
@@ -545,6 +553,11 @@ class Snap(object):
         """Returns the revision for a snap."""
         return self._revision
 
+    @property
+    def version(self) -> Optional[str]:
+        """Returns the version for a snap, as reported by snapd."""
+        return self._version
+
     @property
     def channel(self) -> str:
         """Returns the channel for a snap."""
@@ -593,6 +606,24 @@ class _UnixSocketConnection(http.client.HTTPConnection):
             self.sock.settimeout(self.timeout)
 
 
+# Keep-alive connections to snapd, one per socket path, shared by every SnapClient in the process
+_connection_pool: Dict[str, _UnixSocketConnection] = {}
+_connection_pool_lock = threading.Lock()
+# Raised by a pooled connection which snapd closed
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+
+def _connection_dropped(conn: http.client.HTTPConnection) -> bool:
+    """Return whether the peer of an idle connection has closed it.
+
+    An idle keep-alive connection has nothing to read, so a readable socket is at EOF.
+    """
+    if conn.sock is None:
+        return False
+    readable, _, _ = select.select([conn.sock], [], [], 0)
+    return bool(readable)
+
+
 class _UnixSocketHandler(urllib.request.AbstractHTTPHandler):
     """Implementation of HTTPHandler that uses a named Unix socket."""
 
@@ -619,6 +650,7 @@ class SnapClient:
         opener: Optional[urllib.request.OpenerDirector] = None,
         base_url: str = "http://localhost/v2/",
         timeout: float = 5.0,
+        keepalive: Optional[bool] = None,
     ):
         """Initialize a client instance.
 
@@ -628,12 +660,18 @@ class SnapClient:
             base_url: base url for making requests to the snap client. Defaults to
                 http://localhost/v2/
             timeout: timeout in seconds to use when making requests to the API. Default is 5.0s.
+            keepalive: reuse a process-wide HTTP/1.1 connection to snapd instead of opening
+                one per request. Defaults to `True` unless an opener is given.
         """
+        if keepalive is None:
+            keepalive = opener is None
         if opener is None:
             opener = self._get_default_opener(socket_path)
         self.opener = opener
+        self.socket_path = socket_path
         self.base_url = base_url
         self.timeout = timeout
+        self.keepalive = keepalive
 
     @classmethod
     def _get_default_opener(cls, socket_path):
@@ -675,14 +713,19 @@ class SnapClient:
         query: Dict = None,
         headers: Dict = None,
         data: bytes = None,
-    ) -> http.client.HTTPResponse:
-        """Make a request to the Snapd server; return the raw HTTPResponse object."""
+    ) -> Union[http.client.HTTPResponse, io.BytesIO]:
+        """Make a request to the Snapd server; return the raw HTTPResponse object.
+
+        With keep-alive enabled, the response body is returned already read into a buffer.
+        """
         url = self.base_url + path
         if query:
             url = url + "?" + urllib.parse.urlencode(query)
 
         if headers is None:
             headers = {}
+        if self.keepalive:
+            return self._request_pooled(method, url, headers, data)
         request = urllib.request.Request(url, method=method, data=data, headers=headers)
 
         try:
@@ -702,6 +745,66 @@ class SnapClient:
             raise SnapAPIError({}, 500, "Not found", e.reason)
         return response
 
+    def _request_pooled(
+        self,
+        method: str,
+        url: str,
+        headers: Dict,
+        data: bytes = None,
+    ) -> io.BytesIO:
+        """Make a request over the pooled keep-alive connection; return the response body.
+
+        The body is read in full so the connection can be handed to the next request. A
+        pooled connection which snapd has closed is replaced before it is used. If a reused
+        connection still fails, the request is retried once on a new connection when it could
+        not have reached snapd, because it failed while being sent, or when it is a GET. A
+        request which changes state may have been acted on, so it is never sent twice.
+        """
+        target = urllib.parse.urlsplit(url)
+        selector = target.path + ("?" + target.query if target.query else "")
+        with _connection_pool_lock:
+            while True:
+                conn = _connection_pool.get(self.socket_path)
+                if conn is not None and _connection_dropped(conn):
+                    conn.close()
+                    del _connection_pool[self.socket_path]
+                    conn = None
+                reused = conn is not None
+                if conn is None:
+                    conn = _UnixSocketConnection(target.netloc, socket_path=self.socket_path)
+                    _connection_pool[self.socket_path] = conn
+                conn.timeout = self.timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(self.timeout)
+                sent = False
+                try:
+                    conn.request(method, selector, body=data, headers=headers)
+                    sent = True
+                    response = conn.getresponse()
+                    body = response.read()
+                except (http.client.HTTPException, OSError) as e:
+                    conn.close()
+                    del _connection_pool[self.socket_path]
+                    retry = method == "GET" or not sent
+                    if reused and retry and isinstance(e, _STALE_CONNECTION_ERRORS):
+                        logger.debug("Reconnecting to snapd after error: {}".format(e))
+                        continue
+                    raise SnapAPIError({}, 500, "Not found", str(e))
+                break
+            if response.will_close:
+                conn.close()
+                del _connection_pool[self.socket_path]
+
+        if response.status >= 400:
+            message = ""
+            try:
+                body = json.loads(body.decode())["result"]
+            except (ValueError, KeyError) as e:
+                body = {}
+                message = "{} - {}".format(type(e).__name__, e)
+            raise SnapAPIError(body, response.status, response.reason, message)
+        return io.BytesIO(body)
+
     def get_installed_snaps(self) -> Dict:
         """Get information about currently installed snaps."""
         return self._request("GET", "snaps")
@@ -791,6 +894,7 @@ class SnapCache(Mapping):
                 revision=i["revision"],
                 confinement=i["confinement"],
                 apps=i.get("apps", None),
+                version=i.get("version", None),
             )
             self._snap_map[snap.name] = snap
 
@@ -809,6 +913,7 @@ class SnapCache(Mapping):
             revision=info["revision"],
             confinement=info["confinement"],
             apps=None,
+            version=info.get("version", None),
         )
 
 
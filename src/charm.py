@@ -4,14 +4,23 @@
 
 """GLAuth Operator Charm."""
 
+import ipaddress
 import logging
+import pathlib
+import sqlite3
+from typing import Any, Dict, Optional
 
 import glauth
+import glauth_config
+import userdb
 from charms.operator_libs_linux.v1 import snap
 from ldapclient_lib import ConfigDataUnavailableEvent, LdapClientProvides, LdapReadyEvent
+from metrics_lib import MetricsEndpointProvides
 from ops.charm import CharmBase
+from ops.framework import StoredState
 from ops.main import main
-from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus
+from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus, ModelError
+from timing import timed
 
 logger = logging.getLogger(__name__)
 
@@ -19,16 +28,30 @@ logger = logging.getLogger(__name__)
 class GlauthCharm(CharmBase):
     """Charmed Operator to deploy glauth - a lightweight LDAP server."""
 
+    _stored = StoredState()
+
     def __init__(self, *args):
         super().__init__(*args)
+        self._stored.set_default(served={}, restarts_avoided=0)
         self._ldapclient = LdapClientProvides(self, "ldap-client")
+        self._metrics = MetricsEndpointProvides(self, "metrics-endpoint", glauth.METRICS_PATH)
         # Observe common Juju events
         self.framework.observe(self.on.install, self._install)
+        self.framework.observe(self.on.config_changed, self._on_config_changed)
         self.framework.observe(self.on.remove, self._remove)
         self.framework.observe(self.on.update_status, self._update_status)
         self.framework.observe(self.on.upgrade_charm, self._upgrade_charm)
+        # Share the leader's key material with every unit
+        self.framework.observe(self.on.leader_elected, self._on_key_material_changed)
+        self.framework.observe(self.on.glauth_relation_changed, self._on_key_material_changed)
         # Actions
         self.framework.observe(self.on.set_confidential_action, self._on_set_confidential_action)
+        self.framework.observe(self.on.benchmark_action, self._on_benchmark_action)
+        self.framework.observe(self.on.import_users_action, self._on_import_users_action)
+        self.framework.observe(self.on.add_users_action, self._on_add_users_action)
+        self.framework.observe(self.on.remove_users_action, self._on_remove_users_action)
+        self.framework.observe(self.on.sync_users_action, self._on_sync_users_action)
+        self.framework.observe(self.on.show_tuning_action, self._on_show_tuning_action)
         # LDAP Client Lib Integrations
         self.framework.observe(
             self._ldapclient.on.config_data_unavailable,
@@ -39,6 +62,7 @@ class GlauthCharm(CharmBase):
             self._on_ldap_ready,
         )
 
+    @timed
     def _install(self, _):
         """Install glauth."""
         self.unit.status = MaintenanceStatus("installing glauth")
@@ -48,23 +72,215 @@ class GlauthCharm(CharmBase):
             self.unit.status = ActiveStatus()
         except snap.SnapError as e:
             self.unit.status = BlockedStatus(e.message)
+        else:
+            error = self._apply_tuning()
+            if error:
+                self.unit.status = BlockedStatus(error)
+            # Pre-generate key material on the leader, which shares it with the other units
+            if not self.unit.is_leader():
+                return
+            try:
+                glauth.generate_certificate(self.config["tls-key-algorithm"])
+            except glauth.GlauthError as e:
+                logger.warning("could not pre-generate glauth certificate: %s", e.message)
+        logger.debug("snap cache stats: %s", glauth.cache_stats())
+
+    @property
+    def restarts_avoided(self) -> int:
+        """Return how many config changes GLAuth picked up without a restart."""
+        return self._stored.restarts_avoided
+
+    def _serve(self, allow_start: bool = False) -> str:
+        """Make GLAuth serve the config on disk, restarting it only if it has to.
+
+        Args:
+            allow_start: Start GLAuth if it is stopped. Set as GLAuth becomes ready, when the
+                config is not known to have changed.
+
+        Returns:
+            str: What was done, see `glauth.serve`.
+        """
+        try:
+            outcome, served = glauth.serve(dict(self._stored.served), allow_start)
+        except glauth.GlauthError as e:
+            logger.error("could not serve glauth config: %s", e.message)
+            self.unit.status = BlockedStatus(e.message)
+            return "stopped"
+        self._stored.served = served
+        # Callers other than the ready handler would previously have restarted GLAuth
+        if outcome == "reloaded" or (outcome == "unchanged" and not allow_start):
+            self._stored.restarts_avoided += 1
+        logger.info("glauth config %s, %d restarts avoided", outcome, self.restarts_avoided)
+        return outcome
+
+    def _check_config(self) -> Optional[str]:
+        """Return a message describing the first invalid config option, if any."""
+        for option in ("api-port", "ldap-port"):
+            if not 0 < self.config[option] < 65536:
+                return f"{option} must be between 1 and 65535"
+        for option in (
+            "max-open-files",
+            "gogc",
+            "number-of-failed-binds",
+            "period-of-failed-binds",
+            "block-failed-binds-for",
+            "prune-source-table-every",
+            "prune-sources-older-than",
+        ):
+            if self.config[option] <= 0:
+                return f"{option} must be positive"
+        if self.config["gomaxprocs"] < 0:
+            return "gomaxprocs must not be negative"
+        try:
+            ipaddress.ip_address(self.config["ldap-listen-address"])
+        except ValueError:
+            return "ldap-listen-address must be an IP address"
+        if self.config["tls-key-algorithm"] not in glauth.KEY_ALGORITHMS:
+            return f"tls-key-algorithm must be one of {', '.join(glauth.KEY_ALGORITHMS)}"
+        return self._check_backend_config()
+
+    def _check_backend_config(self) -> Optional[str]:
+        """Return a message describing the first invalid backend option, if any."""
+        backend = self.config["backend"]
+        if backend not in glauth.BACKENDS:
+            return f"backend must be one of {', '.join(glauth.BACKENDS)}"
+        if backend != "config" and not self.config.get("ldap-search-base"):
+            return f"ldap-search-base is required by the {backend} backend"
+        servers = [s.strip() for s in self.config["ldap-upstream-servers"].split(",") if s.strip()]
+        if backend == "ldap" and not (
+            servers and all(s.startswith(("ldap://", "ldaps://")) for s in servers)
+        ):
+            return "ldap-upstream-servers must list ldap:// or ldaps:// URIs"
+        return None
 
+    def _tuning(self) -> Dict[str, str]:
+        """Return the service tuning from charm config, as reported by the workload."""
+        return {
+            "max-open-files": str(self.config["max-open-files"]),
+            "gomaxprocs": str(self.config["gomaxprocs"] or ""),
+            "gogc": str(self.config["gogc"]),
+        }
+
+    def _apply_tuning(self) -> Optional[str]:
+        """Apply the service tuning, restarting GLAuth if it changed, and verify it.
+
+        Returns:
+            Optional[str]: A message describing the first setting GLAuth does not run with.
+        """
+        try:
+            if glauth.write_tuning(
+                self.config["max-open-files"], self.config["gomaxprocs"], self.config["gogc"]
+            ):
+                self._serve()
+            effective = glauth.effective_tuning()
+        except glauth.GlauthError as e:
+            return e.message
+        for option, value in self._tuning().items():
+            if effective[option] != value:
+                return f"glauth runs with {option} {effective[option] or 'unset'}, not {value}"
+        return None
+
+    def _settings(self) -> Dict[str, Any]:
+        """Return the GLAuth server settings from charm config."""
+        settings = {}
+        for name, default in glauth.DEFAULT_SETTINGS.items():
+            value = self.config.get(name.replace("_", "-"))
+            settings[name] = default if value is None else value
+        return settings
+
+    def _write_default_config(self, api_port: int) -> bool:
+        """Render the default config, and an empty database if the backend needs one."""
+        if self.config["backend"] == "database":
+            userdb.ensure_database(glauth.DATABASE_PATH)
+        return glauth.create_default_config(api_port=api_port, **self._settings())
+
+    @timed
+    def _on_config_changed(self, _) -> None:
+        """Re-render the default config, restarting GLAuth only if it changed, and republish."""
+        error = self._check_config()
+        if error:
+            self.unit.status = BlockedStatus(error)
+            return
+        # A limit capped elsewhere blocks the unit, but the rest of the config still applies
+        tuning_error = self._apply_tuning()
+        # A config resource, once applied, supplies the whole config itself
+        if not self._ldapclient.config_resource_applied and glauth.CONFIG_PATH.exists():
+            if self._write_default_config(self.config["api-port"]):
+                self._serve()
+            self.unit.status = ActiveStatus()
+        # Clients are given the port, scheme and base DN, so republish them
+        if self.model.relations["ldap-client"]:
+            self._ldapclient.reconcile()
+        if tuning_error:
+            self.unit.status = BlockedStatus(tuning_error)
+
+    @timed
     def _on_config_data_unavailable(self, event: ConfigDataUnavailableEvent) -> None:
         """Handle config-data-unavailable event."""
+        error = self._check_config()
+        if error:
+            self.unit.status = BlockedStatus(error)
+            return
         # If config data is unavailable, set default config
-        glauth.create_default_config(api_port=event.api_port)
+        self._write_default_config(event.api_port)
 
+    @timed
     def _on_ldap_ready(self, event: LdapReadyEvent) -> None:
         """Handle ldap-ready event."""
-        glauth.start()
+        # A config resource may have been applied since GLAuth started
+        self._serve(allow_start=True)
         self.unit.status = ActiveStatus()
 
+    @timed
+    def _on_key_material_changed(self, _) -> None:
+        """Converge on the CA shared by the leader in a peer secret.
+
+        The leader generates the CA once and publishes it, and every unit serves a certificate
+        it issues for its own hostname and address, so clients trust a single CA whichever
+        unit they reach.
+        """
+        peer = self.model.get_relation("glauth")
+        if peer is None:
+            return
+        secret_id = peer.data[self.app].get("key-material")
+        algorithm = self.config["tls-key-algorithm"]
+        try:
+            if secret_id is None:
+                if not self.unit.is_leader():
+                    return
+                secret = self.app.add_secret(glauth.key_material(algorithm), label="key-material")
+                peer.data[self.app]["key-material"] = secret.id
+                logger.debug("created secret key-material")
+                installed = False
+            else:
+                content = self.model.get_secret(id=secret_id).get_content(refresh=True)
+                installed = glauth.install_key_material(
+                    content["certificate"], content["private-key"]
+                )
+            endpoint = self._ldapclient.cluster_endpoints()[0]
+            issued = glauth.issue_certificate(
+                {endpoint["hostname"], endpoint["address"]}, algorithm
+            )
+            if installed or issued:
+                self._serve()
+        except glauth.GlauthError as e:
+            logger.error("could not share key material: %s", e.message)
+            self.unit.status = BlockedStatus(e.message)
+
+    @timed
     def _on_set_confidential_action(self, event):
         """Handle the set-confidential action."""
+        if not self.unit.is_leader():
+            event.fail("set-confidential must be run on the leader unit")
+            return
         if "ca-cert" in event.params:
             cc_content = {"ca-cert": event.params["ca-cert"]}
         else:
-            cc_content = {"ca-cert": glauth.load()}
+            try:
+                cc_content = {"ca-cert": glauth.load(self.config["tls-key-algorithm"])}
+            except glauth.GlauthError as e:
+                event.fail(e.message)
+                return
         ldbd_content = {"ldap-default-bind-dn": event.params["ldap-default-bind-dn"]}
         lp_content = {"ldap-password": event.params["ldap-password"]}
         cc_secret = self.app.add_secret(cc_content, label="ca-cert")
@@ -78,17 +294,176 @@ class GlauthCharm(CharmBase):
         ldap_relation.data[self.app]["ca-cert"] = cc_secret.id
         ldap_relation.data[self.app]["ldap-default-bind-dn"] = ldbd_secret.id
         ldap_relation.data[self.app]["ldap-password"] = lp_secret.id
+        # Publish the new secrets to clients which joined before they existed
+        if self.model.relations["ldap-client"]:
+            self._ldapclient.reconcile()
+
+    @timed
+    def _on_benchmark_action(self, event):
+        """Handle the benchmark action."""
+        credentials = self._ldapclient.bind_credentials() or (None, None)
+        bind_dn = event.params.get("bind-dn") or credentials[0]
+        password = event.params.get("password") or credentials[1]
+        base_dn = event.params.get("base-dn") or self.config.get("ldap-search-base")
+        if not (bind_dn and password and base_dn):
+            event.fail(
+                "bind-dn, password and base-dn are required, run set-confidential or pass them"
+            )
+            return
+        # ldap3 takes longer to import than most hooks take to run, so only load it here
+        import loadgen
+
+        uri = self._local_uri()
+        event.log(f"running {event.params['operation']} benchmark against {uri}")
+        results = loadgen.run(
+            loadgen.connection_factory(uri, bind_dn, password),
+            base_dn,
+            workers=event.params["workers"],
+            duration=event.params["duration"],
+            operation=event.params["operation"],
+            search_filter=event.params["filter"],
+        )
+        if results["total"]["ops"] == 0:
+            event.fail(f"no operation succeeded against {uri}, {results['errors']} errors")
+            return
+        event.set_results(results)
+
+    def _local_uri(self) -> str:
+        """Return the URI of the LDAP listener the charm configures on this unit."""
+        address = ipaddress.ip_address(self.config["ldap-listen-address"])
+        if address.is_unspecified:
+            address = ipaddress.ip_address("::1" if address.version == 6 else "127.0.0.1")
+        host = f"[{address}]" if address.version == 6 else str(address)
+        return f"ldap://{host}:{self.config['ldap-port']}"
+
+    def _users_source(self, event) -> Optional[pathlib.Path]:
+        """Return the source passed to a users action, failing it if there is none."""
+        if event.params.get("path"):
+            return pathlib.Path(event.params["path"])
+        try:
+            return pathlib.Path(self.model.resources.fetch("users"))
+        except ModelError as e:
+            event.fail(f"pass a path or attach the users resource: {e}")
+            return None
+
+    @timed
+    def _on_import_users_action(self, event):
+        """Handle the import-users action."""
+        source = self._users_source(event)
+        if source is None:
+            return
+        try:
+            users, groups = userdb.load_source(source, event.params.get("format"))
+            results = userdb.compile_database(users, groups, glauth.DATABASE_PATH, source.name)
+        except (userdb.UserSourceError, glauth_config.ConfigValidationError) as e:
+            event.fail(str(e))
+            return
+        except (sqlite3.Error, OSError) as e:
+            # Such as a locked database or a full disk, the current database is kept
+            event.fail(f"could not write the user database: {e}")
+            return
+        if self.config["backend"] != "database":
+            event.log("the database is only read once backend is set to database")
+        else:
+            # GLAuth keeps the replaced database open until restarted
+            self._serve()
+        event.set_results(results)
 
+    def _update_users(self, event, mode: str, users: list, groups: list, source: str) -> None:
+        """Apply users and groups to the store of the configured backend."""
+        if self.config["backend"] == "ldap":
+            event.fail("users and groups are managed upstream under the ldap backend")
+            return
+        try:
+            if self.config["backend"] == "database":
+                # GLAuth reads rows changed in place without a restart
+                results = userdb.update_database(glauth.DATABASE_PATH, users, groups, mode, source)
+            else:
+                results = userdb.update_config(
+                    glauth.USERS_CONFIG_PATH, users, groups, mode, source
+                )
+                if results["changed"]:
+                    self._serve()
+        except (userdb.UserSourceError, glauth_config.ConfigValidationError) as e:
+            event.fail(str(e))
+            return
+        except (sqlite3.Error, OSError) as e:
+            event.fail(f"could not write the user store: {e}")
+            return
+        event.set_results(results)
+
+    def _update_users_from_source(self, event, mode: str) -> None:
+        source = self._users_source(event)
+        if source is None:
+            return
+        try:
+            users, groups = userdb.load_source(source, event.params.get("format"))
+        except userdb.UserSourceError as e:
+            event.fail(str(e))
+            return
+        self._update_users(event, mode, users, groups, source.name)
+
+    @timed
+    def _on_add_users_action(self, event):
+        """Handle the add-users action."""
+        self._update_users_from_source(event, "add")
+
+    @timed
+    def _on_sync_users_action(self, event):
+        """Handle the sync-users action."""
+        self._update_users_from_source(event, "sync")
+
+    @timed
+    def _on_remove_users_action(self, event):
+        """Handle the remove-users action."""
+        users = [
+            {"name": name} for name in event.params.get("users", "").replace(",", " ").split()
+        ]
+        groups = [
+            {"name": name} for name in event.params.get("groups", "").replace(",", " ").split()
+        ]
+        source = "remove-users"
+        if event.params.get("path"):
+            path = pathlib.Path(event.params["path"])
+            try:
+                more_users, more_groups = userdb.load_names(path, event.params.get("format"))
+            except userdb.UserSourceError as e:
+                event.fail(str(e))
+                return
+            users, groups, source = users + more_users, groups + more_groups, path.name
+        if not (users or groups):
+            event.fail("pass the users or groups to remove, or a path listing them")
+            return
+        self._update_users(event, "remove", users, groups, source)
+
+    @timed
+    def _on_show_tuning_action(self, event):
+        """Handle the show-tuning action."""
+        try:
+            effective = glauth.effective_tuning()
+        except glauth.GlauthError as e:
+            event.fail(e.message)
+            return
+        event.set_results({"configured": self._tuning(), "effective": effective})
+
+    @timed
     def _remove(self, _):
         """Remove glauth from the machine."""
         self.unit.status = MaintenanceStatus("removing glauth")
         glauth.remove()
+        try:
+            glauth.remove_tuning()
+        except glauth.GlauthError as e:
+            logger.warning("could not remove glauth service tuning: %s", e.message)
 
+    @timed
     def _update_status(self, _):
         """Update status."""
         snap.hold_refresh()
         self.unit.set_workload_version(glauth.version())
+        logger.debug("snap cache stats: %s", glauth.cache_stats())
 
+    @timed
     def _upgrade_charm(self, _):
         """Ensure the snap is refreshed (in channel) if there are new revisions."""
         self.unit.status = MaintenanceStatus("refreshing glauth")
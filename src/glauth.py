@@ -4,20 +4,116 @@
 
 """Provides glauth class to control glauth."""
 
+import datetime
+import hashlib
+import ipaddress
 import logging
+import os
 import pathlib
 import socket
 import subprocess
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 from charms.operator_libs_linux.v1 import snap
-from jinja2 import Template
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from cryptography.x509.oid import NameOID
+from jinja2 import Environment, FileSystemLoader
+
+import glauth_config
 
 logger = logging.getLogger(__name__)
 
+# Certificate and key served by this unit, issued for its names by the shared CA
+CERT_PATH = pathlib.Path("/var/snap/glauth/common/etc/glauth/certs.d/glauth.crt")
+KEY_PATH = pathlib.Path("/var/snap/glauth/common/etc/glauth/keys.d/glauth.key")
+# CA generated by the leader and shared with every unit, trusted by clients
+CA_CERT_PATH = pathlib.Path("/var/snap/glauth/common/etc/glauth/certs.d/glauth-ca.crt")
+CA_KEY_PATH = pathlib.Path("/var/snap/glauth/common/etc/glauth/keys.d/glauth-ca.key")
+CONFIG_PATH = pathlib.Path("/var/snap/glauth/common/etc/glauth/glauth.d/glauth.cfg")
+# Users and groups added by actions under the config backend, loaded with the config files
+USERS_CONFIG_PATH = CONFIG_PATH.with_name("charm-users.cfg")
+DATABASE_PATH = pathlib.Path("/var/snap/glauth/common/etc/glauth/glauth.db")
+SQLITE_PLUGIN = "/snap/glauth/current/lib/sqlite.so"
+# Config files, the SQLite plugin, or an upstream LDAP server proxied to
+BACKENDS = ("config", "database", "ldap")
+# Server settings rendered into the default config, each mirrored by a charm config option
+DEFAULT_SETTINGS = {
+    "debug": False,
+    "backend": "config",
+    "ldap_search_base": "",
+    "ldap_upstream_servers": "",
+    "ldap_upstream_insecure": False,
+    "ldap_listen_address": "0.0.0.0",
+    "ldap_port": 363,
+    "metrics": False,
+    "limit_failed_binds": True,
+    "number_of_failed_binds": 3,
+    "period_of_failed_binds": 10,
+    "block_failed_binds_for": 60,
+    "prune_source_table_every": 600,
+    "prune_sources_older_than": 600,
+}
+# Systemd unit of the GLAuth snap service, tuned through a drop-in
+SERVICE = "snap.glauth.daemon.service"
+DROPIN_PATH = pathlib.Path(f"/etc/systemd/system/{SERVICE}.d/50-charm-tuning.conf")
+METRICS_PATH = "/metrics"
+KEY_ALGORITHMS = ("ecdsa-p256", "ed25519", "rsa-2048", "rsa-3072", "rsa-4096")
+# Tables GLAuth reloads from its config files while running, when watching them
+RELOADED_TABLES = ("users", "groups")
+
+
+class GlauthError(Exception):
+    """Raised when an operation on the GLAuth workload fails."""
+
+    @property
+    def message(self) -> str:
+        """Return the message passed as the first argument."""
+        return self.args[0]
+
+
+class _SnapState:
+    """Hook-scoped memo of the glauth snap.
+
+    Building a `snap.SnapCache` lists every installed snap over the snapd API and reads
+    the snapd names cache, so it is loaded at most once per hook and only reloaded after
+    an operation which changes the state of the snap.
+    """
+
+    def __init__(self) -> None:
+        self._snap: Optional[snap.Snap] = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self) -> snap.Snap:
+        """Return the glauth snap, loading it from snapd if not cached."""
+        if self._snap is None:
+            self.misses += 1
+            self._snap = snap.SnapCache()["glauth"]
+        else:
+            self.hits += 1
+        return self._snap
+
+    def invalidate(self) -> None:
+        """Drop the cached snap so the next lookup reloads it from snapd."""
+        self._snap = None
+
+
+_state = _SnapState()
+# Templates are compiled once per hook and served from the environment's cache afterwards
+_templates = Environment(loader=FileSystemLoader("templates"), auto_reload=False)
+
 
-def _snap():
-    cache = snap.SnapCache()
-    return cache["glauth"]
+def _snap() -> snap.Snap:
+    return _state.get()
+
+
+def cache_stats() -> Dict[str, int]:
+    """Return hit and miss counts of the snap state cache for this hook."""
+    return {"hits": _state.hits, "misses": _state.misses}
 
 
 def active() -> bool:
@@ -25,12 +121,30 @@ def active() -> bool:
     return bool(_snap().services["daemon"]["active"])
 
 
-def create_default_config(api_port: int) -> None:
-    """Create default config with no users."""
-    template = Template(pathlib.Path("templates/glauth.toml.j2").read_text())
+def create_default_config(api_port: int, **settings) -> bool:
+    """Create default config with no users.
 
-    rendered = template.render(api_port=api_port, ldap_port=363)
-    pathlib.Path("/var/snap/glauth/common/etc/glauth/glauth.d/glauth.cfg").write_text(rendered)
+    The config file is left untouched if it already holds the rendered content, so GLAuth
+    does not reload an identical config.
+
+    Args:
+        api_port: Port of the GLAuth API listener.
+        settings: Server settings overriding DEFAULT_SETTINGS.
+
+    Returns:
+        bool: True if the config file was written.
+    """
+    context = {**DEFAULT_SETTINGS, **settings}
+    rendered = _templates.get_template("glauth.toml.j2").render(
+        api_port=api_port, database=DATABASE_PATH, sqlite_plugin=SQLITE_PLUGIN, **context
+    )
+    if CONFIG_PATH.is_file() and CONFIG_PATH.read_text() == rendered:
+        logger.debug("default config unchanged")
+        return False
+    tmp = CONFIG_PATH.with_name(f".{CONFIG_PATH.name}.tmp")
+    tmp.write_text(rendered)
+    os.replace(tmp, CONFIG_PATH)
+    return True
 
 
 def install() -> None:
@@ -38,6 +152,7 @@ def install() -> None:
     try:
         # Change to stable once stable is released
         _snap().ensure(snap.SnapState.Latest, channel="edge")
+        _state.invalidate()
         snap.hold_refresh()
     except snap.SnapError as e:
         logger.error("could not install glauth. Reason: %s", e.message)
@@ -50,38 +165,200 @@ def installed() -> bool:
     return _snap().present
 
 
-def load() -> str:
+def _private_key(algorithm: str):
+    if algorithm == "ecdsa-p256":
+        return ec.generate_private_key(ec.SECP256R1())
+    if algorithm == "ed25519":
+        return ed25519.Ed25519PrivateKey.generate()
+    if algorithm in KEY_ALGORITHMS and algorithm.startswith("rsa-"):
+        return rsa.generate_private_key(public_exponent=65537, key_size=int(algorithm[4:]))
+    raise GlauthError(f"unsupported tls key algorithm {algorithm}")
+
+
+def _write_key_pair(cert_path: pathlib.Path, key_path: pathlib.Path, cert, key) -> None:
+    try:
+        key_path.parent.mkdir(parents=True, exist_ok=True)
+        cert_path.parent.mkdir(parents=True, exist_ok=True)
+        key_path.touch(mode=0o600)
+        key_path.write_bytes(
+            key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+        )
+        cert_path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    except OSError as e:
+        raise GlauthError(f"could not write glauth certificate: {e}")
+
+
+def _signature_hash(key) -> Optional[hashes.HashAlgorithm]:
+    # Ed25519 signatures carry their own digest
+    return None if isinstance(key, ed25519.Ed25519PrivateKey) else hashes.SHA256()
+
+
+def generate_certificate(algorithm: str = "ecdsa-p256") -> Optional[float]:
+    """Generate a self-signed CA certificate and key for GLAuth if they do not exist.
+
+    Args:
+        algorithm: Key algorithm, one of KEY_ALGORITHMS.
+
+    Returns:
+        Optional[float]: Seconds spent generating, or None if a certificate already exists.
+    """
+    if CA_CERT_PATH.exists() or CA_KEY_PATH.exists():
+        return None
+    start = time.perf_counter()
+    key = _private_key(algorithm)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, socket.gethostname())])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=365))
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .add_extension(x509.SubjectKeyIdentifier.from_public_key(key.public_key()), critical=False)
+        .sign(key, _signature_hash(key))
+    )
+    _write_key_pair(CA_CERT_PATH, CA_KEY_PATH, cert, key)
+    elapsed = time.perf_counter() - start
+    logger.info("generated %s key and certificate in %.3fs", algorithm, elapsed)
+    return elapsed
+
+
+def _subject_alt_names(names: Iterable[str]) -> List[x509.GeneralName]:
+    alt_names = []
+    for name in sorted(set(names)):
+        try:
+            alt_names.append(x509.IPAddress(ipaddress.ip_address(name)))
+        except ValueError:
+            alt_names.append(x509.DNSName(name))
+    return alt_names
+
+
+def _issued_by(ca_cert: x509.Certificate, alt_names: List[x509.GeneralName]) -> bool:
+    """Return whether the served certificate was issued by the CA for exactly these names."""
+    try:
+        cert = x509.load_pem_x509_certificate(CERT_PATH.read_bytes())
+        cert.verify_directly_issued_by(ca_cert)
+        issued = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+    except (OSError, ValueError, TypeError, InvalidSignature, x509.ExtensionNotFound):
+        return False
+    return sorted(issued, key=str) == sorted(alt_names, key=str)
+
+
+def issue_certificate(names: Iterable[str], algorithm: str = "ecdsa-p256") -> bool:
+    """Issue the certificate this unit serves, signed by the shared CA.
+
+    Clients trust the CA, so every unit presents a certificate valid for its own hostname
+    and addresses. The certificate is only reissued if the CA or the names changed.
+
+    Args:
+        names: Hostnames and IP addresses clients reach this unit on.
+        algorithm: Key algorithm of the certificate, one of KEY_ALGORITHMS.
+
+    Returns:
+        bool: True if a certificate was issued.
+    """
+    try:
+        ca_cert = x509.load_pem_x509_certificate(CA_CERT_PATH.read_bytes())
+        ca_key = serialization.load_pem_private_key(CA_KEY_PATH.read_bytes(), password=None)
+    except (OSError, ValueError) as e:
+        raise GlauthError(f"could not read glauth CA: {e}")
+    alt_names = _subject_alt_names(names)
+    if _issued_by(ca_cert, alt_names):
+        return False
+    key = _private_key(algorithm)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, socket.gethostname())]))
+        .issuer_name(ca_cert.subject)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(ca_cert.not_valid_after_utc)
+        .add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=True)
+        .add_extension(x509.SubjectAlternativeName(alt_names), critical=False)
+        .add_extension(
+            x509.AuthorityKeyIdentifier.from_issuer_public_key(ca_key.public_key()),
+            critical=False,
+        )
+        .sign(ca_key, _signature_hash(ca_key))
+    )
+    _write_key_pair(CERT_PATH, KEY_PATH, cert, key)
+    logger.info("issued certificate for %s", ", ".join(str(n.value) for n in alt_names))
+    return True
+
+
+def key_material(algorithm: str = "ecdsa-p256") -> Dict[str, str]:
+    """Return the CA certificate and private key of GLAuth, generating them if needed.
+
+    Args:
+        algorithm: Key algorithm to use if the certificate has not been generated yet.
+
+    Returns:
+        Dict[str, str]: PEM certificate and private key, as "certificate" and "private-key".
+    """
+    generate_certificate(algorithm)
+    try:
+        return {"certificate": CA_CERT_PATH.read_text(), "private-key": CA_KEY_PATH.read_text()}
+    except OSError as e:
+        raise GlauthError(f"could not read glauth key material: {e}")
+
+
+def install_key_material(certificate: str, private_key: str) -> bool:
+    """Install a CA certificate and private key generated elsewhere, such as on the leader.
+
+    Args:
+        certificate: PEM certificate.
+        private_key: PEM private key.
+
+    Returns:
+        bool: True if either file was changed.
+    """
+    try:
+        if (
+            CA_CERT_PATH.exists()
+            and CA_KEY_PATH.exists()
+            and CA_CERT_PATH.read_text() == certificate
+            and CA_KEY_PATH.read_text() == private_key
+        ):
+            return False
+        for path, content, mode in (
+            (CA_KEY_PATH, private_key, 0o600),
+            (CA_CERT_PATH, certificate, 0o644),
+        ):
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f".{path.name}.tmp")
+            tmp.unlink(missing_ok=True)
+            tmp.touch(mode=mode)
+            tmp.write_text(content)
+            os.replace(tmp, path)
+    except OSError as e:
+        raise GlauthError(f"could not write glauth key material: {e}")
+    logger.info("installed shared key material")
+    return True
+
+
+def load(algorithm: str = "ecdsa-p256") -> str:
     """Load ca-certificate from glauth snap.
 
+    Args:
+        algorithm: Key algorithm to use if the certificate has not been generated yet.
+
     Returns:
         str: The ca certificate content.
     """
-    cert = "/var/snap/glauth/common/etc/glauth/certs.d/glauth.crt"
-    key = "/var/snap/glauth/common/etc/glauth/keys.d/glauth.key"
-    if not pathlib.Path(cert).exists() and not pathlib.Path(key).exists():
-        # If cert and key do not exist, create both
-        subprocess.call(
-            [
-                "openssl",
-                "req",
-                "-x509",
-                "-newkey",
-                "rsa:4096",
-                "-keyout",
-                f"{key}",
-                "-out",
-                f"{cert}",
-                "-days",
-                "365",
-                "-nodes",
-                "-subj",
-                f"/CN={socket.gethostname()}",
-            ],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.STDOUT,
-        )
-    content = open(cert, "r").read()
-    return content
+    generate_certificate(algorithm)
+    try:
+        return CA_CERT_PATH.read_text()
+    except OSError as e:
+        raise GlauthError(f"could not read glauth certificate: {e}")
 
 
 def refresh() -> None:
@@ -90,23 +367,210 @@ def refresh() -> None:
     install()
 
 
+def write_tuning(max_open_files: int, gomaxprocs: int = 0, gogc: int = 100) -> bool:
+    """Write the systemd drop-in setting the limits and Go runtime of the GLAuth service.
+
+    The drop-in is only written, and systemd reloaded, if its content changed. It applies
+    once GLAuth is next started.
+
+    Args:
+        max_open_files: Open file limit of the daemon, bounding its client connections.
+        gomaxprocs: Threads running Go code at once, 0 to use every CPU.
+        gogc: Heap growth, in percent, which triggers a garbage collection.
+
+    Returns:
+        bool: True if the drop-in was written.
+    """
+    lines = ["# Managed by the glauth charm.", "[Service]", f"LimitNOFILE={max_open_files}"]
+    if gomaxprocs:
+        lines.append(f"Environment=GOMAXPROCS={gomaxprocs}")
+    lines.append(f"Environment=GOGC={gogc}")
+    content = "\n".join(lines) + "\n"
+    try:
+        if DROPIN_PATH.is_file() and DROPIN_PATH.read_text() == content:
+            return False
+        DROPIN_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp = DROPIN_PATH.with_name(f".{DROPIN_PATH.name}.tmp")
+        tmp.write_text(content)
+        os.replace(tmp, DROPIN_PATH)
+        subprocess.check_call(["systemctl", "daemon-reload"])
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise GlauthError(f"could not apply glauth service tuning: {e}")
+    logger.info("wrote %s", DROPIN_PATH)
+    return True
+
+
+def remove_tuning() -> bool:
+    """Remove the systemd drop-in tuning the GLAuth service, and reload systemd.
+
+    Returns:
+        bool: True if the drop-in was removed.
+    """
+    try:
+        DROPIN_PATH.unlink()
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        raise GlauthError(f"could not remove glauth service tuning: {e}")
+    try:
+        # The drop-in directory is only there for the charm's drop-in
+        DROPIN_PATH.parent.rmdir()
+    except OSError:
+        pass
+    try:
+        subprocess.check_call(["systemctl", "daemon-reload"])
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise GlauthError(f"could not remove glauth service tuning: {e}")
+    logger.info("removed %s", DROPIN_PATH)
+    return True
+
+
+def effective_tuning() -> Dict[str, str]:
+    """Return the open file limit and Go runtime settings GLAuth runs with.
+
+    They are read from the running daemon's process, or else from the systemd unit it would
+    be started with. Unset Go settings are empty.
+
+    Returns:
+        Dict[str, str]: "max-open-files", "gomaxprocs" and "gogc", and their "source",
+            either "process" or "unit".
+    """
+    try:
+        output = subprocess.check_output(
+            ["systemctl", "show", SERVICE, "--property=MainPID,LimitNOFILE,Environment"],
+            text=True,
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise GlauthError(f"could not read glauth service tuning: {e}")
+    unit = dict(line.partition("=")[::2] for line in output.splitlines())
+    environment = unit.get("Environment", "").split()
+    limit = unit.get("LimitNOFILE", "")
+    source = "unit"
+    pid = unit.get("MainPID", "0")
+    if pid.isdigit() and int(pid):
+        try:
+            with open(f"/proc/{pid}/limits") as f:
+                limit = next(line.split()[3] for line in f if line.startswith("Max open files"))
+            with open(f"/proc/{pid}/environ", "rb") as f:
+                environment = f.read().decode(errors="replace").split("\0")
+            source = "process"
+        except (OSError, StopIteration, IndexError) as e:
+            logger.debug("could not read tuning of glauth process %s: %s", pid, e)
+    variables = dict(item.partition("=")[::2] for item in environment)
+    return {
+        "max-open-files": limit,
+        "gomaxprocs": variables.get("GOMAXPROCS", ""),
+        "gogc": variables.get("GOGC", ""),
+        "source": source,
+    }
+
+
+def _startup_lines(text: str) -> Iterator[Tuple[Optional[str], str]]:
+    """Yield the lines of a config file GLAuth only reads at startup, with their table."""
+    table = None
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("["):
+            table = stripped.strip("[] \t").split(".")[0].strip().lower()
+        if table not in RELOADED_TABLES:
+            yield table, stripped
+
+
+def config_digests() -> Dict[str, str]:
+    """Return digests of the config GLAuth would load if it started now.
+
+    The startup digest covers what GLAuth only reads when it starts: the config outside of
+    its users and groups, the TLS key material, the service tuning and which database file
+    it opens. The config digest covers the config files in full. Unless the config sets
+    `watchconfig`, GLAuth reloads nothing, so both are startup digests.
+
+    Returns:
+        Dict[str, str]: Digests as "startup" and "config".
+    """
+    startup = hashlib.sha256()
+    full = hashlib.sha256()
+    watched = False
+    database = False
+    try:
+        for path in sorted(CONFIG_PATH.parent.glob("*")):
+            if path.name.startswith(".") or not path.name.endswith(glauth_config.CONFIG_SUFFIXES):
+                continue
+            text = path.read_text()
+            full.update(f"{path.name}\0{text}\0".encode())
+            startup.update(f"{path.name}\0".encode())
+            for table, line in _startup_lines(text):
+                startup.update(f"{line}\n".encode())
+                key, _, value = line.partition("=")
+                if table is None and key.strip().lower() == "watchconfig":
+                    watched = value.strip() == "true"
+                database = database or str(DATABASE_PATH) in line
+        for path in (CERT_PATH, KEY_PATH, DROPIN_PATH):
+            if path.exists():
+                startup.update(path.read_bytes())
+        # The database is changed in place while served, but a new file needs a restart
+        if database and DATABASE_PATH.exists():
+            startup.update(str(DATABASE_PATH.stat().st_ino).encode())
+    except OSError as e:
+        raise GlauthError(f"could not read glauth config: {e}")
+    if not watched:
+        startup.update(full.digest())
+    return {"startup": startup.hexdigest(), "config": full.hexdigest()}
+
+
+def serve(
+    served: Optional[Dict[str, str]], allow_start: bool = False
+) -> Tuple[str, Dict[str, str]]:
+    """Make GLAuth serve the config on disk, restarting it only if it has to.
+
+    GLAuth is restarted if its startup config changed, or if what it serves is not known.
+    If only users and groups changed, GLAuth reloads them itself from its watched config.
+    A running GLAuth which may be started is taken to serve the config on disk if what it
+    serves is not known, as it was started before its config was tracked.
+
+    Args:
+        served: Digests GLAuth was last started or reloaded with, see `config_digests`.
+        allow_start: Start GLAuth if it is not running, otherwise it is left stopped.
+
+    Returns:
+        Tuple[str, Dict[str, str]]: One of "started", "stopped", "restarted", "reloaded" or
+            "unchanged", and the digests GLAuth now serves.
+    """
+    desired = config_digests()
+    if not active():
+        if not allow_start:
+            return "stopped", served or {}
+        start()
+        return "started", desired
+    if served == desired or (allow_start and not served):
+        return "unchanged", desired
+    if served and served.get("startup") == desired["startup"]:
+        return "reloaded", desired
+    restart()
+    return "restarted", desired
+
+
+def restart() -> None:
+    """Restart the glauth snap services."""
+    _snap().restart()
+    _state.invalidate()
+
+
 def remove() -> None:
     """Remove the glauth snap, preserving config and data."""
     _snap().ensure(snap.SnapState.Absent)
+    _state.invalidate()
 
 
 def start() -> None:
     """Start the glauth snap."""
     _snap().start(enable=True)
+    _state.invalidate()
 
 
 def version() -> str:
     """Return GLAuth version."""
-    if _snap().present:
-        # Version separated by newlines includes version, build time and commit hash
-        # split by newlines, grab first line, grab second string for version
-        full_version = subprocess.run(
-            ["snap", "list", "glauth"], stdout=subprocess.PIPE, text=True
-        ).stdout.splitlines()[1]
-        return full_version.split()[2]
+    glauth = _snap()
+    if glauth.present:
+        # The snapd listing loaded into the snap cache already carries the version
+        return glauth.version
     raise snap.SnapError("glauth snap not installed, cannot fetch version")
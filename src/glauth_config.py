@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Validation of GLAuth TOML configuration files before they are applied.
+
+Users and groups from every file are checked together, as GLAuth merges the files of its
+config directory: UID and GID numbers and names must be unique, every group a user or
+group refers to must be defined and password hashes must be well formed.
+
+Config files with large user lists are parsed with a line scanner which understands the
+flat `key = value` layout GLAuth configs use, as general TOML parsers take seconds on tens
+of thousands of users. Files using any other TOML syntax are parsed with `toml`.
+"""
+
+import logging
+import pathlib
+import re
+import time
+from typing import Any, Dict, List, Tuple
+
+import toml
+
+logger = logging.getLogger(__name__)
+
+# Suffixes of the files in a config resource which GLAuth reads as TOML
+CONFIG_SUFFIXES = (".cfg", ".toml")
+# Problems listed in a validation error, the rest are only counted
+MAX_REPORTED = 5
+
+_ARRAY_TABLE = re.compile(r"\[\[\s*([A-Za-z0-9_-]+)\s*\]\]")
+_TABLE = re.compile(r"\[\s*([A-Za-z0-9_-]+)\s*\]")
+_BARE_KEY = re.compile(r"[A-Za-z0-9_-]+")
+_STRING = re.compile(r'"([^"\\]*)"')
+_STRING_ITEMS = re.compile(r'\[\s*(?:"[^"\\]*"\s*,\s*)*(?:"[^"\\]*"\s*,?\s*)?\]')
+_SHA256 = re.compile(r"[0-9a-fA-F]{64}")
+_BCRYPT = re.compile(r"\$2[abxy]?\$[0-9]{2}\$[./A-Za-z0-9]{53}")
+
+
+class ConfigValidationError(Exception):
+    """Raised when GLAuth config files are invalid."""
+
+
+class _UnsupportedError(Exception):
+    """Raised by the line scanner on syntax it does not handle."""
+
+
+def _scan_value(value: str) -> Any:
+    first = value[:1]
+    if first == '"':
+        if len(value) < 2 or value[-1] != '"' or '"' in value[1:-1] or "\\" in value:
+            raise _UnsupportedError(value)
+        return value[1:-1]
+    if first == "[":
+        if value[-1] != "]":
+            raise _UnsupportedError(value)
+        if '"' in value:
+            # Strings may hold commas, so are not split on them
+            if _STRING_ITEMS.fullmatch(value) is None:
+                raise _UnsupportedError(value)
+            return _STRING.findall(value)
+        return [_scan_value(item.strip()) for item in value[1:-1].split(",") if item.strip()]
+    if value in ("true", "false"):
+        return value == "true"
+    if value.isascii() and value.lstrip("+-").isdigit() and value.lstrip("+-")[:1] != "0":
+        return int(value)
+    if value == "0":
+        return 0
+    raise _UnsupportedError(value)
+
+
+def _scan(text: str) -> Dict[str, Any]:
+    """Parse the flat TOML subset of GLAuth configs into the same structure as `toml`."""
+    document: Dict[str, Any] = {}
+    current = document
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line[0] == "#":
+            continue
+        if line[0] == "[":
+            match = _ARRAY_TABLE.fullmatch(line)
+            if match:
+                tables = document.setdefault(match.group(1), [])
+                if not isinstance(tables, list):
+                    raise _UnsupportedError(line)
+                current = {}
+                tables.append(current)
+                continue
+            match = _TABLE.fullmatch(line)
+            if match is None or match.group(1) in document:
+                raise _UnsupportedError(line)
+            current = document[match.group(1)] = {}
+            continue
+        key, _, value = line.partition("=")
+        key, value = key.rstrip(), value.lstrip()
+        # Values with comments are left to the full parser
+        if not _BARE_KEY.fullmatch(key) or "#" in value or key in current:
+            raise _UnsupportedError(line)
+        current[key] = _scan_value(value)
+    return document
+
+
+def parse(path: pathlib.Path, name: str) -> Dict[str, Any]:
+    """Parse a GLAuth TOML config file, reported as name.
+
+    Raises:
+        ConfigValidationError: If the file is not valid TOML.
+    """
+    text = path.read_text()
+    try:
+        return _scan(text)
+    except _UnsupportedError:
+        pass
+    try:
+        return toml.loads(text)
+    except toml.TomlDecodeError as e:
+        raise ConfigValidationError(f"{name} is not valid TOML: {e}") from e
+    except AttributeError as e:
+        # toml fails this way on a key or table redefined as an array of tables
+        raise ConfigValidationError(
+            f"{name} is not valid TOML: a key is redefined as an array of tables"
+        ) from e
+
+
+def entries(document: Dict[str, Any], table: str, name: str) -> List[Dict[str, Any]]:
+    """Return the entries of an array of tables with lower-cased keys, as GLAuth reads them."""
+    entries = document.get(table, [])
+    if not isinstance(entries, list) or not all(isinstance(e, dict) for e in entries):
+        raise ConfigValidationError(f"{name}: {table} must be an array of tables")
+    return [{key.lower(): value for key, value in entry.items()} for entry in entries]
+
+
+def _label(kind: str, entry: Dict[str, Any], name: str) -> str:
+    return f"{kind} {entry.get('name', '?')} in {name}"
+
+
+def _check_hashes(user: Dict[str, Any], name: str, problems: List[str]) -> None:
+    hashes = [("passsha256", user.get("passsha256"), _SHA256, False)]
+    hashes.append(("passbcrypt", user.get("passbcrypt"), _BCRYPT, True))
+    for key, pattern, hex_encoded in (
+        ("passappsha256", _SHA256, False),
+        ("passappbcrypt", _BCRYPT, True),
+    ):
+        values = user.get(key, [])
+        hashes += [(key, value, pattern, hex_encoded) for value in values]
+    for key, value, pattern, hex_encoded in hashes:
+        if value is None:
+            continue
+        try:
+            # GLAuth takes bcrypt hashes hex encoded
+            decoded = bytes.fromhex(value).decode() if hex_encoded else value
+        except (TypeError, ValueError):
+            decoded = None
+        if not isinstance(decoded, str) or not pattern.fullmatch(decoded):
+            problems.append(f"{_label('user', user, name)} has a malformed {key}")
+
+
+def _check_refs(
+    kind: str, entry: Dict[str, Any], name: str, key: str, gids: set, problems: List[str]
+) -> None:
+    refs = entry.get(key, [])
+    for gid in refs if isinstance(refs, list) else [refs]:
+        if gid not in gids:
+            problems.append(f"{_label(kind, entry, name)} {key} refers to undefined group {gid}")
+
+
+def check(users: List[Tuple[str, Dict[str, Any]]], groups: List[Tuple[str, Dict[str, Any]]]):
+    """Check users and groups loaded together, each given with the name of its source.
+
+    Entries must have lower-cased keys, as GLAuth matches them case-insensitively.
+
+    Raises:
+        ConfigValidationError: Listing the first problems found, if any.
+    """
+    problems: List[str] = []
+    seen: Dict[tuple, tuple] = {}
+    for kind, entries, number in (("group", groups, "gidnumber"), ("user", users, "uidnumber")):
+        for name, entry in entries:
+            if not isinstance(entry.get(number), int) or not entry.get("name"):
+                problems.append(
+                    f"{_label(kind, entry, name)} must have a name and an integer {number}"
+                )
+                continue
+            for key in ((kind, "name", entry["name"]), (kind, number, entry[number])):
+                if key in seen:
+                    problems.append(
+                        f"{_label(kind, entry, name)} duplicates the {key[1]} of "
+                        f"{_label(kind, seen[key][1], seen[key][0])}"
+                    )
+                else:
+                    seen[key] = (name, entry)
+    gids = {entry.get("gidnumber") for _, entry in groups}
+    for name, group in groups:
+        _check_refs("group", group, name, "includegroups", gids, problems)
+    for name, user in users:
+        _check_refs("user", user, name, "primarygroup", gids, problems)
+        _check_refs("user", user, name, "othergroups", gids, problems)
+        _check_hashes(user, name, problems)
+    if problems:
+        listed = "; ".join(problems[:MAX_REPORTED])
+        more = len(problems) - MAX_REPORTED
+        raise ConfigValidationError(listed + (f"; and {more} more problems" if more > 0 else ""))
+
+
+def validate(files: Dict[str, pathlib.Path]) -> Dict[str, int]:
+    """Check the users and groups defined across GLAuth config files.
+
+    Args:
+        files: Config files GLAuth would load together, by the name to report them under.
+
+    Returns:
+        Dict[str, int]: Number of files, users and groups checked.
+
+    Raises:
+        ConfigValidationError: Listing the first problems found, if any.
+    """
+    start = time.perf_counter()
+    users: List[Tuple[str, Dict[str, Any]]] = []
+    groups: List[Tuple[str, Dict[str, Any]]] = []
+    for name, path in files.items():
+        document = parse(path, name)
+        users += [(name, user) for user in entries(document, "users", name)]
+        groups += [(name, group) for group in entries(document, "groups", name)]
+    check(users, groups)
+    logger.info(
+        "validated %d config files, %d users and %d groups in %.3fs",
+        len(files),
+        len(users),
+        len(groups),
+        time.perf_counter() - start,
+    )
+    return {"files": len(files), "users": len(users), "groups": len(groups)}
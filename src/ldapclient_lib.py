@@ -24,10 +24,18 @@ This library contains the Provides and Requires classes for handling the ldap-cl
 
 """
 
+import hashlib
+import json
 import logging
+import os
 import pathlib
 import socket
+import tempfile
+import time
 import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 
 from ops.charm import (
     CharmBase,
@@ -35,12 +43,63 @@ from ops.charm import (
     RelationBrokenEvent,
     RelationChangedEvent,
     RelationJoinedEvent,
+    SecretChangedEvent,
 )
-from ops.framework import EventBase, EventSource, Handle, Object
-from ops.model import ActiveStatus, MaintenanceStatus, ModelError
+from ops.framework import EventBase, EventSource, Handle, Object, StoredState
+from ops.model import (
+    ActiveStatus,
+    BlockedStatus,
+    MaintenanceStatus,
+    ModelError,
+    Relation,
+    Secret,
+    WaitingStatus,
+)
+
+try:
+    from timing import timed
+except ImportError:
+    # Handler timing spans come from the glauth charm, charms copying this library run
+    # without them
+    def timed(handler):
+        """Return the handler unchanged."""
+        return handler
+
 
 logger = logging.getLogger(__name__)
 
+GLAUTH_CONFIG_DIR = pathlib.Path("/var/snap/glauth/common/etc/glauth/glauth.d")
+CHUNK_SIZE = 1024 * 1024
+# Upper bounds on the uncompressed size of the config resource
+MAX_MEMBER_SIZE = 256 * 1024 * 1024
+MAX_TOTAL_SIZE = 1024 * 1024 * 1024
+# Labels of the secrets shared with clients, also their keys in peer and relation data
+SECRET_LABELS = ("ca-cert", "ldap-default-bind-dn", "ldap-password")
+# Peer relation carrying the secret IDs, the applied config digest and unit endpoints
+PEER_RELATION_NAME = "glauth"
+
+
+class ConfigResourceError(Exception):
+    """Raised when the config resource cannot be applied."""
+
+
+def _file_digest(path: pathlib.Path) -> str:
+    """Return the sha256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _file_crc(path: pathlib.Path) -> int:
+    """Return the CRC-32 of a file, as stored for zip members."""
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
 
 class CertificateAvailableEvent(EventBase):
     """Charm Event triggered when a CA certificate is available."""
@@ -78,12 +137,15 @@ class ConfigDataAvailableEvent(EventBase):
         ldap_uri: str,
         ldbd_content: str,
         lp_content: str,
+        ldap_uris: Optional[List[Dict[str, Any]]] = None,
     ):
         super().__init__(handle)
         self.basedn = basedn
         self.ldap_uri = ldap_uri
         self.ldbd_content = ldbd_content
         self.lp_content = lp_content
+        # Server URIs in failover order, each with a "uri" and an integer "weight"
+        self.ldap_uris = ldap_uris or []
 
     def snapshot(self) -> dict:
         """Return snapshot."""
@@ -92,6 +154,7 @@ class ConfigDataAvailableEvent(EventBase):
             "ldap_uri": self.ldap_uri,
             "ldbd_content": self.ldbd_content,
             "lp_content": self.lp_content,
+            "ldap_uris": self.ldap_uris,
         }
 
     def restore(self, snapshot: dict):
@@ -100,6 +163,7 @@ class ConfigDataAvailableEvent(EventBase):
         self.ldap_uri = snapshot["ldap_uri"]
         self.ldbd_content = snapshot["ldbd_content"]
         self.lp_content = snapshot["lp_content"]
+        self.ldap_uris = snapshot.get("ldap_uris", [])
 
 
 class ConfigDataUnavailableEvent(EventBase):
@@ -151,10 +215,43 @@ class LdapClientRequirerCharmEvents(CharmEvents):
     ldap_ready = EventSource(LdapReadyEvent)
 
 
+class _SecretRegistry:
+    """Resolve the confidential secrets once and share the handles across relations.
+
+    The secret IDs are read from the peer relation, and each lookup is a hook tool round
+    trip, so handles are kept until the IDs in peer data change.
+    """
+
+    def __init__(self, charm: CharmBase, peer_relation_name: str) -> None:
+        self._charm = charm
+        self._peer_relation_name = peer_relation_name
+        self._ids: Optional[Tuple[str, ...]] = None
+        self._secrets: List[Secret] = []
+
+    def _peer_ids(self) -> Optional[Tuple[str, ...]]:
+        peer = self._charm.model.get_relation(self._peer_relation_name)
+        if peer is None:
+            return None
+        data = peer.data[self._charm.app]
+        ids = tuple(data.get(label) for label in SECRET_LABELS)
+        return ids if all(ids) else None
+
+    def secrets(self) -> Optional[List[Secret]]:
+        """Return the secret handles in SECRET_LABELS order, or None if not yet set."""
+        ids = self._peer_ids()
+        if ids is None:
+            return None
+        if ids != self._ids:
+            self._secrets = [self._charm.model.get_secret(id=secret_id) for secret_id in ids]
+            self._ids = ids
+        return self._secrets
+
+
 class LdapClientProvides(Object):
     """Provides-side of the ldapclient integration."""
 
     on = LdapClientProviderCharmEvents()
+    _stored = StoredState()
 
     def __init__(self, charm: CharmBase, integration_name: str) -> None:
         super().__init__(charm, integration_name)
@@ -166,31 +263,78 @@ class LdapClientProvides(Object):
             charm.on[integration_name].relation_joined,
             self._on_relation_joined,
         )
+        for event in (
+            charm.on[PEER_RELATION_NAME].relation_created,
+            charm.on[PEER_RELATION_NAME].relation_changed,
+            charm.on[PEER_RELATION_NAME].relation_departed,
+        ):
+            self.framework.observe(event, self._on_peer_changed)
         self.charm = charm
         self.integration_name = integration_name
+        self._secrets = _SecretRegistry(charm, PEER_RELATION_NAME)
+        self._stored.set_default(config_digest="", config_members=[], reconcile_seconds=0.0)
+
+    @property
+    def config_resource_applied(self) -> bool:
+        """Return whether a config resource has been extracted into the config directory."""
+        return bool(self._stored.config_digest)
 
+    @timed
     def _on_relation_broken(self, event: RelationBrokenEvent) -> None:
         """Handle relation-broken event.
 
         When the ldapclient relation is broken and emits:
         - Server unavailable event: When the ldap server can't be reached.
         """
-        # Remove Obsolete Secrets
-        ca_cert_secret = self.model.get_secret(label="ca-cert")
-        ldbd_secret = self.model.get_secret(label="ldap-default-bind-dn")
-        lp_secret = self.model.get_secret(label="ldap-password")
-        ca_cert_secret.remove_all_revisions()
-        ldbd_secret.remove_all_revisions()
-        lp_secret.remove_all_revisions()
+        # Secrets are shared by every client, only this relation's grants are obsolete
+        if self.charm.unit.is_leader():
+            for secret in self._secrets.secrets() or []:
+                secret.revoke(event.relation)
         self.on.server_unavailable.emit()
 
+    @timed
     def _on_relation_joined(self, event: RelationJoinedEvent) -> None:
         """Event emitted when the relation is joined.
 
-        Looks at the relation data and config values and emits:
+        Reconciles the server and publishes to the joined relation, see `reconcile`.
+        """
+        self.reconcile([event.relation])
+
+    @timed
+    def _on_peer_changed(self, _) -> None:
+        """Publish this unit's endpoint and converge on the leader's config.
+
+        The leader republishes the server URIs of every relation as units come and go, and
+        other units apply a config resource once the leader has published its digest.
+        """
+        peer = self.model.get_relation(PEER_RELATION_NAME)
+        if peer is None:
+            return
+        data = peer.data[self.charm.unit]
+        changed = {key: value for key, value in self._endpoint().items() if data.get(key) != value}
+        if changed:
+            data.update(changed)
+        if self.model.relations[self.integration_name]:
+            self.reconcile()
+
+    @timed
+    def reconcile(self, relations: Optional[List[Relation]] = None) -> None:
+        """Bring the server and the given ldap-client relations up to date.
+
+        Server-side setup is idempotent, so when many clients join only the first pays for
+        it: an unchanged config resource is not extracted again, an unchanged default config
+        is not rewritten and a running server is only restarted for config it cannot reload.
+        Per relation, the work left is granting the secrets and writing relation data which
+        differs from what is there.
+
+        Emits:
         - config unavailable event: If the config resource is not supplied.
         - ldap ready event: When the necessary ldap components are available.
+
+        Args:
+            relations: Relations to publish to, defaults to every ldap-client relation.
         """
+        start = time.perf_counter()
         self.charm.unit.status = MaintenanceStatus("reconfiguring ldap")
 
         # Check model for GLAuth config resource
@@ -201,38 +345,96 @@ class LdapClientProvides(Object):
             self.on.config_data_unavailable.emit(api_port=self.model.config["api-port"])
             resource_path = None
 
-        # Set config and get LDAP URI
-        ldap_uri = self.set_config(self.model.config["tls"], config=resource_path)
+        # Only the leader decides which config resource is applied, other units converge
+        peer = self.model.get_relation(PEER_RELATION_NAME)
+        is_leader = self.charm.unit.is_leader()
+        digest = _file_digest(pathlib.Path(resource_path)) if resource_path else None
+        if (
+            digest
+            and peer
+            and not is_leader
+            and peer.data[self.charm.app].get("config-digest") != digest
+        ):
+            self.charm.unit.status = WaitingStatus("waiting for leader to apply config resource")
+            return
+
+        # Set config
+        try:
+            if resource_path:
+                self._extract_config(pathlib.Path(resource_path), digest=digest)
+        except ConfigResourceError as e:
+            logger.error("could not apply config resource: %s", e)
+            self.charm.unit.status = BlockedStatus(str(e))
+            return
+        if (
+            digest
+            and peer
+            and is_leader
+            and peer.data[self.charm.app].get("config-digest") != digest
+        ):
+            peer.data[self.charm.app]["config-digest"] = digest
 
         # Get App Peer Secrets
-        ldap_relation = self.model.get_relation(self.charm.app.name)
-        ca_cert = ldap_relation.data[self.charm.app]["ca-cert"]
-        default_bind_dn = ldap_relation.data[self.charm.app]["ldap-default-bind-dn"]
-        ldap_password = ldap_relation.data[self.charm.app]["ldap-password"]
-        cc_secret = self.model.get_secret(id=ca_cert)
-        ldbd_secret = self.model.get_secret(id=default_bind_dn)
-        lp_secret = self.model.get_secret(id=ldap_password)
+        secrets = self._secrets.secrets()
+        if secrets is None:
+            self.charm.unit.status = BlockedStatus("waiting for set-confidential action")
+            return
 
         # Signals ldap is ready to be started
         self.on.ldap_ready.emit()
 
-        # Create Secrets
-        cc_secret.grant(event.relation)
-        ldbd_secret.grant(event.relation)
-        lp_secret.grant(event.relation)
-        event.relation.data[self.charm.app]["ca-cert"] = cc_secret.id
-        event.relation.data[self.charm.app]["ldap-default-bind-dn"] = ldbd_secret.id
-        event.relation.data[self.charm.app]["ldap-password"] = lp_secret.id
-
-        # Configuration data update
-        ldap_relation = self.model.get_relation("ldap-client")
-        ldap_relation.data[self.charm.app].update(
+        # Only the leader may grant secrets and write application data
+        if relations is None:
+            relations = self.model.relations[self.integration_name]
+        if is_leader:
+            tls = self.model.config["tls"]
+            endpoints = self.cluster_endpoints()
+            for relation in relations:
+                # Rotate the failover order per relation, so clients prefer different units
+                offset = relation.id % len(endpoints)
+                ordered = endpoints[offset:] + endpoints[:offset]
+                servers = [
+                    {"uri": self.ldap_uri(tls, e["address"]), "weight": e["weight"]}
+                    for e in ordered
+                ]
+                self._publish(
+                    relation,
+                    secrets,
+                    ",".join(self.ldap_uri(tls, e["hostname"]) for e in ordered),
+                    json.dumps(servers),
+                )
+
+        self._stored.reconcile_seconds = time.perf_counter() - start
+        logger.info(
+            "reconciled ldap server and %d relations in %.3fs",
+            len(relations),
+            self._stored.reconcile_seconds,
+        )
+        self.charm.unit.status = ActiveStatus()
+
+    def _publish(
+        self, relation: Relation, secrets: List[Secret], ldap_uri: str, ldap_uris: str
+    ) -> None:
+        """Grant the secrets to a relation and write its configuration data.
+
+        A secret ID is written to relation data only once it has been granted, so a relation
+        which already carries the ID is not granted again.
+        """
+        data = relation.data[self.charm.app]
+        for label, secret in zip(SECRET_LABELS, secrets):
+            if data.get(label) != secret.id:
+                secret.grant(relation)
+        desired = {label: secret.id for label, secret in zip(SECRET_LABELS, secrets)}
+        desired.update(
             {
-                "basedn": self.model.config["ldap-search-base"],
+                "basedn": self.model.config.get("ldap-search-base") or "",
                 "ldap-uri": ldap_uri,
+                "ldap-uris": ldap_uris,
             }
         )
-        self.charm.unit.status = ActiveStatus()
+        changed = {key: value for key, value in desired.items() if data.get(key, "") != value}
+        if changed:
+            data.update(changed)
 
     def set_config(self, tls: bool, config: pathlib.Path) -> str:
         """Set GLAuth config resource. Create default if none found.
@@ -246,19 +448,259 @@ class LdapClientProvides(Object):
             str: LDAP URI.
         """
         if config:
-            with zipfile.ZipFile(config, "r") as zip:
-                zip.extractall("/var/snap/glauth/common/etc/glauth/glauth.d/")
+            self._extract_config(pathlib.Path(config))
+        return self.ldap_uri(tls)
+
+    def ldap_uri(self, tls: bool, hostname: Optional[str] = None) -> str:
+        """Return the URI clients reach a GLAuth server on.
+
+        Args:
+            tls: TLS check.
+            hostname: Hostname of the unit, defaults to this one.
+
+        Returns:
+            str: LDAP URI.
+        """
+        hostname = hostname or socket.gethostname()
         if tls:
-            ldap_uri = f"ldaps://{socket.gethostname()}:636"
-        else:
-            ldap_uri = f"ldap://{socket.gethostname()}:363"
-        return ldap_uri
+            return f"ldaps://{hostname}:636"
+        return f"ldap://{hostname}:{self.model.config['ldap-port']}"
+
+    def _endpoint(self) -> Dict[str, str]:
+        """Return the hostname, ingress address and weight of this unit.
+
+        The weight is the number of CPUs, a proxy for how much of the load the unit can take.
+        """
+        try:
+            binding = self.model.get_binding(self.integration_name)
+            address = binding.network.ingress_address if binding else None
+        except ModelError as e:
+            logger.debug("no ingress address for %s: %s", self.integration_name, e)
+            address = None
+        hostname = socket.gethostname()
+        return {
+            "hostname": hostname,
+            "address": str(address) if address else hostname,
+            "weight": str(os.cpu_count() or 1),
+        }
+
+    def cluster_endpoints(self) -> List[Dict[str, Any]]:
+        """Return the endpoint of every unit which has published one, this one first.
+
+        Returns:
+            List[Dict[str, Any]]: Hostname, address and integer weight of each unit, the
+                other units in unit name order.
+        """
+        peer = self.model.get_relation(PEER_RELATION_NAME)
+        own = peer.data[self.charm.unit] if peer else {}
+        endpoints = [own if own.get("hostname") else self._endpoint()]
+        if peer is not None:
+            for unit in sorted(peer.units, key=lambda unit: unit.name):
+                if peer.data[unit].get("hostname"):
+                    endpoints.append(peer.data[unit])
+        return [
+            {
+                "hostname": e["hostname"],
+                "address": e.get("address") or e["hostname"],
+                "weight": int(e.get("weight") or 1),
+            }
+            for e in endpoints
+        ]
+
+    def bind_credentials(self) -> Optional[Tuple[str, str]]:
+        """Return the default bind DN and password, or None if not yet set."""
+        secrets = self._secrets.secrets()
+        if secrets is None:
+            return None
+        _, ldbd_secret, lp_secret = secrets
+        return (
+            ldbd_secret.get_content()["ldap-default-bind-dn"],
+            lp_secret.get_content()["ldap-password"],
+        )
+
+    def _extract_config(self, config: pathlib.Path, digest: Optional[str] = None) -> bool:
+        """Extract the config resource into the GLAuth config directory.
+
+        Extraction is skipped if the resource digest matches the last one applied. Otherwise
+        only members whose CRC differs from the file on disk are written, and files from the
+        previously applied resource which are no longer in it are removed.
+
+        Changed members are streamed into temporary files next to their destination and only
+        renamed into place once every member has been written and the TOML config files
+        pass validation, so GLAuth never reads a partially written or invalid config.
+
+        Args:
+            config: Resource config Path object.
+            digest: Digest of the resource, if already computed.
+
+        Returns:
+            bool: True if any file under the config directory was changed.
+
+        Raises:
+            ConfigResourceError: If a member is unsafe, the resource exceeds the size limits or
+                its config is invalid.
+        """
+        # Validation is specific to the GLAuth provider, requirers never load it
+        import glauth_config
+
+        digest = digest or _file_digest(config)
+        applied = list(self._stored.config_members)
+        if digest == self._stored.config_digest and all(
+            (GLAUTH_CONFIG_DIR / name).exists() for name in applied
+        ):
+            logger.debug("config resource %s already applied", digest)
+            return False
+
+        start = time.perf_counter()
+        staged: List[Tuple[str, pathlib.Path]] = []
+        try:
+            with zipfile.ZipFile(config, "r") as zip:
+                members = [member for member in zip.infolist() if not member.is_dir()]
+                _check_members(members)
+                budget = MAX_TOTAL_SIZE
+                for member in members:
+                    target = GLAUTH_CONFIG_DIR / member.filename
+                    if target.is_file() and _file_crc(target) == member.CRC:
+                        continue
+                    tmp = _stream_member(zip, member, target, min(MAX_MEMBER_SIZE, budget))
+                    staged.append((member.filename, tmp))
+                    budget -= tmp.stat().st_size
+            # Check the config as it will be once swapped in, before anything is
+            _validate_members(members, dict(staged), applied)
+        except BaseException as e:
+            for _, tmp in staged:
+                tmp.unlink(missing_ok=True)
+            if isinstance(e, (zipfile.BadZipFile, OSError)):
+                raise ConfigResourceError(f"could not extract config resource: {e}") from e
+            if isinstance(e, glauth_config.ConfigValidationError):
+                raise ConfigResourceError(f"invalid config resource: {e}") from e
+            raise
+
+        size = 0
+        for name, tmp in staged:
+            size += tmp.stat().st_size
+            os.replace(tmp, GLAUTH_CONFIG_DIR / name)
+        names = sorted(member.filename for member in members)
+        stale = set(applied) - set(names)
+        for name in stale:
+            (GLAUTH_CONFIG_DIR / name).unlink(missing_ok=True)
+
+        self._stored.config_digest = digest
+        self._stored.config_members = names
+        elapsed = time.perf_counter() - start
+        logger.info(
+            "applied config resource %s: %d written (%d bytes, %.1f MiB/s), %d unchanged, "
+            "%d removed",
+            digest,
+            len(staged),
+            size,
+            size / (1024 * 1024) / max(elapsed, 1e-6),
+            len(names) - len(staged),
+            len(stale),
+        )
+        return bool(staged or stale)
+
+
+def _check_members(members: List[zipfile.ZipInfo]) -> None:
+    """Check member names and declared sizes before anything is extracted."""
+    for member in members:
+        path = pathlib.PurePosixPath(member.filename)
+        if path.is_absolute() or ".." in path.parts:
+            raise ConfigResourceError(f"config resource member {member.filename} is unsafe")
+        if member.file_size > MAX_MEMBER_SIZE:
+            raise ConfigResourceError(
+                f"config resource member {member.filename} exceeds {MAX_MEMBER_SIZE} bytes"
+            )
+    if sum(member.file_size for member in members) > MAX_TOTAL_SIZE:
+        raise ConfigResourceError(f"config resource exceeds {MAX_TOTAL_SIZE} bytes")
+
+
+def _validate_members(
+    members: List[zipfile.ZipInfo], staged: Dict[str, pathlib.Path], applied: List[str]
+) -> Dict[str, int]:
+    """Validate the TOML config files of a resource, staged ones in place of those on disk.
+
+    Config files of the directory which are not part of a resource, such as the users file
+    managed by the charm, are loaded by GLAuth alongside it, so are validated with it.
+
+    Raises:
+        ConfigValidationError: If the config files are invalid.
+    """
+    import glauth_config
+
+    files = {
+        path.name: path
+        for path in sorted(GLAUTH_CONFIG_DIR.glob("*"))
+        if path.name.endswith(glauth_config.CONFIG_SUFFIXES)
+        and not path.name.startswith(".")
+        and path.name not in applied
+    }
+    files.update(
+        {
+            member.filename: staged.get(member.filename, GLAUTH_CONFIG_DIR / member.filename)
+            for member in members
+            if member.filename.endswith(glauth_config.CONFIG_SUFFIXES)
+        }
+    )
+    summary = glauth_config.validate(files)
+    logger.info("config resource summary: %s", summary)
+    return summary
+
+
+def _stream_member(
+    zip: zipfile.ZipFile, member: zipfile.ZipInfo, target: pathlib.Path, limit: int
+) -> pathlib.Path:
+    """Stream a zip member into a temporary file next to its target.
+
+    The declared size of a member cannot be trusted, so the limit is enforced on the bytes
+    actually decompressed.
+
+    Returns:
+        pathlib.Path: The temporary file, to be renamed onto the target.
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.")
+    written = 0
+    try:
+        with zip.open(member) as src, os.fdopen(fd, "wb") as dst:
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                written += len(chunk)
+                if written > limit:
+                    raise ConfigResourceError(
+                        f"config resource member {member.filename} exceeds size limit"
+                    )
+                dst.write(chunk)
+        os.chmod(tmp, 0o644)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return pathlib.Path(tmp)
+
+
+def _parse_ldap_uris(data, ldap_uri: str) -> List[Dict[str, Any]]:
+    """Return the server URIs and weights published by the provider.
+
+    Providers which only publish `ldap-uri` get every URI in it with a weight of 1.
+    """
+    try:
+        servers = json.loads(data.get("ldap-uris") or "[]")
+        servers = [{"uri": s["uri"], "weight": int(s.get("weight", 1))} for s in servers]
+    except (ValueError, TypeError, KeyError):
+        logger.warning("ignoring malformed ldap-uris: %s", data.get("ldap-uris"))
+        servers = []
+    return servers or [{"uri": uri, "weight": 1} for uri in ldap_uri.split(",") if uri]
+
+
+def _secret_key(secret_id: str) -> str:
+    """Return the part of a secret ID which does not depend on how it is written."""
+    return secret_id.rsplit("/", 1)[-1].rsplit(":", 1)[-1]
 
 
 class LdapClientRequires(Object):
     """Requires-side of the ldapclient integration."""
 
     on = LdapClientRequirerCharmEvents()
+    _stored = StoredState()
 
     def __init__(self, charm: CharmBase, integration_name: str) -> None:
         super().__init__(charm, integration_name)
@@ -270,8 +712,16 @@ class LdapClientRequires(Object):
             charm.on[integration_name].relation_broken,
             self._on_relation_broken,
         )
+        self.framework.observe(charm.on.secret_changed, self._on_secret_changed)
         self.charm = charm
         self.integration_name = integration_name
+        # Digests of what was last delivered per relation, secret content is never stored
+        self._stored.set_default(delivered={}, suppressed_emissions=0)
+
+    @property
+    def suppressed_emissions(self) -> int:
+        """Return how many events were not emitted because their payload was unchanged."""
+        return self._stored.suppressed_emissions
 
     def _on_relation_broken(self, event: RelationBrokenEvent):
         """Handle relation-broken event.
@@ -279,10 +729,77 @@ class LdapClientRequires(Object):
         When the ldapclient relation is broken and emits:
         - Server unavailable event: When the ldap server can't be reached.
         """
+        self._forget([event.relation])
         self.on.server_unavailable.emit()
 
+    def _forget(self, relations: List[Relation]) -> None:
+        """Drop the digests of what was delivered for the relations, so it is emitted again."""
+        suffixes = tuple(f":{relation.id}" for relation in relations)
+        self._stored.delivered = {
+            key: digest
+            for key, digest in self._stored.delivered.items()
+            if not key.endswith(suffixes)
+        }
+
+    def _changed(
+        self, kind: str, relation: Relation, payload: Dict[str, Any], events: int
+    ) -> bool:
+        """Record the digest of a payload and return whether it differs from the last one.
+
+        Args:
+            kind: Kind of payload, delivered separately from other kinds.
+            relation: Relation the payload was published on.
+            payload: Data carried by the events.
+            events: Number of events the payload is delivered with, counted if suppressed.
+        """
+        key = f"{kind}:{relation.id}"
+        digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+        if self._stored.delivered.get(key) == digest:
+            self._stored.suppressed_emissions += events
+            return False
+        self._stored.delivered[key] = digest
+        return True
+
+    def _on_secret_changed(self, event: SecretChangedEvent):
+        """Track the new revision of a provider secret and pass the new content on."""
+        key = _secret_key(event.secret.id or "")
+        relations = [
+            relation
+            for relation in self.model.relations[self.integration_name]
+            if relation.app is not None
+            and key
+            in (_secret_key(relation.data[relation.app].get(label, "")) for label in SECRET_LABELS)
+        ]
+        if not relations:
+            return
+        # Refreshing moves this unit to the new revision, which later lookups then return
+        event.secret.get_content(refresh=True)
+        # Digests only cover secret IDs, which a new revision keeps, so always emit again
+        self._forget(relations)
+        for relation in relations:
+            self._update(relation, relation.app)
+
     def _on_relation_changed(self, event: RelationChangedEvent):
-        """Handle relation-changed event.
+        """Handle relation-changed event, see `_update`."""
+        self._update(event.relation, event.app)
+
+    def _secret_contents(self, secret_ids: List[str]) -> List[Dict[str, str]]:
+        """Return the content of each secret, fetched concurrently.
+
+        Each lookup is a round trip to the controller. `Model.get_secret` only runs the
+        secret-get hook tool and wraps its output, without touching shared model state, so
+        the lookups are safe to run from threads.
+        """
+        with ThreadPoolExecutor(max_workers=len(secret_ids)) as executor:
+            return list(
+                executor.map(
+                    lambda secret_id: dict(self.model.get_secret(id=secret_id).get_content()),
+                    secret_ids,
+                )
+            )
+
+    def _update(self, relation: Relation, app) -> None:
+        """Emit the certificate and configuration published by the provider.
 
         Looks at the relation data and either emits:
         - Certificate available event: When a CA certificate is available.
@@ -290,35 +807,51 @@ class LdapClientRequires(Object):
         - Configuration data available event: When configuration data is available.
         - Configuration data unavailable event: When configuration data is unavailable.
         - Ldap ready event: When cert and config are available.
+
+        Events are not emitted again while their payload is the same as the last one
+        delivered for the relation, see `suppressed_emissions`. Secrets are only fetched if
+        the published data or a secret revision changed since the last delivery.
         """
+        data = relation.data[app]
+        secret_ids = [data.get(label) for label in SECRET_LABELS]
+        if None in secret_ids:
+            logger.debug("sssd-ldap relation-changed secrets not published yet")
+            return
+        published = {
+            key: data.get(key) for key in (*SECRET_LABELS, "basedn", "ldap-uri", "ldap-uris")
+        }
+        if not self._changed("relation", relation, published, events=3):
+            return
         # SSSD Observer retrieves secrets
-        ca_cert = event.relation.data[event.app]["ca-cert"]
-        default_bind_dn = event.relation.data[event.app]["ldap-default-bind-dn"]
-        ldap_password = event.relation.data[event.app]["ldap-password"]
-        cc_secret = self.model.get_secret(id=ca_cert)
-        ldbd_secret = self.model.get_secret(id=default_bind_dn)
-        lp_secret = self.model.get_secret(id=ldap_password)
-        cc_content = cc_secret.get_content()
-        ldbd_content = ldbd_secret.get_content()
-        lp_content = lp_secret.get_content()
-        if None not in [cc_content["ca-cert"]]:
-            self.on.certificate_available.emit(ca_cert=cc_content["ca-cert"])
+        cc_content, ldbd_content, lp_content = self._secret_contents(secret_ids)
+        # Payloads are digested by secret ID rather than content, so no digest of a secret
+        # is stored. A new revision is delivered through secret-changed.
+        if None not in [cc_content.get("ca-cert")]:
+            if self._changed("certificate", relation, {"ca-cert": secret_ids[0]}, events=1):
+                self.on.certificate_available.emit(ca_cert=cc_content["ca-cert"])
         # SSSD Configuration relation data
-        auth_relation = self.model.get_relation("ldap-client")
-        basedn = auth_relation.data[event.app].get("basedn")
-        ldap_uri = auth_relation.data[event.app].get("ldap-uri")
+        basedn = data.get("basedn")
+        ldap_uri = data.get("ldap-uri")
         if None not in [
-            ldbd_content["ldap-default-bind-dn"],
-            lp_content["ldap-password"],
+            ldbd_content.get("ldap-default-bind-dn"),
+            lp_content.get("ldap-password"),
             basedn,
             ldap_uri,
         ]:
-            self.on.config_data_available.emit(
-                basedn=basedn,
-                ldap_uri=ldap_uri,
-                ldbd_content=ldbd_content["ldap-default-bind-dn"],
-                lp_content=lp_content["ldap-password"],
-            )
-            self.on.ldap_ready.emit()
+            config = {
+                "basedn": basedn,
+                "ldap_uri": ldap_uri,
+                "ldbd_content": ldbd_content["ldap-default-bind-dn"],
+                "lp_content": lp_content["ldap-password"],
+                "ldap_uris": _parse_ldap_uris(data, ldap_uri),
+            }
+            # Consumers re-render and restart on these events, so only emit on a real change
+            digested = {
+                key: value for key, value in config.items() if not key.endswith("_content")
+            }
+            digested["secrets"] = secret_ids[1:]
+            if self._changed("config", relation, digested, events=2):
+                self.on.config_data_available.emit(**config)
+                self.on.ldap_ready.emit()
         else:
             logger.error("sssd-ldap relation-changed data not found: ca-cert and sssd-conf.")
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""LDAP load generator used by the benchmark action to size GLAuth units in place."""
+
+import logging
+import ssl
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import ldap3
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS = ("bind", "search", "mixed")
+
+
+def _percentile(samples: List[float], percent: float) -> float:
+    """Return the nearest-rank percentile of sorted samples."""
+    if not samples:
+        return 0.0
+    rank = max(int(round(percent / 100 * len(samples))) - 1, 0)
+    return samples[min(rank, len(samples) - 1)]
+
+
+def _summary(samples: List[float], elapsed: float) -> Dict[str, float]:
+    samples.sort()
+    return {
+        "ops": len(samples),
+        "ops-per-second": round(len(samples) / elapsed, 2),
+        "p50-ms": round(_percentile(samples, 50) * 1000, 3),
+        "p95-ms": round(_percentile(samples, 95) * 1000, 3),
+        "p99-ms": round(_percentile(samples, 99) * 1000, 3),
+    }
+
+
+def connection_factory(uri: str, bind_dn: str, password: str) -> Callable[[], ldap3.Connection]:
+    """Return a factory of unbound connections to an LDAP server.
+
+    Certificates are not verified, the benchmark only targets the local listener.
+    """
+    tls = ldap3.Tls(validate=ssl.CERT_NONE) if uri.startswith("ldaps://") else None
+    server = ldap3.Server(uri, use_ssl=tls is not None, tls=tls, connect_timeout=5)
+
+    def factory() -> ldap3.Connection:
+        return ldap3.Connection(server, user=bind_dn, password=password, receive_timeout=10)
+
+    return factory
+
+
+def _work(
+    factory: Callable[[], ldap3.Connection],
+    base_dn: str,
+    operation: str,
+    search_filter: str,
+    deadline: float,
+) -> Tuple[Dict[str, List[float]], int]:
+    """Run operations on one connection until the deadline.
+
+    Returns:
+        Tuple[Dict[str, List[float]], int]: Latencies of successful operations by kind, and
+            the number of failed operations.
+    """
+    latencies: Dict[str, List[float]] = {"bind": [], "search": []}
+    failures = 0
+    conn: Optional[ldap3.Connection] = None
+    try:
+        conn = factory()
+        if not conn.bind():
+            raise ldap3.core.exceptions.LDAPBindError(conn.result.get("description"))
+        count = 0
+        while time.monotonic() < deadline:
+            op = operation if operation != "mixed" else ("bind", "search")[count % 2]
+            count += 1
+            start = time.perf_counter()
+            if op == "bind":
+                ok = conn.rebind(user=conn.user, password=conn.password)
+            else:
+                ok = conn.search(base_dn, search_filter, ldap3.SUBTREE, attributes=["cn"])
+                # An empty result is not an error
+                ok = ok or conn.result.get("result") == 0
+            if ok:
+                latencies[op].append(time.perf_counter() - start)
+            else:
+                failures += 1
+    except ldap3.core.exceptions.LDAPException as e:
+        logger.debug("benchmark worker failed: %s", e)
+        failures += 1
+    finally:
+        if conn is not None and conn.bound:
+            conn.unbind()
+    return latencies, failures
+
+
+def run(
+    factory: Callable[[], ldap3.Connection],
+    base_dn: str,
+    workers: int = 8,
+    duration: float = 10.0,
+    operation: str = "mixed",
+    search_filter: str = "(objectClass=*)",
+) -> Dict:
+    """Run binds and subtree searches from concurrent workers for a fixed duration.
+
+    Args:
+        factory: Returns a new, unbound connection for each worker.
+        base_dn: Base DN of subtree searches.
+        workers: Number of worker threads, each with its own connection.
+        duration: Seconds to run for.
+        operation: One of OPERATIONS; mixed alternates binds and searches.
+        search_filter: LDAP filter of subtree searches.
+
+    Returns:
+        Dict: Throughput and latency percentiles per operation, and the error count.
+    """
+    if operation not in OPERATIONS:
+        raise ValueError(f"operation must be one of {', '.join(OPERATIONS)}")
+    latencies: Dict[str, List[float]] = {"bind": [], "search": []}
+    errors = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker() -> None:
+        local, failures = _work(factory, base_dn, operation, search_filter, deadline)
+        with lock:
+            for op, samples in local.items():
+                latencies[op].extend(samples)
+            errors.append(failures)
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = max(time.monotonic() - start, 1e-6)
+
+    results = {"errors": sum(errors), "workers": workers, "duration": round(elapsed, 3)}
+    for op, samples in latencies.items():
+        if samples:
+            results[op] = _summary(samples, elapsed)
+    results["total"] = _summary(latencies["bind"] + latencies["search"], elapsed)
+    logger.info("benchmark results: %s", results)
+    return results
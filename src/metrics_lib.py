@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Provides side of the prometheus_scrape interface for the GLAuth metrics listener.
+
+Publishes the scrape job and metadata in application data and each unit's address in unit
+data, in the format expected by Prometheus charms consuming `prometheus_scrape`.
+"""
+
+import json
+import logging
+
+from ops.charm import CharmBase
+from ops.framework import Object
+from timing import timed
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsEndpointProvides(Object):
+    """Publish a GLAuth scrape target to related Prometheus applications."""
+
+    def __init__(self, charm: CharmBase, integration_name: str, metrics_path: str) -> None:
+        super().__init__(charm, integration_name)
+        self.charm = charm
+        self.integration_name = integration_name
+        self.metrics_path = metrics_path
+        for event in (
+            charm.on[integration_name].relation_joined,
+            charm.on.config_changed,
+            charm.on.leader_elected,
+            charm.on.upgrade_charm,
+        ):
+            self.framework.observe(event, self._on_update)
+
+    @timed
+    def _on_update(self, _) -> None:
+        """Publish, or withdraw if metrics are disabled, the scrape target."""
+        self.update()
+
+    def update(self) -> None:
+        """Write scrape jobs and unit addresses to every metrics-endpoint relation."""
+        enabled = self.model.config["metrics"]
+        jobs = []
+        if enabled:
+            jobs = [
+                {
+                    "metrics_path": self.metrics_path,
+                    "static_configs": [{"targets": [f"*:{self.model.config['api-port']}"]}],
+                }
+            ]
+        metadata = {
+            "model": self.model.name,
+            "model_uuid": self.model.uuid,
+            "application": self.charm.app.name,
+            "unit": self.charm.unit.name,
+            "charm_name": self.charm.meta.name,
+        }
+        for relation in self.model.relations[self.integration_name]:
+            binding = self.model.get_binding(relation)
+            address = str(binding.network.ingress_address) if binding else ""
+            relation.data[self.charm.unit].update(
+                {
+                    "prometheus_scrape_unit_address": address,
+                    "prometheus_scrape_unit_name": self.charm.unit.name,
+                }
+            )
+            if self.charm.unit.is_leader():
+                relation.data[self.charm.app].update(
+                    {
+                        "scrape_jobs": json.dumps(jobs),
+                        "scrape_metadata": json.dumps(metadata),
+                    }
+                )
+        logger.debug("published %d scrape jobs", len(jobs))
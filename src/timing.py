@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Timing spans for charm event handlers.
+
+A span records the wall time of a handler along with how many snapd API requests,
+subprocess forks and Juju hook tool calls it made. Calls are counted from Python audit
+events, so neither the snap library nor ops need to be wrapped. Each finished span is
+logged as a JSON line and, if enabled, appended to a rolling summary file.
+"""
+
+import contextlib
+import functools
+import json
+import logging
+import os
+import pathlib
+import sys
+import time
+from typing import Callable, Dict, Iterator, List
+
+from charms.operator_libs_linux.v1 import snap
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PATH = pathlib.Path(".hook-timings.json")
+SUMMARY_SAMPLES = 20
+HOOK_TOOLS = frozenset(
+    {
+        "action-fail",
+        "action-get",
+        "action-log",
+        "action-set",
+        "application-version-set",
+        "close-port",
+        "config-get",
+        "is-leader",
+        "juju-log",
+        "leader-get",
+        "leader-set",
+        "network-get",
+        "open-port",
+        "opened-ports",
+        "relation-get",
+        "relation-ids",
+        "relation-list",
+        "relation-set",
+        "resource-get",
+        "secret-add",
+        "secret-get",
+        "secret-grant",
+        "secret-ids",
+        "secret-info-get",
+        "secret-remove",
+        "secret-revoke",
+        "secret-set",
+        "state-delete",
+        "state-get",
+        "state-set",
+        "status-get",
+        "status-set",
+        "storage-get",
+        "storage-list",
+    }
+)
+_HTTP_METHODS = frozenset({b"GET", b"POST", b"PUT", b"DELETE"})
+
+
+class Span:
+    """Counters for one timed handler."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.wall = 0.0
+        self.snapd_calls = 0
+        self.forks = 0
+        self.hook_tool_calls = 0
+
+    def as_dict(self) -> Dict:
+        """Return the span as a dict."""
+        return {
+            "span": self.name,
+            "wall": round(self.wall, 6),
+            "snapd_calls": self.snapd_calls,
+            "forks": self.forks,
+            "hook_tool_calls": self.hook_tool_calls,
+        }
+
+
+_active: List[Span] = []
+_hooked = False
+
+
+def _audit(event: str, args: tuple) -> None:
+    if not _active:
+        return
+    if event == "subprocess.Popen":
+        argv = args[1]
+        program = argv if isinstance(argv, (str, bytes)) else argv[0]
+        if os.path.basename(os.fsdecode(program)) in HOOK_TOOLS:
+            for span in _active:
+                span.hook_tool_calls += 1
+        else:
+            for span in _active:
+                span.forks += 1
+    elif event == "http.client.send" and isinstance(args[0], snap._UnixSocketConnection):
+        data = args[1]
+        # Headers go out in a single send, so only the request line marks a new call
+        if isinstance(data, bytes) and data.split(b" ", 1)[0] in _HTTP_METHODS:
+            for span in _active:
+                span.snapd_calls += 1
+
+
+@contextlib.contextmanager
+def span(name: str) -> Iterator[Span]:
+    """Time the enclosed block, counting the calls it makes.
+
+    Spans may nest, in which case calls are counted in every enclosing span.
+    """
+    global _hooked
+    if not _hooked:
+        sys.addaudithook(_audit)
+        _hooked = True
+    current = Span(name)
+    _active.append(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.wall = time.perf_counter() - start
+        _active.remove(current)
+
+
+def _append_summary(record: Dict) -> None:
+    """Keep the last SUMMARY_SAMPLES records of each span in the summary file."""
+    try:
+        summary = json.loads(SUMMARY_PATH.read_text())
+    except (OSError, ValueError):
+        summary = {}
+    samples = summary.setdefault(record["span"], [])
+    samples.append(record)
+    del samples[:-SUMMARY_SAMPLES]
+    try:
+        SUMMARY_PATH.write_text(json.dumps(summary, indent=2, sort_keys=True))
+    except OSError as e:
+        logger.debug("could not write hook timing summary: %s", e)
+
+
+def timed(handler: Callable) -> Callable:
+    """Wrap a charm or charm library event handler in a span."""
+
+    @functools.wraps(handler)
+    def wrapper(self, *args, **kwargs):
+        with span(handler.__qualname__) as current:
+            result = handler(self, *args, **kwargs)
+        record = current.as_dict()
+        logger.info("hook timing %s", json.dumps(record, sort_keys=True))
+        if self.model.config.get("hook-timing-summary"):
+            _append_summary(record)
+        return result
+
+    return wrapper
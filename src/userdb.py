@@ -0,0 +1,696 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Compile bulk user and group sources into a GLAuth SQLite database.
+
+Sources are CSV, LDIF or JSON Lines. They are checked like config files, see
+`glauth_config.check`, and written to a new database which is only renamed over the
+current one once complete. The database has the schema of the GLAuth SQLite plugin,
+indexed on the columns GLAuth looks users and groups up by.
+
+Users and groups can also be added, removed or synced incrementally, in the database or in
+a config file managed by the charm: the change is diffed against what is there and only
+the entries which differ are written.
+"""
+
+import base64
+import csv
+import io
+import json
+import logging
+import os
+import pathlib
+import re
+import sqlite3
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import glauth_config
+
+logger = logging.getLogger(__name__)
+
+SOURCE_FORMATS = ("csv", "ldif", "jsonl")
+# Add or update the given entries, remove them by name, or make the store hold exactly them
+UPDATE_MODES = ("add", "remove", "sync")
+# Text columns of the users table, in addition to the name
+USER_TEXT_COLUMNS = ("givenname", "sn", "mail", "loginshell", "homedirectory")
+USER_COLUMNS = (
+    "name",
+    "uidnumber",
+    "primarygroup",
+    "othergroups",
+    *USER_TEXT_COLUMNS,
+    "disabled",
+    "passsha256",
+    "passbcrypt",
+    "sshkeys",
+)
+SCHEMA = """
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    uidnumber INTEGER NOT NULL,
+    primarygroup INTEGER NOT NULL,
+    othergroups TEXT DEFAULT '',
+    givenname TEXT DEFAULT '',
+    sn TEXT DEFAULT '',
+    mail TEXT DEFAULT '',
+    loginshell TEXT DEFAULT '',
+    homedirectory TEXT DEFAULT '',
+    disabled SMALLINT DEFAULT 0,
+    passsha256 TEXT DEFAULT '',
+    passbcrypt TEXT DEFAULT '',
+    otpsecret TEXT DEFAULT '',
+    yubikey TEXT DEFAULT '',
+    sshkeys TEXT DEFAULT '',
+    custattr TEXT DEFAULT '{}'
+);
+CREATE TABLE ldapgroups (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    gidnumber INTEGER NOT NULL
+);
+CREATE TABLE includegroups (
+    id INTEGER PRIMARY KEY,
+    parentgroupid INTEGER NOT NULL,
+    includegroupid INTEGER NOT NULL
+);
+CREATE TABLE capabilities (
+    id INTEGER PRIMARY KEY,
+    userid INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    object TEXT NOT NULL
+);
+"""
+# Created once the tables are filled, which is faster than maintaining them row by row
+INDEXES = """
+CREATE UNIQUE INDEX idx_user_name ON users(name);
+CREATE UNIQUE INDEX idx_user_uidnumber ON users(uidnumber);
+CREATE INDEX idx_user_primarygroup ON users(primarygroup);
+CREATE INDEX idx_user_mail ON users(mail);
+CREATE UNIQUE INDEX idx_group_name ON ldapgroups(name);
+CREATE UNIQUE INDEX idx_group_gidnumber ON ldapgroups(gidnumber);
+CREATE INDEX idx_includegroups_parent ON includegroups(parentgroupid);
+CREATE INDEX idx_includegroups_include ON includegroups(includegroupid);
+CREATE INDEX idx_capabilities_user ON capabilities(userid);
+"""
+
+_LIST_SEPARATOR = re.compile(r"[;,\s]+")
+# Strings which need no escaping in TOML
+_PLAIN = re.compile(r'[^"\\\x00-\x1f\x7f]*')
+
+
+class UserSourceError(Exception):
+    """Raised when a user and group source cannot be read."""
+
+
+def _int(value: Any, field: str, where: str) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise UserSourceError(f"{where}: {field} must be an integer, not {value!r}") from None
+
+
+def _ints(value: Any, field: str, where: str) -> List[int]:
+    if isinstance(value, str):
+        value = [v for v in _LIST_SEPARATOR.split(value) if v]
+    return [_int(v, field, where) for v in value or []]
+
+
+def _user(record: Dict[str, Any], where: str) -> Dict[str, Any]:
+    """Return a user with the columns of the users table."""
+    keys = record.get("sshkeys") or []
+    user = {
+        "name": str(record.get("name") or ""),
+        "uidnumber": _int(record.get("uidnumber"), "uidnumber", where),
+        "primarygroup": _int(record.get("primarygroup"), "primarygroup", where),
+        "othergroups": _ints(record.get("othergroups"), "othergroups", where),
+        "disabled": int(str(record.get("disabled", "")).lower() in ("1", "true", "yes")),
+        "passsha256": str(record.get("passsha256") or "") or None,
+        "passbcrypt": str(record.get("passbcrypt") or "") or None,
+        "sshkeys": [keys] if isinstance(keys, str) else list(keys),
+    }
+    user.update({column: str(record.get(column) or "") for column in USER_TEXT_COLUMNS})
+    return user
+
+
+def _group(record: Dict[str, Any], where: str) -> Dict[str, Any]:
+    """Return a group with the columns of the ldapgroups table and its included groups."""
+    return {
+        "name": str(record.get("name") or ""),
+        "gidnumber": _int(record.get("gidnumber"), "gidnumber", where),
+        "includegroups": _ints(record.get("includegroups"), "includegroups", where),
+    }
+
+
+def _records_csv(text: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    reader = csv.DictReader(io.StringIO(text))
+    for record in reader:
+        record = {key.strip().lower(): value for key, value in record.items() if key}
+        # Several SSH keys are separated by newlines within the quoted field
+        if record.get("sshkeys"):
+            record["sshkeys"] = record["sshkeys"].splitlines()
+        yield reader.line_num, record
+
+
+def _records_jsonl(text: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    for number, line in enumerate(text.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise UserSourceError(f"line {number}: {e}") from None
+        if not isinstance(record, dict):
+            raise UserSourceError(f"line {number}: expected an object")
+        yield number, {key.lower(): value for key, value in record.items()}
+
+
+def _ldif_password(value: str, where: str) -> Dict[str, str]:
+    """Return the GLAuth password hash column for an LDAP userPassword value."""
+    scheme, _, digest = value.partition("}")
+    scheme = scheme.lstrip("{").upper()
+    if scheme == "SHA256":
+        try:
+            return {"passsha256": base64.b64decode(digest, validate=True).hex()}
+        except ValueError:
+            raise UserSourceError(f"{where}: malformed SHA256 userPassword") from None
+    if scheme in ("CRYPT", "BCRYPT") and digest.startswith("$2"):
+        return {"passbcrypt": digest.encode().hex()}
+    raise UserSourceError(f"{where}: unsupported userPassword scheme {scheme or 'plain'}")
+
+
+def _ldif_lines(text: str) -> List[Tuple[int, str]]:
+    """Return the LDIF lines with their number, continuations unfolded and comments dropped."""
+    lines: List[Tuple[int, str]] = []
+    for number, line in enumerate(text.splitlines(), 1):
+        if line.startswith(" ") and lines:
+            lines[-1] = (lines[-1][0], lines[-1][1] + line[1:])
+        elif not line.startswith("#"):
+            lines.append((number, line))
+    return lines
+
+
+def _ldif_entries(text: str) -> Iterator[Tuple[int, Dict[str, List[str]]]]:
+    """Yield the attributes of each LDIF entry, with lower-cased names."""
+    entry: Dict[str, List[str]] = {}
+    start = 0
+    lines = _ldif_lines(text)
+    for number, line in lines + [(len(lines) + 1, "")]:
+        if not line.strip():
+            if entry:
+                yield start, entry
+            entry = {}
+            continue
+        name, sep, value = line.partition(":")
+        if not sep:
+            raise UserSourceError(f"line {number}: expected an attribute")
+        if not entry:
+            start = number
+        if value.startswith(":"):
+            try:
+                value = base64.b64decode(value[1:].strip(), validate=True).decode()
+            except ValueError:
+                raise UserSourceError(f"line {number}: malformed base64 value") from None
+        entry.setdefault(name.strip().lower(), []).append(value.strip())
+
+
+def _records_ldif(text: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    members: Dict[str, List[int]] = {}
+    users: List[Tuple[int, Dict[str, Any]]] = []
+    for number, entry in _ldif_entries(text):
+        if "version" in entry and len(entry) == 1:
+            continue
+        first = {name: values[0] for name, values in entry.items()}
+        classes = {value.lower() for value in entry.get("objectclass", [])}
+        if classes & {"posixgroup", "groupofnames"}:
+            gid = _int(first.get("gidnumber"), "gidNumber", f"line {number}")
+            for member in entry.get("memberuid", []):
+                members.setdefault(member, []).append(gid)
+            yield number, {"type": "group", "name": first.get("cn"), "gidnumber": gid}
+        elif "uidnumber" in first:
+            record = {
+                "name": first.get("uid") or first.get("cn"),
+                "uidnumber": first["uidnumber"],
+                "primarygroup": first.get("gidnumber"),
+                "sshkeys": entry.get("sshpublickey", []),
+                **{column: first.get(column) for column in USER_TEXT_COLUMNS},
+            }
+            if "userpassword" in first:
+                record.update(_ldif_password(first["userpassword"], f"line {number}"))
+            users.append((number, record))
+    # Secondary groups are listed on the group, GLAuth keeps them on the user
+    for number, record in users:
+        record["othergroups"] = [
+            gid for gid in members.get(record["name"], []) if str(gid) != record["primarygroup"]
+        ]
+        yield number, record
+
+
+_READERS = {"csv": _records_csv, "jsonl": _records_jsonl, "ldif": _records_ldif}
+
+
+def source_format(path: pathlib.Path) -> str:
+    """Return the format of a source from its file extension, or else its first line."""
+    suffix = path.suffix.lstrip(".").lower()
+    fmt = {"json": "jsonl", "ndjson": "jsonl"}.get(suffix, suffix)
+    if fmt in SOURCE_FORMATS:
+        return fmt
+    try:
+        with open(path) as f:
+            first = next((line.strip() for line in f if line.strip()), "")
+    except (OSError, UnicodeDecodeError) as e:
+        raise UserSourceError(f"could not read {path.name}: {e}") from e
+    if first.startswith("{"):
+        return "jsonl"
+    if re.match(r"(#|version:|dn:)", first, re.IGNORECASE):
+        return "ldif"
+    return "csv"
+
+
+def load_source(
+    path: pathlib.Path, fmt: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Read the users and groups of a source.
+
+    Records are users unless their `type` is `group`, LDIF entries are groups if they are
+    a posixGroup or groupOfNames. Lists of group numbers may be separated by commas,
+    semicolons or spaces.
+
+    Args:
+        path: Source file.
+        fmt: One of SOURCE_FORMATS, defaults to the format of the file extension.
+
+    Returns:
+        Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]: Users and groups.
+
+    Raises:
+        UserSourceError: If the source cannot be read.
+    """
+    fmt = fmt or source_format(path)
+    if fmt not in SOURCE_FORMATS:
+        raise UserSourceError(f"unsupported source format {fmt}")
+    try:
+        text = path.read_text()
+    except (OSError, UnicodeDecodeError) as e:
+        raise UserSourceError(f"could not read {path.name}: {e}") from e
+    users, groups = [], []
+    for number, record in _READERS[fmt](text):
+        where = f"{path.name} line {number}"
+        if str(record.get("type") or "user").lower() == "group":
+            groups.append(_group(record, where))
+        else:
+            users.append(_user(record, where))
+    return users, groups
+
+
+def _user_row(user: Dict[str, Any]) -> tuple:
+    row = dict(user)
+    row["othergroups"] = ",".join(str(gid) for gid in user["othergroups"])
+    row["sshkeys"] = ",".join(user["sshkeys"])
+    row["passsha256"] = user["passsha256"] or ""
+    row["passbcrypt"] = user["passbcrypt"] or ""
+    return tuple(row[column] for column in USER_COLUMNS)
+
+
+def compile_database(
+    users: List[Dict[str, Any]], groups: List[Dict[str, Any]], path: pathlib.Path, source: str
+) -> Dict[str, Any]:
+    """Write users and groups to a new database and rename it over the database at path.
+
+    Args:
+        users: Users, as returned by `load_source`.
+        groups: Groups, as returned by `load_source`.
+        path: Database GLAuth is configured with.
+        source: Name of the source, to report problems against.
+
+    Returns:
+        Dict[str, Any]: Number of users and groups written, and the seconds taken.
+
+    Raises:
+        ConfigValidationError: If the users and groups are invalid.
+    """
+    start = time.perf_counter()
+    glauth_config.check([(source, u) for u in users], [(source, g) for g in groups])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.unlink(missing_ok=True)
+    conn = sqlite3.connect(tmp)
+    try:
+        # Nothing reads the new database until it is complete, so skip the journal
+        conn.executescript("PRAGMA journal_mode = OFF; PRAGMA synchronous = OFF;" + SCHEMA)
+        with conn:
+            columns = ", ".join(USER_COLUMNS)
+            conn.executemany(
+                f"INSERT INTO users ({columns}) VALUES ({', '.join('?' * len(USER_COLUMNS))})",
+                (_user_row(user) for user in users),
+            )
+            ids = {group["gidnumber"]: i for i, group in enumerate(groups, 1)}
+            conn.executemany(
+                "INSERT INTO ldapgroups (id, name, gidnumber) VALUES (?, ?, ?)",
+                ((ids[g["gidnumber"]], g["name"], g["gidnumber"]) for g in groups),
+            )
+            conn.executemany(
+                "INSERT INTO includegroups (parentgroupid, includegroupid) VALUES (?, ?)",
+                (
+                    (ids[group["gidnumber"]], ids[gid])
+                    for group in groups
+                    for gid in group["includegroups"]
+                ),
+            )
+        conn.executescript(INDEXES + "ANALYZE; PRAGMA journal_mode = DELETE;")
+    except BaseException:
+        conn.close()
+        tmp.unlink(missing_ok=True)
+        raise
+    conn.close()
+    os.chmod(tmp, 0o600)
+    os.replace(tmp, path)
+    elapsed = time.perf_counter() - start
+    logger.info(
+        "compiled %d users and %d groups into %s in %.3fs", len(users), len(groups), path, elapsed
+    )
+    return {"users": len(users), "groups": len(groups), "seconds": round(elapsed, 3)}
+
+
+def ensure_database(path: pathlib.Path) -> bool:
+    """Create an empty database at path if there is none.
+
+    Returns:
+        bool: True if the database was created.
+    """
+    if path.exists():
+        return False
+    compile_database([], [], path, path.name)
+    return True
+
+
+def load_names(
+    path: pathlib.Path, fmt: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Read only the names of the users and groups of a source, to remove them.
+
+    Returns:
+        Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]: Users and groups, by name only.
+
+    Raises:
+        UserSourceError: If the source cannot be read.
+    """
+    fmt = fmt or source_format(path)
+    if fmt not in SOURCE_FORMATS:
+        raise UserSourceError(f"unsupported source format {fmt}")
+    try:
+        text = path.read_text()
+    except (OSError, UnicodeDecodeError) as e:
+        raise UserSourceError(f"could not read {path.name}: {e}") from e
+    users, groups = [], []
+    for number, record in _READERS[fmt](text):
+        if not record.get("name"):
+            raise UserSourceError(f"{path.name} line {number}: name is required")
+        entries = groups if str(record.get("type") or "user").lower() == "group" else users
+        entries.append({"name": str(record["name"])})
+    return users, groups
+
+
+def _diff(
+    current: List[Dict[str, Any]], wanted: List[Dict[str, Any]], mode: str, kind: str
+) -> Dict[str, List[Dict[str, Any]]]:
+    """Sort wanted entries into those to add, update or remove, matching them by name."""
+    known = {entry["name"]: entry for entry in current}
+    changes: Dict[str, List[Dict[str, Any]]] = {
+        key: [] for key in ("added", "updated", "removed", "unchanged", "not-found")
+    }
+    names = set()
+    for entry in wanted:
+        if entry["name"] in names:
+            raise UserSourceError(f"{kind} {entry['name']} is listed more than once")
+        names.add(entry["name"])
+        old = known.get(entry["name"])
+        if mode == "remove":
+            changes["not-found" if old is None else "removed"].append(old or entry)
+        elif old is None:
+            changes["added"].append(entry)
+        else:
+            changes["unchanged" if old == entry else "updated"].append(entry)
+    if mode == "sync":
+        changes["removed"] = [entry for name, entry in known.items() if name not in names]
+    return changes
+
+
+def _result(
+    current: List[Dict[str, Any]], changes: Dict[str, List[Dict[str, Any]]]
+) -> List[Dict[str, Any]]:
+    """Return the entries once changes are applied."""
+    replaced = {entry["name"] for entry in changes["updated"] + changes["removed"]}
+    kept = [entry for entry in current if entry["name"] not in replaced]
+    return kept + changes["updated"] + changes["added"]
+
+
+def _plan(
+    current: Tuple[List[Dict[str, Any]], List[Dict[str, Any]]],
+    users: List[Dict[str, Any]],
+    groups: List[Dict[str, Any]],
+    mode: str,
+) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+    if mode not in UPDATE_MODES:
+        raise UserSourceError(f"mode must be one of {', '.join(UPDATE_MODES)}")
+    return {
+        "users": _diff(current[0], users, mode, "user"),
+        "groups": _diff(current[1], groups, mode, "group"),
+    }
+
+
+def _summary(plan: Dict[str, Dict[str, List[Dict[str, Any]]]], start: float) -> Dict[str, Any]:
+    summary: Dict[str, Any] = {
+        kind: {key: len(entries) for key, entries in changes.items()}
+        for kind, changes in plan.items()
+    }
+    summary["changed"] = any(
+        changes[key] for changes in plan.values() for key in ("added", "updated", "removed")
+    )
+    summary["seconds"] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+def read_database(path: pathlib.Path) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Read the users and groups of a database, in the form returned by `load_source`."""
+    with sqlite3.connect(path) as conn:
+        users = []
+        for row in conn.execute(f"SELECT {', '.join(USER_COLUMNS)} FROM users ORDER BY id"):
+            user = dict(zip(USER_COLUMNS, row))
+            user["othergroups"] = [int(gid) for gid in user["othergroups"].split(",") if gid]
+            user["sshkeys"] = [key for key in user["sshkeys"].split(",") if key]
+            user["passsha256"] = user["passsha256"] or None
+            user["passbcrypt"] = user["passbcrypt"] or None
+            users.append(user)
+        includes: Dict[int, List[int]] = {}
+        for parent, gid in conn.execute(
+            "SELECT parentgroupid, gidnumber FROM includegroups "
+            "JOIN ldapgroups ON ldapgroups.id = includegroupid ORDER BY includegroups.id"
+        ):
+            includes.setdefault(parent, []).append(gid)
+        groups = [
+            {"name": name, "gidnumber": gid, "includegroups": includes.get(id, [])}
+            for id, name, gid in conn.execute("SELECT id, name, gidnumber FROM ldapgroups")
+        ]
+    conn.close()
+    return users, groups
+
+
+def update_database(
+    path: pathlib.Path,
+    users: List[Dict[str, Any]],
+    groups: List[Dict[str, Any]],
+    mode: str,
+    source: str,
+) -> Dict[str, Any]:
+    """Apply the difference between users and groups and those in the database.
+
+    Only changed rows are written, in a single transaction, so GLAuth serves the change
+    without a restart. Rows keep their id when updated.
+
+    Args:
+        path: Database GLAuth is configured with, created if missing.
+        users: Users to add, remove or sync, by name only to remove.
+        groups: Groups to add, remove or sync, by name only to remove.
+        mode: One of UPDATE_MODES.
+        source: Name of the source, to report problems against.
+
+    Returns:
+        Dict[str, Any]: Number of users and groups per outcome, if anything changed and the
+            seconds taken.
+
+    Raises:
+        UserSourceError: If the entries or mode are invalid.
+        ConfigValidationError: If the database would be invalid once changed.
+    """
+    start = time.perf_counter()
+    ensure_database(path)
+    current = read_database(path)
+    plan = _plan(current, users, groups, mode)
+    glauth_config.check(
+        [(source, user) for user in _result(current[0], plan["users"])],
+        [(source, group) for group in _result(current[1], plan["groups"])],
+    )
+    summary = _summary(plan, start)
+    if not summary["changed"]:
+        return summary
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            _apply_users(conn, plan["users"])
+            _apply_groups(conn, plan["groups"])
+    finally:
+        conn.close()
+    summary["seconds"] = round(time.perf_counter() - start, 3)
+    logger.info("updated %s: %s", path, summary)
+    return summary
+
+
+def _apply_users(conn: sqlite3.Connection, changes: Dict[str, List[Dict[str, Any]]]) -> None:
+    ids = dict(conn.execute("SELECT name, id FROM users"))
+    # Updated rows are replaced, so numbers can move between users without a conflict
+    conn.executemany(
+        "DELETE FROM users WHERE id = ?",
+        ((ids[user["name"]],) for user in changes["updated"] + changes["removed"]),
+    )
+    conn.executemany(
+        f"INSERT INTO users (id, {', '.join(USER_COLUMNS)}) "
+        f"VALUES ({', '.join('?' * (len(USER_COLUMNS) + 1))})",
+        (
+            (ids.get(user["name"]), *_user_row(user))
+            for user in changes["updated"] + changes["added"]
+        ),
+    )
+
+
+def _apply_groups(conn: sqlite3.Connection, changes: Dict[str, List[Dict[str, Any]]]) -> None:
+    ids = dict(conn.execute("SELECT name, id FROM ldapgroups"))
+    replaced = [(ids[group["name"]],) for group in changes["updated"] + changes["removed"]]
+    conn.executemany("DELETE FROM ldapgroups WHERE id = ?", replaced)
+    conn.executemany("DELETE FROM includegroups WHERE parentgroupid = ?", replaced)
+    conn.executemany(
+        "DELETE FROM includegroups WHERE includegroupid = ?",
+        ((ids[group["name"]],) for group in changes["removed"]),
+    )
+    written = changes["updated"] + changes["added"]
+    conn.executemany(
+        "INSERT INTO ldapgroups (id, name, gidnumber) VALUES (?, ?, ?)",
+        ((ids.get(group["name"]), group["name"], group["gidnumber"]) for group in written),
+    )
+    gids = dict(conn.execute("SELECT gidnumber, id FROM ldapgroups"))
+    conn.executemany(
+        "INSERT INTO includegroups (parentgroupid, includegroupid) VALUES (?, ?)",
+        (
+            (gids[group["gidnumber"]], gids[gid])
+            for group in written
+            for gid in group["includegroups"]
+        ),
+    )
+
+
+# Keys of the users written to a managed config file, as GLAuth spells them
+_CONFIG_KEYS = {"loginshell": "loginShell", "homedirectory": "homeDir"}
+
+
+def read_config(path: pathlib.Path) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Read the users and groups of a config file, in the form returned by `load_source`."""
+    if not path.exists():
+        return [], []
+    document = glauth_config.parse(path, path.name)
+    users, groups = [], []
+    for entry in glauth_config.entries(document, "users", path.name):
+        entry["homedirectory"] = entry.pop("homedir", "")
+        users.append(_user(entry, path.name))
+    for entry in glauth_config.entries(document, "groups", path.name):
+        groups.append(_group(entry, path.name))
+    return users, groups
+
+
+def _toml(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, list):
+        return f"[{', '.join(_toml(item) for item in value)}]"
+    if _PLAIN.fullmatch(value):
+        return f'"{value}"'
+    # JSON strings are TOML basic strings
+    return json.dumps(value)
+
+
+def render_config(users: List[Dict[str, Any]], groups: List[Dict[str, Any]]) -> str:
+    """Render users and groups as a GLAuth config file, leaving out empty values."""
+    lines = ["# Managed by the glauth charm, edit with the add-users and sync-users actions."]
+    for group in groups:
+        lines += ["", "[[groups]]"]
+        lines += [f"{key} = {_toml(group[key])}" for key in ("name", "gidnumber")]
+        if group["includegroups"]:
+            lines.append(f"includegroups = {_toml(group['includegroups'])}")
+    for user in users:
+        lines += ["", "[[users]]"]
+        for key in USER_COLUMNS:
+            value = user[key]
+            if key == "disabled":
+                value = bool(value)
+            if value:
+                lines.append(f"{_CONFIG_KEYS.get(key, key)} = {_toml(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def update_config(
+    path: pathlib.Path,
+    users: List[Dict[str, Any]],
+    groups: List[Dict[str, Any]],
+    mode: str,
+    source: str,
+) -> Dict[str, Any]:
+    """Apply the difference between users and groups and those in a managed config file.
+
+    The result is checked together with the other config files next to it, which GLAuth
+    loads with it, and the file is only rewritten if anything changed.
+
+    Args:
+        path: Config file managed by the charm.
+        users: Users to add, remove or sync, by name only to remove.
+        groups: Groups to add, remove or sync, by name only to remove.
+        mode: One of UPDATE_MODES.
+        source: Name of the source, to report problems against.
+
+    Returns:
+        Dict[str, Any]: Number of users and groups per outcome, if anything changed and the
+            seconds taken.
+
+    Raises:
+        UserSourceError: If the entries or mode are invalid.
+        ConfigValidationError: If the config files would be invalid once changed.
+    """
+    start = time.perf_counter()
+    current = read_config(path)
+    plan = _plan(current, users, groups, mode)
+    result = (_result(current[0], plan["users"]), _result(current[1], plan["groups"]))
+    summary = _summary(plan, start)
+    if not summary["changed"]:
+        return summary
+    others: List[Tuple[str, Dict[str, Any]]] = []
+    other_groups: List[Tuple[str, Dict[str, Any]]] = []
+    for other in sorted(path.parent.iterdir()):
+        if other == path or not other.name.endswith(glauth_config.CONFIG_SUFFIXES):
+            continue
+        document = glauth_config.parse(other, other.name)
+        others += [(other.name, u) for u in glauth_config.entries(document, "users", other.name)]
+        other_groups += [
+            (other.name, g) for g in glauth_config.entries(document, "groups", other.name)
+        ]
+    glauth_config.check(
+        others + [(source, user) for user in result[0]],
+        other_groups + [(source, group) for group in result[1]],
+    )
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(render_config(*result))
+    os.replace(tmp, path)
+    summary["seconds"] = round(time.perf_counter() - start, 3)
+    logger.info("updated %s: %s", path, summary)
+    return summary
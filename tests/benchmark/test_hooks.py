@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Benchmark hook latency of the glauth charm against a baseline.
+
+Each hook is driven through Harness with snapd, subprocess and filesystem stubs, at several
+numbers of related ldap-client applications. Results are written to BENCHMARK_RESULTS and
+a hook more than BENCHMARK_TOLERANCE times slower than its baseline fails the run. Set
+BENCHMARK_UPDATE_BASELINE=1 to record the results as the new baseline instead.
+"""
+
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import tempfile
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+import glauth
+import ldapclient_lib
+from charm import GlauthCharm
+from ops.testing import Harness
+
+BASELINE = pathlib.Path(__file__).parent / "baseline.json"
+RESULTS = pathlib.Path(os.environ.get("BENCHMARK_RESULTS", "benchmark-results.json"))
+TOLERANCE = float(os.environ.get("BENCHMARK_TOLERANCE", "3.0"))
+# Absolute slack in seconds, so sub-millisecond hooks are not failed on timer noise
+SLACK = 0.005
+SCALES = (1, 50, 500)
+ROUNDS = 5
+
+_results = {}
+
+
+def tearDownModule():  # noqa: N802
+    """Write the results, and the baseline if asked to."""
+    RESULTS.write_text(json.dumps(_results, indent=2, sort_keys=True) + "\n")
+    if os.environ.get("BENCHMARK_UPDATE_BASELINE"):
+        BASELINE.write_text(json.dumps(_results, indent=2, sort_keys=True) + "\n")
+
+
+def _median(func, rounds: int = ROUNDS) -> float:
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+class TestHookLatency(unittest.TestCase):
+    """Time charm hooks at increasing numbers of related applications."""
+
+    def setUp(self) -> None:
+        """Stub snapd, subprocesses and workload paths."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        root = pathlib.Path(tmp.name)
+        (root / "glauth.d").mkdir()
+        patches = [
+            patch.object(glauth, "CONFIG_PATH", root / "glauth.d" / "glauth.cfg"),
+            patch.object(glauth, "CERT_PATH", root / "glauth.crt"),
+            patch.object(glauth, "KEY_PATH", root / "glauth.key"),
+            patch.object(glauth, "CA_CERT_PATH", root / "glauth-ca.crt"),
+            patch.object(glauth, "CA_KEY_PATH", root / "glauth-ca.key"),
+            patch.object(glauth, "DROPIN_PATH", root / "tuning.conf"),
+            patch.object(ldapclient_lib, "GLAUTH_CONFIG_DIR", root / "glauth.d"),
+            patch(
+                "charms.operator_libs_linux.v1.snap.SnapCache.__getitem__",
+                return_value=MagicMock(version="2.2.0", present=True),
+            ),
+            patch("charms.operator_libs_linux.v1.snap.SnapCache.__init__", return_value=None),
+            patch.object(subprocess, "check_call"),
+            patch.object(subprocess, "check_output", return_value=""),
+            patch.object(subprocess, "run"),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.baseline = json.loads(BASELINE.read_text()) if BASELINE.exists() else {}
+
+    def _record(self, hook: str, scale: int, seconds: float) -> None:
+        _results.setdefault(hook, {})[str(scale)] = round(seconds, 6)
+        baseline = self.baseline.get(hook, {}).get(str(scale))
+        if baseline is not None and not os.environ.get("BENCHMARK_UPDATE_BASELINE"):
+            self.assertLessEqual(
+                seconds,
+                baseline * TOLERANCE + SLACK,
+                f"{hook} at {scale} related apps regressed: {seconds:.4f}s, "
+                f"baseline {baseline:.4f}s",
+            )
+
+    def _harness(self) -> Harness:
+        harness = Harness(GlauthCharm)
+        self.addCleanup(harness.cleanup)
+        harness.set_leader(True)
+        harness.begin()
+        harness.add_relation("glauth", "glauth")
+        return harness
+
+    def test_hooks(self) -> None:
+        """Time every hook at each scale."""
+        for scale in SCALES:
+            with self.subTest(scale=scale):
+                harness = self._harness()
+                charm = harness.charm
+
+                # Clients joining before set-confidential wait for the secrets
+                relation_ids = []
+                for i in range(scale):
+                    relation_ids.append(harness.add_relation("ldap-client", f"early{i}"))
+                    harness.add_relation_unit(relation_ids[-1], f"early{i}/0")
+                params = {"ldap-password": "secret", "ldap-default-bind-dn": "cn=svc"}
+                self._record(
+                    "set-confidential",
+                    scale,
+                    _median(lambda: harness.run_action("set-confidential", params), rounds=1),
+                )
+
+                start = time.perf_counter()
+                for i in range(scale):
+                    relation_ids.append(harness.add_relation("ldap-client", f"sssd{i}"))
+                    harness.add_relation_unit(relation_ids[-1], f"sssd{i}/0")
+                self._record(
+                    "ldap-client-relation-joined", scale, (time.perf_counter() - start) / scale
+                )
+
+                # With every client related, as hooks may walk all relations
+                self._record("install", scale, _median(charm.on.install.emit))
+                self._record("upgrade-charm", scale, _median(charm.on.upgrade_charm.emit))
+                self._record("update-status", scale, _median(charm.on.update_status.emit))
+
+                # One relation is removed per round
+                remaining = iter(relation_ids)
+                self._record(
+                    "ldap-client-relation-broken",
+                    scale,
+                    _median(
+                        lambda: harness.remove_relation(next(remaining)),
+                        rounds=min(ROUNDS, len(relation_ids)),
+                    ),
+                )
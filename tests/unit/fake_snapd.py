@@ -0,0 +1,244 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Fake snapd serving the REST endpoints used by the snap library on a Unix socket.
+
+`FakeSnapd` answers `snaps`, `find` and `apps` queries from in-memory state and applies the
+changes requested by a `snap` CLI stand-in put on PATH, so both the snap library and the
+glauth module can be driven end to end without a real snapd. Latency and failures can be
+injected per endpoint, and every request and connection is counted.
+"""
+
+import copy
+import functools
+import http.server
+import json
+import os
+import pathlib
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from typing import Dict, List, Optional
+from unittest.mock import PropertyMock, patch
+
+from charms.operator_libs_linux.v1 import snap
+
+GLAUTH_SNAP = {
+    "name": "glauth",
+    "version": "2.2.0",
+    "revision": "33",
+    "channel": "latest/edge",
+    "confinement": "strict",
+    "apps": [
+        {"snap": "glauth", "name": "daemon", "daemon": "simple", "enabled": True, "active": True}
+    ],
+}
+
+# Translates the `snap` commands used by the snap library into snapd API requests
+_CLI = """#!{python}
+import http.client, json, socket, sys
+
+def request(method, path, body=None):
+    conn = http.client.HTTPConnection("localhost")
+    conn.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.sock.connect("{socket_path}")
+    conn.request(method, path, body=json.dumps(body) if body is not None else None)
+    response = conn.getresponse()
+    result = json.loads(response.read())["result"]
+    if response.status >= 400:
+        sys.exit("error: " + result.get("message", response.reason))
+    return result
+
+command, args = sys.argv[1], [a for a in sys.argv[2:] if not a.startswith("-")]
+if command == "list":
+    print("Name Version Rev Tracking Publisher Notes")
+    for s in request("GET", "/v2/snaps"):
+        if not args or s["name"] in args:
+            print(s["name"], s["version"], s["revision"], s["channel"], "-", "-")
+elif command in ("install", "refresh", "remove"):
+    request("POST", "/v2/snaps/" + args[0], {{"action": command}})
+elif command in ("start", "stop", "restart"):
+    request("POST", "/v2/apps", {{"action": command, "names": args}})
+elif command == "set":
+    request("PUT", "/v2/snaps/" + args[0] + "/conf", dict(a.split("=", 1) for a in args[1:]))
+else:
+    sys.exit("error: unsupported command " + command)
+"""
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.fake.lock:
+            self.server.fake.connections += 1
+
+    def do_GET(self):  # noqa: N802
+        self._dispatch("GET")
+
+    def do_POST(self):  # noqa: N802
+        self._dispatch("POST")
+
+    def do_PUT(self):  # noqa: N802
+        self._dispatch("PUT")
+
+    def _dispatch(self, method: str) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else {}
+        fake = self.server.fake
+        with fake.lock:
+            fake.requests.append(url.path)
+            if method != "GET":
+                fake.changes.append((method, url.path, body))
+            latency = fake.latency
+            failure = fake.failures.get(url.path)
+            if failure is not None and failure[1] > 0:
+                fake.failures[url.path] = (failure[0], failure[1] - 1)
+            else:
+                failure = None
+        if latency:
+            time.sleep(latency)
+        if failure is not None:
+            self._reply(failure[0], {"message": "injected failure", "kind": "fake"})
+            return
+        with fake.lock:
+            code, result = fake._handle(method, url.path, query, body)
+        self._reply(code, result)
+
+    def _reply(self, code: int, result) -> None:
+        body = json.dumps({"type": "sync", "status-code": code, "result": result}).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # Drop the connection without announcing it, as snapd does on restart
+        self.close_connection = not self.server.fake.keepalive
+
+    def log_message(self, *_):
+        pass
+
+
+class FakeSnapd:
+    """Serve a subset of the snapd API and a `snap` CLI stand-in from a temporary directory.
+
+    Used as a context manager, the snap library and the `snap` command on PATH are pointed
+    at the fake for the duration of the block.
+
+    Attributes:
+        snaps: Installed snaps, as listed by `GET /v2/snaps`.
+        store: Snaps available to `find` and `install`.
+        latency: Seconds every request is delayed by.
+        keepalive: Whether connections are kept open between requests.
+        requests: Path of every request served.
+        changes: Method, path and body of every request which changed state.
+        connections: Number of connections accepted.
+    """
+
+    def __init__(
+        self, snaps: Optional[List[Dict]] = None, store: Optional[List[Dict]] = None
+    ) -> None:
+        self.snaps = copy.deepcopy(snaps if snaps is not None else [GLAUTH_SNAP])
+        self.store = copy.deepcopy(store if store is not None else [GLAUTH_SNAP])
+        self.latency = 0.0
+        self.keepalive = True
+        self.failures: Dict[str, tuple] = {}
+        self.requests: List[str] = []
+        self.changes: List[tuple] = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._dir = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self._dir.name, "snapd.socket")
+        self._server = _Server(self.socket_path, _Handler)
+        self._server.fake = self
+        self._patches = []
+
+    def fail(self, path: str, code: int = 500, times: int = 1) -> None:
+        """Answer the next `times` requests to `path` with an error status."""
+        self.failures[path] = (code, times)
+
+    def _find(self, snaps: List[Dict], name: str) -> Optional[Dict]:
+        return next((s for s in snaps if s["name"] == name), None)
+
+    def _handle(self, method: str, path: str, query: Dict, body: Dict) -> tuple:
+        """Return the status code and result of a request, applying any change it asks for."""
+        if method == "GET" and path == "/v2/snaps":
+            return 200, self.snaps
+        if method == "GET" and path == "/v2/find":
+            found = self._find(self.store, query.get("name"))
+            return (200, [found]) if found else (404, {"message": "snap not found"})
+        if method == "GET" and path == "/v2/apps":
+            installed = self._find(self.snaps, query.get("names"))
+            return (200, installed["apps"]) if installed else (404, {"message": "not found"})
+        if method == "POST" and path.startswith("/v2/snaps/"):
+            return self._change_snap(path.rsplit("/", 1)[1], body.get("action"))
+        if method == "POST" and path == "/v2/apps":
+            return self._change_apps(body.get("action"), body.get("names", []))
+        if method == "PUT" and path.endswith("/conf"):
+            return 200, None
+        return 404, {"message": "not found"}
+
+    def _change_snap(self, name: str, action: str) -> tuple:
+        installed, available = self._find(self.snaps, name), self._find(self.store, name)
+        if action == "install" and available and not installed:
+            self.snaps.append(copy.deepcopy(available))
+        elif action == "refresh" and installed:
+            installed.update({k: v for k, v in (available or {}).items() if k != "apps"})
+        elif action == "remove" and installed:
+            self.snaps.remove(installed)
+        else:
+            return 400, {"message": f"cannot {action} snap {name}"}
+        return 200, None
+
+    def _change_apps(self, action: str, names: List[str]) -> tuple:
+        for name in names:
+            snap_name, _, app_name = name.partition(".")
+            installed = self._find(self.snaps, snap_name)
+            if installed is None:
+                return 404, {"message": f"snap {snap_name} not installed"}
+            for app in installed["apps"]:
+                if app_name in ("", app["name"]) and "daemon" in app:
+                    app["active"] = action != "stop"
+        return 200, None
+
+    def _write_cli(self) -> None:
+        """Write a `snap` executable which, like the real one, works through snapd."""
+        cli = pathlib.Path(self._dir.name, "snap")
+        cli.write_text(_CLI.format(python=sys.executable, socket_path=self.socket_path))
+        cli.chmod(0o755)
+
+    def __enter__(self) -> "FakeSnapd":
+        """Start serving and point the snap library and PATH at the fake."""
+        self._write_cli()
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self._patches = [
+            patch.object(snap, "SnapClient", functools.partial(snap.SnapClient, self.socket_path)),
+            patch.object(
+                snap.SnapCache, "snapd_installed", new_callable=PropertyMock, return_value=True
+            ),
+            patch.dict(os.environ, {"PATH": f"{self._dir.name}:{os.environ['PATH']}"}),
+        ]
+        for p in self._patches:
+            p.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        """Restore the snap library and PATH and stop serving."""
+        for p in reversed(self._patches):
+            p.stop()
+        conn = snap._connection_pool.pop(self.socket_path, None)
+        if conn is not None:
+            conn.close()
+        self._server.shutdown()
+        self._server.server_close()
+        self._dir.cleanup()
@@ -4,27 +4,169 @@
 
 """Test default charm events such as upgrade charm, install, etc."""
 
+import json
+import pathlib
+import tempfile
 import unittest
 from unittest.mock import patch
 
+import glauth
 from charm import GlauthCharm
-from ops.model import ActiveStatus
-from ops.testing import Harness
+from ops.model import ActiveStatus, BlockedStatus
+from ops.testing import ActionFailed, Harness
 
 
 class TestCharm(unittest.TestCase):
     """Unit test glauth charm."""
 
     def setUp(self) -> None:
-        """Set up unit test."""
+        """Set up unit test, with systemd reporting the tuning of the drop-in."""
         self.harness = Harness(GlauthCharm)
         self.addCleanup(self.harness.cleanup)
         self.harness.begin()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dropin = pathlib.Path(tmp.name, "service.d", "tuning.conf")
+        self.limit = None
+        for patcher in (
+            patch.object(glauth, "DROPIN_PATH", self.dropin),
+            patch("subprocess.check_call"),
+            patch("subprocess.check_output", side_effect=self._systemctl_show),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        glauth.write_tuning(65536)
 
+    def _systemctl_show(self, *_, **__) -> str:
+        lines = self.dropin.read_text().splitlines() if self.dropin.exists() else []
+        limit = next((line[12:] for line in lines if line.startswith("LimitNOFILE=")), "1024")
+        environment = " ".join(line[12:] for line in lines if line.startswith("Environment="))
+        return f"MainPID=0\nLimitNOFILE={self.limit or limit}\nEnvironment={environment}\n"
+
+    @patch("glauth.generate_certificate")
     @patch("glauth.version", return_value="v1.0.0")
     @patch("glauth.installed", return_value=True)
     @patch("glauth.install")
-    def test_install(self, *_) -> None:
+    def test_install(self, *args) -> None:
         """Test install behavior."""
+        self.harness.set_leader(True)
         self.harness.charm.on.install.emit()
         self.assertEqual(self.harness.charm.unit.status, ActiveStatus())
+        args[-1].assert_called_once_with("ecdsa-p256")
+
+    @patch("glauth.remove")
+    def test_remove(self, remove) -> None:
+        """Test removing the charm removes the snap and the service tuning."""
+        self.harness.charm.on.remove.emit()
+        remove.assert_called_once_with()
+        self.assertFalse(self.dropin.exists())
+
+    @patch("glauth.load", side_effect=glauth.GlauthError("could not read glauth certificate"))
+    def test_set_confidential_fails(self, _) -> None:
+        """Test certificate errors fail the set-confidential action."""
+        self.harness.set_leader(True)
+        self.harness.add_relation("glauth", "glauth")
+        with self.assertRaises(ActionFailed) as e:
+            self.harness.run_action(
+                "set-confidential",
+                {"ldap-password": "secret", "ldap-default-bind-dn": "cn=svc,dc=glauth,dc=com"},
+            )
+        self.assertEqual(e.exception.message, "could not read glauth certificate")
+
+    def test_config_changed_invalid(self) -> None:
+        """Test invalid config options block the unit."""
+        self.harness.update_config({"ldap-port": 0})
+        self.assertEqual(
+            self.harness.charm.unit.status, BlockedStatus("ldap-port must be between 1 and 65535")
+        )
+        self.harness.update_config({"ldap-port": 3894, "ldap-listen-address": "any"})
+        self.assertEqual(
+            self.harness.charm.unit.status,
+            BlockedStatus("ldap-listen-address must be an IP address"),
+        )
+        self.harness.update_config({"ldap-listen-address": "0.0.0.0", "tls-key-algorithm": "dsa"})
+        self.assertEqual(
+            self.harness.charm.unit.status,
+            BlockedStatus(
+                "tls-key-algorithm must be one of "
+                "ecdsa-p256, ed25519, rsa-2048, rsa-3072, rsa-4096"
+            ),
+        )
+        self.harness.update_config({"tls-key-algorithm": "ed25519", "backend": "ldap"})
+        self.assertEqual(
+            self.harness.charm.unit.status,
+            BlockedStatus("ldap-search-base is required by the ldap backend"),
+        )
+        self.harness.update_config(
+            {"ldap-search-base": "dc=glauth,dc=com", "ldap-upstream-servers": "ldap1:389"}
+        )
+        self.assertEqual(
+            self.harness.charm.unit.status,
+            BlockedStatus("ldap-upstream-servers must list ldap:// or ldaps:// URIs"),
+        )
+
+    @patch("glauth.restart")
+    @patch("glauth.active", return_value=True)
+    def test_config_changed(self, _, restart) -> None:
+        """Test config changes are rendered and restart GLAuth only when they change it."""
+        with tempfile.TemporaryDirectory() as tmp:
+            config = pathlib.Path(tmp, "glauth.cfg")
+            with patch.object(glauth, "CONFIG_PATH", config):
+                glauth.create_default_config(api_port=5555)
+                self.harness.update_config({"debug": False})
+                restart.assert_not_called()
+                self.harness.update_config({"debug": True, "number-of-failed-binds": 5})
+                restart.assert_called_once()
+                self.assertIn("debug = true", config.read_text())
+                self.assertIn("NumberOfFailedBinds = 5", config.read_text())
+        self.assertEqual(self.harness.charm.unit.status, ActiveStatus())
+
+    def test_metrics_endpoint(self) -> None:
+        """Test the scrape target follows the metrics and api-port options."""
+        self.harness.set_leader(True)
+        relation_id = self.harness.add_relation("metrics-endpoint", "prometheus")
+        self.harness.add_relation_unit(relation_id, "prometheus/0")
+        jobs = json.loads(self.harness.get_relation_data(relation_id, "glauth")["scrape_jobs"])
+        self.assertEqual(jobs, [])
+
+        self.harness.update_config({"metrics": True})
+        jobs = json.loads(self.harness.get_relation_data(relation_id, "glauth")["scrape_jobs"])
+        self.assertEqual(jobs[0]["metrics_path"], "/metrics")
+        self.assertEqual(jobs[0]["static_configs"][0]["targets"], ["*:5555"])
+        unit_data = self.harness.get_relation_data(relation_id, "glauth/0")
+        self.assertEqual(unit_data["prometheus_scrape_unit_name"], "glauth/0")
+
+        self.harness.update_config({"metrics": False})
+        jobs = json.loads(self.harness.get_relation_data(relation_id, "glauth")["scrape_jobs"])
+        self.assertEqual(jobs, [])
+
+    @patch("glauth.restart")
+    @patch("glauth.active", return_value=True)
+    def test_tuning(self, _, restart) -> None:
+        """Test the service tuning is applied with a restart and verified."""
+        self.harness.update_config({"max-open-files": 100000, "gomaxprocs": 4})
+        self.assertIn("LimitNOFILE=100000", self.dropin.read_text())
+        restart.assert_called_once()
+        output = self.harness.run_action("show-tuning")
+        self.assertEqual(
+            output.results["effective"],
+            {"max-open-files": "100000", "gomaxprocs": "4", "gogc": "100", "source": "unit"},
+        )
+        # Limits capped elsewhere, such as by the container, are reported
+        self.limit = "1024"
+        self.harness.update_config({"gogc": 200})
+        self.assertEqual(
+            self.harness.charm.unit.status,
+            BlockedStatus("glauth runs with max-open-files 1024, not 100000"),
+        )
+        # and do not hold back the rest of the config
+        with tempfile.TemporaryDirectory() as tmp:
+            config = pathlib.Path(tmp, "glauth.cfg")
+            with patch.object(glauth, "CONFIG_PATH", config):
+                glauth.create_default_config(api_port=5555)
+                self.harness.update_config({"debug": True})
+                self.assertIn("debug = true", config.read_text())
+        self.assertEqual(
+            self.harness.charm.unit.status,
+            BlockedStatus("glauth runs with max-open-files 1024, not 100000"),
+        )
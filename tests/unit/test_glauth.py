@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Test glauth workload helpers."""
+
+import ipaddress
+import os
+import pathlib
+import resource
+import subprocess
+import tempfile
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+import glauth
+import toml
+from cryptography import x509
+from fake_snapd import FakeSnapd
+
+
+class TestSnapState(unittest.TestCase):
+    """Test the hook-scoped snap state cache."""
+
+    def setUp(self) -> None:
+        """Reset the module snap state for each test."""
+        patcher = patch.object(glauth, "_state", glauth._SnapState())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch("charms.operator_libs_linux.v1.snap.SnapCache")
+    def test_snap_loaded_once(self, snap_cache) -> None:
+        """Test repeated lookups in one hook only load the snap cache once."""
+        glauth.installed()
+        glauth.installed()
+        glauth.active()
+        snap_cache.assert_called_once()
+        self.assertEqual(glauth.cache_stats(), {"hits": 2, "misses": 1})
+
+    @patch("charms.operator_libs_linux.v1.snap.hold_refresh")
+    @patch("charms.operator_libs_linux.v1.snap.SnapCache")
+    def test_invalidate_after_mutation(self, snap_cache, _) -> None:
+        """Test mutating operations invalidate the cached snap."""
+        snap_cache.return_value = {"glauth": MagicMock()}
+        glauth.install()
+        glauth.installed()
+        glauth.start()
+        glauth.installed()
+        glauth.remove()
+        self.assertEqual(snap_cache.call_count, 3)
+        self.assertEqual(glauth.cache_stats(), {"hits": 2, "misses": 3})
+
+
+class TestVersion(unittest.TestCase):
+    """Test workload version lookup against a fake snapd."""
+
+    def setUp(self) -> None:
+        """Start a fake snapd."""
+        self.snapd = FakeSnapd()
+        self.snapd.__enter__()
+        self.addCleanup(self.snapd.__exit__)
+
+    def test_version(self) -> None:
+        """Test the version is read from the snapd listing without forking."""
+        with patch.object(glauth, "_state", glauth._SnapState()), patch("subprocess.run") as run:
+            self.assertEqual(glauth.version(), "2.2.0")
+            run.assert_not_called()
+        self.assertEqual(self.snapd.requests, ["/v2/snaps"])
+
+    def test_version_benchmark(self) -> None:
+        """Compare the REST lookup against forking `snap list` as version() used to."""
+        rest, fork = [], []
+        for _ in range(20):
+            start = time.perf_counter()
+            with patch.object(glauth, "_state", glauth._SnapState()):
+                glauth.version()
+            rest.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            subprocess.run(
+                ["snap", "list", "glauth"], stdout=subprocess.PIPE, text=True
+            ).stdout.splitlines()[1].split()[2]
+            fork.append(time.perf_counter() - start)
+        print(f"version(): snapd api {min(rest) * 1000:.3f}ms, snap list {min(fork) * 1000:.3f}ms")
+        self.assertLess(min(rest), min(fork))
+
+
+class TestLifecycle(unittest.TestCase):
+    """Test the glauth snap lifecycle end to end against a fake snapd."""
+
+    def setUp(self) -> None:
+        """Start a fake snapd with glauth available but not installed."""
+        self.snapd = FakeSnapd(snaps=[])
+        self.snapd.__enter__()
+        self.addCleanup(self.snapd.__exit__)
+        patcher = patch.object(glauth, "_state", glauth._SnapState())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_install_start_remove(self) -> None:
+        """Test each operation reaches snapd with a bounded number of requests."""
+        glauth.install()
+        self.assertEqual(glauth.version(), "2.2.0")
+        self.assertEqual(
+            self.snapd.requests,
+            ["/v2/snaps", "/v2/find", "/v2/snaps/glauth", "/v2/apps", "/v2/snaps/system/conf"]
+            + ["/v2/snaps"],
+        )
+        self.snapd.snaps[0]["apps"][0]["active"] = False
+        self.assertFalse(glauth.active())
+        glauth.start()
+        self.assertTrue(glauth.active())
+        glauth.remove()
+        self.assertFalse(glauth.installed())
+        # One pooled connection from the charm, one from each `snap` command
+        self.assertEqual(self.snapd.connections, 5)
+
+    def test_failure(self) -> None:
+        """Test injected snapd failures surface as SnapError."""
+        self.snapd.fail("/v2/snaps/glauth")
+        with self.assertRaises(glauth.snap.SnapError):
+            glauth.install()
+        glauth.install()
+        self.assertTrue(glauth.installed())
+
+    def test_latency(self) -> None:
+        """Test injected latency applies to every request."""
+        self.snapd.latency = 0.05
+        start = time.perf_counter()
+        glauth.installed()
+        self.assertGreaterEqual(time.perf_counter() - start, 0.1)
+
+
+class TestCertificate(unittest.TestCase):
+    """Test in-process certificate generation."""
+
+    def setUp(self) -> None:
+        """Point certificate and key paths at a temporary directory."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cert = pathlib.Path(tmp.name, "certs.d", "glauth.crt")
+        self.key = pathlib.Path(tmp.name, "keys.d", "glauth.key")
+        self.ca_cert = pathlib.Path(tmp.name, "certs.d", "glauth-ca.crt")
+        self.ca_key = pathlib.Path(tmp.name, "keys.d", "glauth-ca.key")
+        for name, path in (
+            ("CERT_PATH", self.cert),
+            ("KEY_PATH", self.key),
+            ("CA_CERT_PATH", self.ca_cert),
+            ("CA_KEY_PATH", self.ca_key),
+        ):
+            patcher = patch.object(glauth, name, path)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_algorithms(self) -> None:
+        """Test every supported algorithm produces a loadable certificate."""
+        for algorithm in ("ecdsa-p256", "ed25519", "rsa-2048"):
+            with self.subTest(algorithm=algorithm):
+                self.assertIsNotNone(glauth.generate_certificate(algorithm))
+                x509.load_pem_x509_certificate(glauth.load().encode())
+                self.assertEqual(self.ca_key.stat().st_mode & 0o777, 0o600)
+                self.assertTrue(glauth.issue_certificate(["glauth-0"], algorithm))
+                self.assertEqual(self.key.stat().st_mode & 0o777, 0o600)
+                for path in (self.cert, self.key, self.ca_cert, self.ca_key):
+                    path.unlink()
+
+    def test_load_existing(self) -> None:
+        """Test an existing certificate is read rather than regenerated."""
+        glauth.generate_certificate()
+        self.assertIsNone(glauth.generate_certificate())
+        self.assertEqual(glauth.load(), self.ca_cert.read_text())
+
+    def test_install_key_material(self) -> None:
+        """Test key material from the leader replaces this unit's and is not rewritten."""
+        shared = glauth.key_material()
+        self.ca_cert.unlink()
+        glauth.generate_certificate("ed25519")
+        self.assertTrue(glauth.install_key_material(shared["certificate"], shared["private-key"]))
+        self.assertEqual(glauth.load(), shared["certificate"])
+        self.assertEqual(self.ca_key.stat().st_mode & 0o777, 0o600)
+        self.assertFalse(glauth.install_key_material(shared["certificate"], shared["private-key"]))
+
+    def test_issue_certificate(self) -> None:
+        """Test each unit serves a certificate for its own names, signed by the shared CA."""
+        glauth.generate_certificate()
+        self.assertTrue(glauth.issue_certificate(["glauth-0", "10.0.0.1"]))
+        self.assertFalse(glauth.issue_certificate(["10.0.0.1", "glauth-0"]))
+        ca = x509.load_pem_x509_certificate(glauth.load().encode())
+        cert = x509.load_pem_x509_certificate(self.cert.read_bytes())
+        cert.verify_directly_issued_by(ca)
+        names = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+        self.assertEqual(names.get_values_for_type(x509.DNSName), ["glauth-0"])
+        self.assertEqual(
+            names.get_values_for_type(x509.IPAddress), [ipaddress.ip_address("10.0.0.1")]
+        )
+        # A new address, or a new CA from the leader, reissues the certificate
+        self.assertTrue(glauth.issue_certificate(["glauth-0", "10.0.0.2"]))
+        shared = glauth.key_material()
+        for path in (self.ca_cert, self.ca_key):
+            path.unlink()
+        glauth.generate_certificate()
+        self.assertTrue(glauth.issue_certificate(["glauth-0", "10.0.0.2"]))
+        glauth.install_key_material(shared["certificate"], shared["private-key"])
+        self.assertTrue(glauth.issue_certificate(["glauth-0", "10.0.0.2"]))
+
+    def test_issue_without_ca(self) -> None:
+        """Test issuing before the CA is installed raises GlauthError."""
+        with self.assertRaises(glauth.GlauthError):
+            glauth.issue_certificate(["glauth-0"])
+
+    def test_unsupported_algorithm(self) -> None:
+        """Test an unknown algorithm raises GlauthError."""
+        with self.assertRaises(glauth.GlauthError):
+            glauth.generate_certificate("dsa-1024")
+
+
+class TestDefaultConfig(unittest.TestCase):
+    """Test rendering of the default config."""
+
+    def setUp(self) -> None:
+        """Point the config path at a temporary directory."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.config = pathlib.Path(tmp.name, "glauth.cfg")
+        patcher = patch.object(glauth, "CONFIG_PATH", self.config)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_render(self) -> None:
+        """Test the template is compiled once and unchanged configs are not rewritten."""
+        with patch.object(
+            glauth._templates, "_parse", side_effect=glauth._templates._parse
+        ) as parse:
+            self.assertTrue(glauth.create_default_config(api_port=5555))
+            mtime = self.config.stat().st_mtime_ns
+            self.assertFalse(glauth.create_default_config(api_port=5555))
+            self.assertEqual(self.config.stat().st_mtime_ns, mtime)
+            self.assertTrue(glauth.create_default_config(api_port=5556))
+        self.assertLessEqual(parse.call_count, 1)
+        self.assertIn('listen = "0.0.0.0:5556"', self.config.read_text())
+
+    def test_backends(self) -> None:
+        """Test each backend renders its own backend block."""
+        glauth.create_default_config(api_port=5555)
+        self.assertNotIn("[backend]", self.config.read_text())
+        glauth.create_default_config(
+            api_port=5555, backend="database", ldap_search_base="dc=glauth,dc=com"
+        )
+        backend = toml.loads(self.config.read_text())["backend"]
+        self.assertEqual(
+            (backend["datastore"], backend["database"]), ("plugin", str(glauth.DATABASE_PATH))
+        )
+        glauth.create_default_config(
+            api_port=5555,
+            backend="ldap",
+            ldap_search_base="dc=glauth,dc=com",
+            ldap_upstream_servers="ldaps://ldap1:636, ldap://ldap2:389",
+        )
+        backend = toml.loads(self.config.read_text())["backend"]
+        self.assertEqual(
+            backend,
+            {
+                "datastore": "ldap",
+                "servers": ["ldaps://ldap1:636", "ldap://ldap2:389"],
+                "insecure": False,
+                "baseDN": "dc=glauth,dc=com",
+            },
+        )
+
+
+@patch("glauth.restart")
+@patch("glauth.start")
+@patch("glauth.active", return_value=True)
+class TestServe(unittest.TestCase):
+    """Test GLAuth is only restarted for config it does not reload."""
+
+    def setUp(self) -> None:
+        """Point the config, key material and database paths at a temporary directory."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = pathlib.Path(tmp.name)
+        for name, path in (
+            ("CONFIG_PATH", "glauth.cfg"),
+            ("CERT_PATH", "glauth.crt"),
+            ("KEY_PATH", "glauth.key"),
+            ("DATABASE_PATH", "glauth.db"),
+        ):
+            patcher = patch.object(glauth, name, self.tmp / path)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        glauth.create_default_config(api_port=5555)
+        self.users = self.tmp / "users.cfg"
+        self.users.write_text('[[users]]\nname = "a"\n')
+
+    def test_reload(self, active, start, restart) -> None:
+        """Test changes to users are reloaded and the rest restarts GLAuth."""
+        outcome, served = glauth.serve(None)
+        self.assertEqual(outcome, "restarted")
+        self.assertEqual(glauth.serve(served), ("unchanged", served))
+        self.users.write_text('[[users]]\nname = "b"\n')
+        outcome, served = glauth.serve(served)
+        self.assertEqual(outcome, "reloaded")
+        glauth.CERT_PATH.write_text("cert")
+        outcome, served = glauth.serve(served)
+        self.assertEqual(outcome, "restarted")
+        glauth.create_default_config(api_port=5556)
+        self.assertEqual(glauth.serve(served)[0], "restarted")
+        self.assertEqual(restart.call_count, 3)
+        start.assert_not_called()
+
+    def test_database(self, *_) -> None:
+        """Test a database replaced restarts GLAuth only under the database backend."""
+        glauth.DATABASE_PATH.write_text("")
+        served = glauth.config_digests()
+        glauth.DATABASE_PATH.with_name("new.db").write_text("")
+        glauth.DATABASE_PATH.with_name("new.db").replace(glauth.DATABASE_PATH)
+        self.assertEqual(glauth.serve(served)[0], "unchanged")
+        glauth.create_default_config(api_port=5555, backend="database")
+        served = glauth.config_digests()
+        glauth.DATABASE_PATH.with_name("new.db").write_text("")
+        glauth.DATABASE_PATH.with_name("new.db").replace(glauth.DATABASE_PATH)
+        self.assertEqual(glauth.serve(served)[0], "restarted")
+
+    def test_unwatched(self, *_) -> None:
+        """Test changes to users restart GLAuth if it does not watch its config."""
+        glauth.CONFIG_PATH.write_text(glauth.CONFIG_PATH.read_text().replace("true", "false"))
+        served = glauth.config_digests()
+        self.users.write_text('[[users]]\nname = "b"\n')
+        self.assertEqual(glauth.serve(served)[0], "restarted")
+
+    def test_stopped(self, active, start, restart) -> None:
+        """Test GLAuth is only started when allowed, and adopted when already running."""
+        active.return_value = False
+        self.assertEqual(glauth.serve(None), ("stopped", {}))
+        self.assertEqual(glauth.serve(None, allow_start=True)[0], "started")
+        start.assert_called_once()
+        active.return_value = True
+        self.assertEqual(glauth.serve(None, allow_start=True)[0], "unchanged")
+        restart.assert_not_called()
+
+
+class TestTuning(unittest.TestCase):
+    """Test the systemd drop-in tuning the GLAuth service."""
+
+    def setUp(self) -> None:
+        """Point the drop-in at a temporary directory."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dropin = pathlib.Path(tmp.name, "service.d", "tuning.conf")
+        patcher = patch.object(glauth, "DROPIN_PATH", self.dropin)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch("subprocess.check_call")
+    def test_write(self, check_call) -> None:
+        """Test systemd is only reloaded when the drop-in changes."""
+        self.assertTrue(glauth.write_tuning(65536, gomaxprocs=4))
+        self.assertFalse(glauth.write_tuning(65536, gomaxprocs=4))
+        check_call.assert_called_once_with(["systemctl", "daemon-reload"])
+        self.assertIn("Environment=GOMAXPROCS=4", self.dropin.read_text())
+        self.assertTrue(glauth.write_tuning(65536))
+        self.assertNotIn("GOMAXPROCS", self.dropin.read_text())
+
+    @patch("subprocess.check_call")
+    def test_remove(self, check_call) -> None:
+        """Test the drop-in and its directory are removed and systemd reloaded."""
+        self.assertFalse(glauth.remove_tuning())
+        check_call.assert_not_called()
+        glauth.write_tuning(65536)
+        check_call.reset_mock()
+        self.assertTrue(glauth.remove_tuning())
+        self.assertFalse(self.dropin.parent.exists())
+        check_call.assert_called_once_with(["systemctl", "daemon-reload"])
+
+    def test_effective(self) -> None:
+        """Test the settings are read from the running process, or else the unit."""
+        show = "MainPID={}\nLimitNOFILE=65536\nEnvironment=GOGC=200 GOMAXPROCS=4\n"
+        with patch("subprocess.check_output", return_value=show.format(0)):
+            self.assertEqual(
+                glauth.effective_tuning(),
+                {"max-open-files": "65536", "gomaxprocs": "4", "gogc": "200", "source": "unit"},
+            )
+        with patch("subprocess.check_output", return_value=show.format(os.getpid())):
+            effective = glauth.effective_tuning()
+        self.assertEqual(effective["source"], "process")
+        self.assertEqual(
+            effective["max-open-files"], str(resource.getrlimit(resource.RLIMIT_NOFILE)[0])
+        )
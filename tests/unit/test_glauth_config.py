@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Test validation of GLAuth config files."""
+
+import pathlib
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import glauth_config
+import toml
+
+SHA256 = "6478579e37aff45f013e14eeb30b3cc56c72ccdc310123bcdf53e0333e3f416a"
+# GLAuth expects bcrypt hashes hex encoded
+BCRYPT = "$2y$10$KbHZNKoVnNMucd3i6kKiVumnl4daPwnXI1nXsRiUgSitzRcbLLo9l".encode().hex()
+CONFIG = f"""
+[[users]]
+  name = "hackers"
+  uidnumber = 5001
+  primarygroup = 5501
+  passsha256 = "{SHA256}"
+
+[[users]]
+  name = "serviceuser"
+  uidnumber = 5003
+  primarygroup = 5502
+  otherGroups = [5501]
+  passbcrypt = "{BCRYPT}"
+
+[[groups]]
+  name = "superheros"
+  gidnumber = 5501
+
+[[groups]]
+  name = "svcaccts"
+  gidnumber = 5502
+  includegroups = [5501]
+"""
+
+
+class TestValidate(unittest.TestCase):
+    """Test checks across users and groups."""
+
+    def setUp(self) -> None:
+        """Set up a temporary directory for config files."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = pathlib.Path(tmp.name)
+
+    def _files(self, **contents: str) -> dict:
+        files = {}
+        for name, content in contents.items():
+            files[f"{name}.cfg"] = self.tmp / f"{name}.cfg"
+            files[f"{name}.cfg"].write_text(content)
+        return files
+
+    def test_valid(self) -> None:
+        """Test a valid config is summarised."""
+        summary = glauth_config.validate(self._files(users=CONFIG))
+        self.assertEqual(summary, {"files": 1, "users": 2, "groups": 2})
+
+    def test_problems(self) -> None:
+        """Test duplicates, dangling groups and malformed hashes are all reported."""
+        extra = """
+[[users]]
+  name = "hackers"
+  uidnumber = 5003
+  primarygroup = 6000
+  passsha256 = "nothex"
+"""
+        with self.assertRaises(glauth_config.ConfigValidationError) as e:
+            glauth_config.validate(self._files(users=CONFIG, more=extra))
+        message = str(e.exception)
+        self.assertIn("user hackers in more.cfg duplicates the name of user hackers", message)
+        self.assertIn("duplicates the uidnumber of user serviceuser in users.cfg", message)
+        self.assertIn("primarygroup refers to undefined group 6000", message)
+        self.assertIn("has a malformed passsha256", message)
+
+    def test_invalid_toml(self) -> None:
+        """Test a file which is not TOML is reported by name."""
+        with self.assertRaises(glauth_config.ConfigValidationError) as e:
+            glauth_config.validate(self._files(users='[[users]]\n  name = "x'))
+        self.assertIn("users.cfg is not valid TOML", str(e.exception))
+
+    def test_redefined_table(self) -> None:
+        """Test a table or key redefined as an array of tables is reported, not raised."""
+        for text in ("[ldap]\n[[ldap]]\n", "ldap = 1\n[[ldap]]\n"):
+            with self.subTest(text=text):
+                with self.assertRaises(glauth_config.ConfigValidationError) as e:
+                    glauth_config.validate(self._files(users=text))
+                self.assertIn("users.cfg is not valid TOML", str(e.exception))
+
+    def test_scanner_matches_toml(self) -> None:
+        """Test the line scanner reads configs as toml does, and defers other syntax."""
+        self.assertEqual(glauth_config._scan(CONFIG), toml.loads(CONFIG))
+        for text in ('a = "x" # comment', "a = [\n  1,\n]", "[users.attrs]", "a = 1.5"):
+            with self.subTest(text=text):
+                with self.assertRaises(glauth_config._UnsupportedError):
+                    glauth_config._scan(text)
+                self.assertEqual(
+                    glauth_config.parse(self._files(f=text)["f.cfg"], "f"), toml.loads(text)
+                )
+
+    def test_large_config_scanned(self) -> None:
+        """Test tens of thousands of users are read without the general TOML parser."""
+        users = "".join(
+            f'[[users]]\n  name = "user{i}"\n  uidnumber = {10000 + i}\n'
+            f'  primarygroup = 5501\n  otherGroups = [5502]\n  passsha256 = "{SHA256}"\n'
+            for i in range(20000)
+        )
+        groups = '[[groups]]\n  name = "a"\n  gidnumber = 5501\n[[groups]]\n  name = "b"\n  gidnumber = 5502\n'
+        with patch("toml.loads") as loads:
+            summary = glauth_config.validate(self._files(users=users, groups=groups))
+        loads.assert_not_called()
+        self.assertEqual(summary["users"], 20000)
@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Test the provides side of the ldap-client library."""
+
+import json
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import zipfile
+from unittest.mock import patch
+
+import glauth
+import ldapclient_lib
+from charm import GlauthCharm
+from ops.charm import CharmBase
+from ops.model import ActiveStatus, BlockedStatus, WaitingStatus
+from ops.testing import Harness
+
+
+def _patch_key_paths(test: unittest.TestCase, root: pathlib.Path) -> None:
+    """Point the key material of GLAuth at a temporary directory for the test."""
+    for name in ("CERT_PATH", "KEY_PATH", "CA_CERT_PATH", "CA_KEY_PATH"):
+        patcher = patch.object(glauth, name, root / getattr(glauth, name).name)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+
+
+class TestSetConfig(unittest.TestCase):
+    """Test extraction of the config resource."""
+
+    def setUp(self) -> None:
+        """Set up harness and a temporary GLAuth config directory."""
+        self.harness = Harness(GlauthCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.begin()
+        self.provides = self.harness.charm._ldapclient
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = pathlib.Path(tmp.name)
+        self.config_dir = self.tmp / "glauth.d"
+        self.config_dir.mkdir()
+        patcher = patch.object(ldapclient_lib, "GLAUTH_CONFIG_DIR", self.config_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _resource(self, name: str, members: dict) -> pathlib.Path:
+        path = self.tmp / name
+        with zipfile.ZipFile(path, "w") as zip:
+            for member, content in members.items():
+                zip.writestr(member, content)
+        return path
+
+    def test_extract(self) -> None:
+        """Test the resource is extracted into the config directory."""
+        resource = self._resource("a.zip", {"users.cfg": "a = 1", "groups.cfg": "b = 2"})
+        self.assertTrue(self.provides._extract_config(resource))
+        self.assertEqual((self.config_dir / "users.cfg").read_text(), "a = 1")
+        self.assertEqual((self.config_dir / "groups.cfg").read_text(), "b = 2")
+
+    def test_same_digest_skipped(self) -> None:
+        """Test a resource already applied is not extracted again."""
+        resource = self._resource("a.zip", {"users.cfg": "a = 1"})
+        self.provides._extract_config(resource)
+        with patch("ldapclient_lib._stream_member") as stream:
+            self.assertFalse(self.provides._extract_config(resource))
+            self.provides.set_config(False, config=resource)
+        stream.assert_not_called()
+
+    def test_incremental(self) -> None:
+        """Test only changed members are written and stale files removed."""
+        self.provides._extract_config(
+            self._resource(
+                "a.zip", {"users.cfg": "a = 1", "groups.cfg": "b = 2", "old.cfg": "c = 3"}
+            )
+        )
+        resource = self._resource("b.zip", {"users.cfg": "a = 1", "groups.cfg": "b = 3"})
+        with patch(
+            "ldapclient_lib._stream_member", side_effect=ldapclient_lib._stream_member
+        ) as stream:
+            self.assertTrue(self.provides._extract_config(resource))
+        self.assertEqual([c.args[1].filename for c in stream.call_args_list], ["groups.cfg"])
+        self.assertEqual((self.config_dir / "groups.cfg").read_text(), "b = 3")
+        self.assertFalse((self.config_dir / "old.cfg").exists())
+
+    @patch("ldapclient_lib.MAX_TOTAL_SIZE", 1024)
+    @patch("ldapclient_lib.MAX_MEMBER_SIZE", 1024)
+    def test_invalid_config(self) -> None:
+        """Test an invalid config is not swapped in and leaves no staged files behind."""
+        self.provides._extract_config(self._resource("a.zip", {"users.cfg": "a = 1"}))
+        bad = '[[users]]\n  name = "a"\n  uidnumber = 1\n  primarygroup = 2\n'
+        with self.assertRaises(ldapclient_lib.ConfigResourceError) as e:
+            self.provides._extract_config(self._resource("b.zip", {"users.cfg": bad}))
+        self.assertIn("undefined group 2", str(e.exception))
+        self.assertEqual([p.name for p in self.config_dir.iterdir()], ["users.cfg"])
+        self.assertEqual((self.config_dir / "users.cfg").read_text(), "a = 1")
+
+    def test_size_limits(self) -> None:
+        """Test oversized resources are rejected without touching the config directory."""
+        for members in ({"big.cfg": "a" * 1025}, {"a.cfg": "a" * 600, "b.cfg": "b" * 600}):
+            with self.subTest(members=list(members)):
+                with self.assertRaises(ldapclient_lib.ConfigResourceError):
+                    self.provides._extract_config(self._resource("big.zip", members))
+                self.assertEqual(list(self.config_dir.iterdir()), [])
+
+    def test_stream_limit(self) -> None:
+        """Test the limit is enforced on decompressed bytes, not the declared size."""
+        resource = self._resource("a.zip", {"users.cfg": "a" * 10})
+        with zipfile.ZipFile(resource) as zip, self.assertRaises(
+            ldapclient_lib.ConfigResourceError
+        ):
+            ldapclient_lib._stream_member(
+                zip, zip.getinfo("users.cfg"), self.config_dir / "users.cfg", 5
+            )
+        self.assertEqual(list(self.config_dir.iterdir()), [])
+
+    def test_unsafe_member(self) -> None:
+        """Test members escaping the config directory are rejected."""
+        with self.assertRaises(ldapclient_lib.ConfigResourceError):
+            self.provides._extract_config(self._resource("a.zip", {"../escape.cfg": "a"}))
+        self.assertFalse((self.tmp / "escape.cfg").exists())
+
+
+@patch("glauth.create_default_config")
+@patch("glauth.start")
+@patch("glauth.active", return_value=True)
+class TestReconcile(unittest.TestCase):
+    """Test reconciliation of the server and ldap-client relations."""
+
+    def setUp(self) -> None:
+        """Set up harness as leader with the confidential secrets in peer data."""
+        self.harness = Harness(GlauthCharm)
+        self.addCleanup(self.harness.cleanup)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        _patch_key_paths(self, pathlib.Path(tmp.name))
+        self.harness.set_leader(True)
+        self.harness.begin()
+        self.peer_id = self.harness.add_relation("glauth", "glauth")
+
+    def _set_confidential(self) -> dict:
+        ids = {}
+        for label in ldapclient_lib.SECRET_LABELS:
+            ids[label] = self.harness.charm.app.add_secret({label: "x"}, label=label).id
+        self.harness.update_relation_data(self.peer_id, "glauth", ids)
+        return ids
+
+    def _join(self, app: str, units: int = 1) -> int:
+        relation_id = self.harness.add_relation("ldap-client", app)
+        for unit in range(units):
+            self.harness.add_relation_unit(relation_id, f"{app}/{unit}")
+        return relation_id
+
+    def test_waiting_for_secrets(self, *_) -> None:
+        """Test joining before set-confidential blocks without publishing."""
+        relation_id = self._join("sssd")
+        self.assertEqual(
+            self.harness.charm.unit.status, BlockedStatus("waiting for set-confidential action")
+        )
+        self.assertEqual(self.harness.get_relation_data(relation_id, "glauth"), {})
+
+    def test_publish(self, _, start, create_default_config) -> None:
+        """Test every joined relation receives the secrets and config data."""
+        ids = self._set_confidential()
+        relation_ids = [self._join(f"sssd{i}") for i in range(3)]
+        for relation_id in relation_ids:
+            data = self.harness.get_relation_data(relation_id, "glauth")
+            self.assertEqual({key: data[key] for key in ids}, ids)
+            self.assertTrue(data["ldap-uri"].startswith("ldaps://"))
+        start.assert_not_called()
+        self.assertEqual(self.harness.charm.unit.status, ActiveStatus())
+        self.assertGreater(self.harness.charm._ldapclient._stored.reconcile_seconds, 0)
+
+    @patch("glauth.effective_tuning")
+    @patch("glauth.write_tuning", return_value=False)
+    def test_config_changed_publishes(self, _, effective_tuning, *__) -> None:
+        """Test config clients are given is republished when it changes."""
+        effective_tuning.return_value = {
+            "max-open-files": "65536",
+            "gomaxprocs": "",
+            "gogc": "100",
+        }
+        self._set_confidential()
+        relation_id = self._join("sssd")
+        self.harness.update_config(
+            {"tls": False, "ldap-port": 3894, "ldap-search-base": "dc=glauth,dc=com"}
+        )
+        data = self.harness.get_relation_data(relation_id, "glauth")
+        self.assertTrue(data["ldap-uri"].startswith("ldap://"))
+        self.assertTrue(data["ldap-uri"].endswith(":3894"))
+        self.assertEqual(data["basedn"], "dc=glauth,dc=com")
+
+    def test_unit_storm(self, *_) -> None:
+        """Test units joining an already published relation do not rewrite its data."""
+        self._set_confidential()
+        relation_id = self._join("sssd")
+        with patch.object(
+            self.harness._backend, "relation_set", wraps=self.harness._backend.relation_set
+        ) as relation_set:
+            for unit in range(1, 50):
+                self.harness.add_relation_unit(relation_id, f"sssd/{unit}")
+        relation_set.assert_not_called()
+
+    @patch("glauth.load", return_value="cert")
+    def test_set_confidential_publishes(self, *_) -> None:
+        """Test clients which joined before set-confidential receive the secrets."""
+        relation_id = self._join("sssd")
+        self.harness.run_action(
+            "set-confidential",
+            {"ldap-password": "secret", "ldap-default-bind-dn": "cn=svc,dc=glauth,dc=com"},
+        )
+        data = self.harness.get_relation_data(relation_id, "glauth")
+        self.assertEqual(set(ldapclient_lib.SECRET_LABELS) - set(data), set())
+
+    def test_relation_broken(self, *_) -> None:
+        """Test a client leaving only loses its own grants to the shared secrets."""
+        ids = self._set_confidential()
+        leaving, staying = self._join("sssd0"), self._join("sssd1")
+        self.harness.remove_relation(leaving)
+        for secret_id in ids.values():
+            self.assertEqual(self.harness.get_secret_grants(secret_id, leaving), set())
+            self.assertEqual(self.harness.get_secret_grants(secret_id, staying), {"sssd1"})
+        self.harness.remove_relation(staying)
+
+    def test_secret_lookups(self, *_) -> None:
+        """Test secrets are resolved once per hook and never granted twice."""
+        self._set_confidential()
+        relation_ids = [self.harness.add_relation("ldap-client", f"sssd{i}") for i in range(5)]
+        backend = self.harness._backend
+        with patch.object(
+            backend, "secret_get", wraps=backend.secret_get
+        ) as secret_get, patch.object(
+            backend, "secret_grant", wraps=backend.secret_grant
+        ) as secret_grant:
+            self.harness.charm._ldapclient.reconcile()
+            self.assertEqual(secret_get.call_count, 3)
+            self.assertEqual(secret_grant.call_count, 15)
+            self.harness.add_relation_unit(relation_ids[0], "sssd0/0")
+            self.harness.charm._ldapclient.reconcile()
+            self.assertEqual(secret_get.call_count, 3)
+            self.assertEqual(secret_grant.call_count, 15)
+
+
+@patch("glauth.create_default_config")
+@patch("glauth.start")
+@patch("glauth.restart")
+@patch("glauth.active", return_value=True)
+class TestCluster(unittest.TestCase):
+    """Test units converging on the leader and clients receiving every unit."""
+
+    def setUp(self) -> None:
+        """Set up harness with two peer units and a config resource."""
+        self.harness = Harness(GlauthCharm)
+        self.addCleanup(self.harness.cleanup)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.config_dir = pathlib.Path(tmp.name, "glauth.d")
+        patcher = patch.object(ldapclient_lib, "GLAUTH_CONFIG_DIR", self.config_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        _patch_key_paths(self, pathlib.Path(tmp.name))
+        resource = pathlib.Path(tmp.name, "config.zip")
+        with zipfile.ZipFile(resource, "w") as zip:
+            zip.writestr("users.cfg", "a = 1")
+        self.digest = ldapclient_lib._file_digest(resource)
+        self.harness.add_resource("config", resource.read_bytes())
+        self.peer_id = self.harness.add_relation("glauth", "glauth")
+        for unit in (1, 2):
+            self.harness.add_relation_unit(self.peer_id, f"glauth/{unit}")
+            self.harness.update_relation_data(
+                self.peer_id,
+                f"glauth/{unit}",
+                {"hostname": f"glauth-{unit}", "address": f"10.0.0.{unit}", "weight": "4"},
+            )
+        self.harness.begin()
+
+    def _set_confidential(self) -> None:
+        ids = {}
+        for label in ldapclient_lib.SECRET_LABELS:
+            ids[label] = self.harness.charm.app.add_secret({label: "x"}, label=label).id
+        self.harness.update_relation_data(self.peer_id, "glauth", ids)
+
+    def test_ldap_uri_lists_units(self, *_) -> None:
+        """Test every unit is published, in a different failover order per relation."""
+        self.harness.set_leader(True)
+        self._set_confidential()
+        first, second = (self.harness.add_relation("ldap-client", f"sssd{i}") for i in range(2))
+        self.harness.charm._ldapclient.reconcile()
+        uris = self.harness.get_relation_data(first, "glauth")["ldap-uri"].split(",")
+        self.assertEqual(len(uris), 3)
+        self.assertIn("ldaps://glauth-2:636", uris)
+        rotated = self.harness.get_relation_data(second, "glauth")["ldap-uri"].split(",")
+        self.assertEqual(sorted(rotated), sorted(uris))
+        self.assertNotEqual(rotated[0], uris[0])
+        servers = json.loads(self.harness.get_relation_data(first, "glauth")["ldap-uris"])
+        self.assertEqual(len(servers), 3)
+        self.assertIn({"uri": "ldaps://10.0.0.2:636", "weight": 4}, servers)
+        self.assertEqual(
+            self.harness.get_relation_data(self.peer_id, "glauth")["config-digest"], self.digest
+        )
+
+    def test_follower_waits_for_leader(self, *_) -> None:
+        """Test a unit applies the config resource only once the leader has applied it."""
+        self.harness.add_relation("ldap-client", "sssd")
+        self.harness.charm._ldapclient.reconcile()
+        self.assertEqual(
+            self.harness.charm.unit.status,
+            WaitingStatus("waiting for leader to apply config resource"),
+        )
+        self.assertFalse((self.config_dir / "users.cfg").exists())
+        self.harness.update_relation_data(self.peer_id, "glauth", {"config-digest": self.digest})
+        self.assertEqual((self.config_dir / "users.cfg").read_text(), "a = 1")
+
+    @patch("glauth.serve", return_value=("restarted", {}))
+    @patch("glauth.issue_certificate", return_value=False)
+    @patch("glauth.install_key_material", return_value=True)
+    @patch("glauth.key_material", return_value={"certificate": "c", "private-key": "k"})
+    def test_key_material(
+        self, key_material, install_key_material, issue_certificate, serve, *_
+    ) -> None:
+        """Test the leader shares its CA once and every unit issues its own certificate."""
+        self.harness.set_leader(True)
+        secret_id = self.harness.get_relation_data(self.peer_id, "glauth")["key-material"]
+        self.harness.set_leader(False)
+        self.harness.set_leader(True)
+        key_material.assert_called_once()
+        self.harness.set_leader(False)
+        self.harness.update_relation_data(self.peer_id, "glauth/1", {"hostname": "glauth-1b"})
+        install_key_material.assert_called_with("c", "k")
+        endpoint = self.harness.charm._ldapclient.cluster_endpoints()[0]
+        issue_certificate.assert_called_with(
+            {endpoint["hostname"], endpoint["address"]}, "ecdsa-p256"
+        )
+        serve.assert_called()
+        self.assertEqual(
+            self.harness.get_relation_data(self.peer_id, "glauth")["key-material"], secret_id
+        )
+
+
+class _Requirer(CharmBase):
+    """Charm consuming the ldap-client integration."""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.ldapclient = ldapclient_lib.LdapClientRequires(self, "ldap-client")
+        self.configs = []
+        self.framework.observe(self.ldapclient.on.config_data_available, self._on_config)
+
+    def _on_config(self, event) -> None:
+        self.configs.append(event)
+
+
+class TestRequires(unittest.TestCase):
+    """Test the requires side of the ldap-client library."""
+
+    def setUp(self) -> None:
+        """Set up a requirer related to glauth, with the secrets granted."""
+        self.harness = Harness(
+            _Requirer, meta="name: sssd\nrequires:\n  ldap-client:\n    interface: ldap-client\n"
+        )
+        self.addCleanup(self.harness.cleanup)
+        self.harness.begin()
+        self.relation_id = self.harness.add_relation("ldap-client", "glauth")
+        self.harness.add_relation_unit(self.relation_id, "glauth/0")
+        self.ids = {}
+        for label in ldapclient_lib.SECRET_LABELS:
+            self.ids[label] = self.harness.add_model_secret("glauth", {label: "x"})
+            self.harness.grant_secret(self.ids[label], "sssd")
+
+    def _publish(self, data: dict) -> None:
+        data = {**self.ids, "basedn": "dc=glauth,dc=com", **data}
+        self.harness.update_relation_data(self.relation_id, "glauth", data)
+
+    def test_ldap_uris(self) -> None:
+        """Test the server URIs are exposed in failover order with their weights."""
+        servers = [{"uri": "ldap://10.0.0.2:3893", "weight": 2}, {"uri": "ldap://10.0.0.1:3893"}]
+        self._publish({"ldap-uri": "ldap://glauth-0:3893", "ldap-uris": json.dumps(servers)})
+        self.assertEqual(
+            self.harness.charm.configs[-1].ldap_uris,
+            [
+                {"uri": "ldap://10.0.0.2:3893", "weight": 2},
+                {"uri": "ldap://10.0.0.1:3893", "weight": 1},
+            ],
+        )
+
+    def test_ldap_uri_fallback(self) -> None:
+        """Test providers publishing only ldap-uri still yield a list of servers."""
+        self._publish({"ldap-uri": "ldap://glauth-0:3893,ldap://glauth-1:3893"})
+        self.assertEqual(
+            [server["uri"] for server in self.harness.charm.configs[-1].ldap_uris],
+            ["ldap://glauth-0:3893", "ldap://glauth-1:3893"],
+        )
+
+    def test_secret_fetches(self) -> None:
+        """Test secrets are only fetched when published data or a secret revision changes."""
+        backend = self.harness._backend
+        with patch.object(backend, "secret_get", wraps=backend.secret_get) as secret_get:
+            self._publish({"ldap-uri": "ldap://glauth-0:3893"})
+            self.assertEqual(secret_get.call_count, 3)
+            self._publish({"ldap-uri": "ldap://glauth-0:3893", "unrelated": "x"})
+            self.assertEqual(secret_get.call_count, 3)
+            self._publish({"ldap-uri": "ldap://glauth-1:3893"})
+            self.assertEqual(secret_get.call_count, 6)
+            delivered = dict(self.harness.charm.ldapclient._stored.delivered)
+            configs = len(self.harness.charm.configs)
+            self.harness.set_secret_content(self.ids["ldap-password"], {"ldap-password": "y"})
+            self.assertEqual(secret_get.call_count, 10)
+        # A new revision is always delivered, and nothing of the secret content is kept
+        self.assertEqual(len(self.harness.charm.configs), configs + 1)
+        self.assertEqual(dict(self.harness.charm.ldapclient._stored.delivered), delivered)
+        with self.assertRaises(AttributeError):
+            self.harness.charm.ldapclient._stored.secrets
+        self.assertEqual(self.harness.charm.configs[-1].lp_content, "y")
+        self.assertEqual(self.harness.charm.configs[-1].ldap_uri, "ldap://glauth-1:3893")
+
+    def test_unchanged_payload_suppressed(self) -> None:
+        """Test events are emitted again only when the delivered payload changes."""
+        self._publish({"ldap-uri": "ldap://glauth-0:3893"})
+        self.assertEqual(len(self.harness.charm.configs), 1)
+        self._publish({"ldap-uri": "ldap://glauth-0:3893", "unrelated": "x"})
+        self.assertEqual(len(self.harness.charm.configs), 1)
+        self.assertEqual(self.harness.charm.ldapclient.suppressed_emissions, 3)
+        self._publish({"basedn": "dc=example,dc=com"})
+        self.assertEqual(len(self.harness.charm.configs), 2)
+        self.assertEqual(self.harness.charm.ldapclient.suppressed_emissions, 4)
+
+
+class TestStandalone(unittest.TestCase):
+    """Test the library works when copied into another charm."""
+
+    def test_import(self) -> None:
+        """Test the library imports with nothing of this charm next to it."""
+        with tempfile.TemporaryDirectory() as tmp:
+            shutil.copy(ldapclient_lib.__file__, tmp)
+            subprocess.run(
+                [sys.executable, "-c", "import ldapclient_lib; ldapclient_lib.LdapClientRequires"],
+                cwd=tmp,
+                env={"PYTHONPATH": tmp, "PATH": os.environ.get("PATH", "")},
+                check=True,
+                capture_output=True,
+            )
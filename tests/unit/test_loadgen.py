@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Test the LDAP load generator against an in-memory stand-in server."""
+
+import unittest
+from unittest.mock import patch
+
+import ldap3
+import loadgen
+from charm import GlauthCharm
+from ops.testing import Harness
+
+BIND_DN = "cn=svc,ou=svcaccts,dc=glauth,dc=com"
+
+
+def _stand_in(password: str = "secret"):
+    """Return a connection factory for a mock LDAP server holding a few users."""
+    server = ldap3.Server("glauth")
+
+    def factory():
+        return ldap3.Connection(
+            server, user=BIND_DN, password=password, client_strategy=ldap3.MOCK_SYNC
+        )
+
+    seed = factory()
+    seed.strategy.add_entry(BIND_DN, {"objectClass": "person", "userPassword": "secret"})
+    for i in range(10):
+        seed.strategy.add_entry(f"cn=user{i},dc=glauth,dc=com", {"objectClass": "person"})
+    return factory
+
+
+class TestLoadgen(unittest.TestCase):
+    """Test load generation and result reporting."""
+
+    def test_mixed(self) -> None:
+        """Test concurrent binds and searches are timed per operation."""
+        results = loadgen.run(_stand_in(), "dc=glauth,dc=com", workers=4, duration=0.2)
+        self.assertEqual(results["errors"], 0)
+        for op in ("bind", "search", "total"):
+            self.assertGreater(results[op]["ops"], 0)
+            self.assertLessEqual(results[op]["p50-ms"], results[op]["p99-ms"])
+        self.assertEqual(
+            results["total"]["ops"], results["bind"]["ops"] + results["search"]["ops"]
+        )
+
+    def test_bad_credentials(self) -> None:
+        """Test a failing bind is reported as an error per worker."""
+        results = loadgen.run(_stand_in("wrong"), "dc=glauth,dc=com", workers=2, duration=0.1)
+        self.assertEqual(results["errors"], 2)
+        self.assertEqual(results["total"]["ops"], 0)
+
+    def test_percentile(self) -> None:
+        """Test nearest-rank percentiles."""
+        samples = [float(i) for i in range(1, 101)]
+        self.assertEqual(loadgen._percentile(samples, 50), 50.0)
+        self.assertEqual(loadgen._percentile(samples, 99), 99.0)
+        self.assertEqual(loadgen._percentile([], 99), 0.0)
+
+
+class TestBenchmarkAction(unittest.TestCase):
+    """Test the benchmark action."""
+
+    def setUp(self) -> None:
+        """Set up harness."""
+        self.harness = Harness(GlauthCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.begin()
+
+    @patch("loadgen.connection_factory", return_value=_stand_in())
+    def test_benchmark(self, factory) -> None:
+        """Test the action runs against the URI of the local listener."""
+        output = self.harness.run_action(
+            "benchmark",
+            {
+                "duration": 0.2,
+                "workers": 2,
+                "bind-dn": BIND_DN,
+                "password": "secret",
+                "base-dn": "dc=glauth,dc=com",
+            },
+        )
+        self.assertGreater(output.results["total"]["ops"], 0)
+        self.assertEqual(factory.call_args.args[0], "ldap://127.0.0.1:363")
+
+    @patch("loadgen.connection_factory", return_value=_stand_in())
+    def test_benchmark_listen_address(self, factory) -> None:
+        """Test the action follows the address the listener is bound to."""
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"ldap-listen-address": "10.0.0.5", "ldap-port": 3894})
+        self.harness.run_action(
+            "benchmark",
+            {
+                "duration": 0.1,
+                "workers": 1,
+                "bind-dn": BIND_DN,
+                "password": "secret",
+                "base-dn": "dc=glauth,dc=com",
+            },
+        )
+        self.assertEqual(factory.call_args.args[0], "ldap://10.0.0.5:3894")
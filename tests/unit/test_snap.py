@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Test the snapd client against a fake snapd."""
+
+import http.client
+import time
+import unittest
+from unittest.mock import ANY, patch
+
+from charms.operator_libs_linux.v1 import snap
+from fake_snapd import FakeSnapd
+
+
+class TestSnapClient(unittest.TestCase):
+    """Test snapd connection handling."""
+
+    def setUp(self) -> None:
+        """Start a fake snapd."""
+        self.snapd = FakeSnapd()
+        self.snapd.__enter__()
+        self.addCleanup(self.snapd.__exit__)
+
+    def _requests(self, client: snap.SnapClient) -> None:
+        client.get_installed_snaps()
+        client.get_installed_snap_apps("glauth")
+        with self.assertRaises(snap.SnapAPIError):
+            client.get_snap_information("missing")
+
+    def test_keepalive(self) -> None:
+        """Test requests from every client share one connection."""
+        self._requests(snap.SnapClient())
+        self._requests(snap.SnapClient())
+        snap.SnapCache()["glauth"].services
+        self.assertEqual(len(self.snapd.requests), 8)
+        self.assertEqual(self.snapd.connections, 1)
+
+    def test_no_keepalive(self) -> None:
+        """Test every request opens a connection with keep-alive disabled."""
+        self._requests(snap.SnapClient(keepalive=False))
+        self.assertEqual(self.snapd.connections, 3)
+
+    def test_reconnect(self) -> None:
+        """Test a connection dropped by snapd is transparently reopened."""
+        client = snap.SnapClient()
+        self.snapd.keepalive = False
+        self.assertEqual(len(client.get_installed_snaps()), 1)
+        self.assertEqual(len(client.get_installed_snaps()), 1)
+        self.assertEqual(self.snapd.connections, 2)
+
+    def test_reconnect_change(self) -> None:
+        """Test a request which changes state is sent on a new connection if snapd closed it."""
+        client = snap.SnapClient()
+        self.snapd.keepalive = False
+        client.get_installed_snaps()
+        # Once snapd has closed the connection, as a request may race its close
+        conn = snap._connection_pool[self.snapd.socket_path]
+        deadline = time.monotonic() + 5
+        while not snap._connection_dropped(conn) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        client._request("POST", "apps", body={"action": "stop", "names": ["glauth.daemon"]})
+        self.assertEqual(self.snapd.changes, [("POST", "/v2/apps", ANY)])
+        self.assertEqual(self.snapd.connections, 2)
+
+    def test_change_not_resent(self) -> None:
+        """Test a request which changes state is not sent again once snapd may have got it."""
+        client = snap.SnapClient()
+        client.get_installed_snaps()
+        with patch.object(
+            snap._UnixSocketConnection,
+            "getresponse",
+            side_effect=http.client.RemoteDisconnected("closed"),
+        ) as getresponse:
+            with self.assertRaises(snap.SnapAPIError):
+                client._request(
+                    "POST", "apps", body={"action": "stop", "names": ["glauth.daemon"]}
+                )
+        getresponse.assert_called_once()
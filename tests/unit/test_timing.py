@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Test handler timing spans."""
+
+import json
+import pathlib
+import subprocess
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import glauth
+import timing
+from charm import GlauthCharm
+from fake_snapd import FakeSnapd
+from ops.testing import Harness
+
+
+class TestSpan(unittest.TestCase):
+    """Test call counting within spans."""
+
+    def test_counts(self) -> None:
+        """Test snapd requests, forks and hook tool calls are counted separately."""
+        with FakeSnapd(), patch.object(glauth, "_state", glauth._SnapState()):
+            with timing.span("outer") as outer:
+                glauth.installed()
+                with timing.span("inner") as inner:
+                    subprocess.run(["true"])
+                    with self.assertRaises(FileNotFoundError):
+                        subprocess.run(["relation-get", "-r", "1"])
+        self.assertEqual((outer.snapd_calls, outer.forks, outer.hook_tool_calls), (1, 1, 1))
+        self.assertEqual((inner.snapd_calls, inner.forks, inner.hook_tool_calls), (0, 1, 1))
+        self.assertGreater(outer.wall, inner.wall)
+
+
+class TestTimed(unittest.TestCase):
+    """Test timed charm handlers."""
+
+    def setUp(self) -> None:
+        """Set up harness with the summary file in a temporary directory."""
+        self.harness = Harness(GlauthCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.begin()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.summary = pathlib.Path(tmp.name, "hook-timings.json")
+        tuning = {"max-open-files": "65536", "gomaxprocs": "", "gogc": "100"}
+        for patcher in (
+            patch.object(timing, "SUMMARY_PATH", self.summary),
+            patch("glauth.write_tuning", return_value=False),
+            patch("glauth.effective_tuning", return_value=tuning),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @patch("glauth.version", return_value="v1.0.0")
+    @patch("charms.operator_libs_linux.v1.snap.hold_refresh")
+    def test_summary(self, *_) -> None:
+        """Test spans are logged and kept in the summary file only when enabled."""
+        with self.assertLogs("timing", "INFO") as logs:
+            self.harness.charm.on.update_status.emit()
+        record = json.loads(logs.records[0].args[0])
+        self.assertEqual(record["span"], "GlauthCharm._update_status")
+        self.assertFalse(self.summary.exists())
+
+        self.harness.update_config({"hook-timing-summary": True})
+        with patch.object(timing, "SUMMARY_SAMPLES", 2):
+            for _ in range(3):
+                self.harness.charm.on.update_status.emit()
+        summary = json.loads(self.summary.read_text())
+        self.assertEqual(len(summary["GlauthCharm._update_status"]), 2)
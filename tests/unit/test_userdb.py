@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Test compiling user and group sources into the GLAuth database."""
+
+import base64
+import hashlib
+import pathlib
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import glauth
+import glauth_config
+import userdb
+from charm import GlauthCharm
+from ops.testing import ActionFailed, Harness
+
+CSV = """type,name,uidnumber,gidnumber,primarygroup,othergroups,mail,includegroups
+group,superheros,,5501,,,,
+group,svcaccts,,5502,,,,5501
+user,hackers,5001,,5501,,hackers@example.com,
+user,serviceuser,5003,,5502,5501,,
+"""
+LDIF = f"""version: 1
+
+dn: cn=superheros,ou=groups,dc=glauth,dc=com
+objectClass: posixGroup
+cn: superheros
+gidNumber: 5501
+memberUid: serviceuser
+
+# service accounts
+dn: cn=svcaccts,ou=groups,dc=glauth,dc=com
+objectClass: posixGroup
+cn: svcaccts
+gidNumber: 5502
+
+dn: uid=serviceuser,ou=people,dc=glauth,dc=com
+objectClass: posixAccount
+uid: serviceuser
+uidNumber: 5003
+gidNumber: 5502
+mail: svc@exam
+ ple.com
+userPassword: {{SHA256}}{base64.b64encode(hashlib.sha256(b"pw").digest()).decode()}
+"""
+JSONL = """{"type": "group", "name": "superheros", "gidnumber": 5501}
+{"name": "hackers", "uidnumber": 5001, "primarygroup": 5501, "sshkeys": ["ssh-ed25519 AAAA"]}
+"""
+# Service tuning of the default config
+TUNING = {"max-open-files": "65536", "gomaxprocs": "", "gogc": "100"}
+
+
+class TestUserdb(unittest.TestCase):
+    """Test reading sources and compiling the database."""
+
+    def setUp(self) -> None:
+        """Set up a temporary directory for sources and the database."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = pathlib.Path(tmp.name)
+        self.database = self.tmp / "glauth.db"
+
+    def _source(self, name: str, content: str) -> pathlib.Path:
+        path = self.tmp / name
+        path.write_text(content)
+        return path
+
+    def _query(self, sql: str, *args) -> list:
+        with sqlite3.connect(self.database) as conn:
+            return conn.execute(sql, args).fetchall()
+
+    def test_csv(self) -> None:
+        """Test users, groups and included groups are written from CSV."""
+        users, groups = userdb.load_source(self._source("users.csv", CSV))
+        results = userdb.compile_database(users, groups, self.database, "users.csv")
+        self.assertEqual((results["users"], results["groups"]), (2, 2))
+        self.assertEqual(
+            self._query("SELECT name, primarygroup, othergroups FROM users ORDER BY uidnumber"),
+            [("hackers", 5501, ""), ("serviceuser", 5502, "5501")],
+        )
+        self.assertEqual(
+            self._query(
+                "SELECT p.gidnumber, i.gidnumber FROM includegroups "
+                "JOIN ldapgroups p ON p.id = parentgroupid JOIN ldapgroups i ON i.id = includegroupid"
+            ),
+            [(5502, 5501)],
+        )
+
+    def test_ldif(self) -> None:
+        """Test posix entries, member lists, folded lines and password hashes from LDIF."""
+        path = self._source("users", LDIF)
+        self.assertEqual(userdb.source_format(path), "ldif")
+        users, groups = userdb.load_source(path)
+        self.assertEqual([g["name"] for g in groups], ["superheros", "svcaccts"])
+        self.assertEqual(users[0]["othergroups"], [5501])
+        self.assertEqual(users[0]["mail"], "svc@example.com")
+        self.assertEqual(users[0]["passsha256"], hashlib.sha256(b"pw").hexdigest())
+
+    def test_jsonl(self) -> None:
+        """Test records are read from JSON Lines."""
+        users, groups = userdb.load_source(self._source("users.jsonl", JSONL))
+        userdb.compile_database(users, groups, self.database, "users.jsonl")
+        self.assertEqual(self._query("SELECT sshkeys FROM users"), [("ssh-ed25519 AAAA",)])
+
+    def test_indexes(self) -> None:
+        """Test lookups by name, number, group and mail use an index."""
+        userdb.ensure_database(self.database)
+        for column in ("name", "uidnumber", "primarygroup", "mail"):
+            with self.subTest(column=column):
+                plan = self._query(f"EXPLAIN QUERY PLAN SELECT * FROM users WHERE {column} = ?", 1)
+                self.assertIn("USING INDEX", plan[0][-1])
+
+    def test_invalid(self) -> None:
+        """Test invalid sources leave the current database in place."""
+        users, groups = userdb.load_source(self._source("users.csv", CSV))
+        userdb.compile_database(users, groups, self.database, "users.csv")
+        users[1]["uidnumber"] = 5001
+        with self.assertRaises(glauth_config.ConfigValidationError):
+            userdb.compile_database(users, groups, self.database, "users.csv")
+        with self.assertRaises(userdb.UserSourceError):
+            userdb.load_source(self._source("bad.jsonl", '{"name": "x", "uidnumber": "y"}'))
+        self.assertEqual(len(self._query("SELECT * FROM users")), 2)
+        self.assertEqual(sorted(p.name for p in self.tmp.iterdir() if p.name.startswith(".")), [])
+
+
+class TestUpdate(unittest.TestCase):
+    """Test incremental updates of the database and the managed config file."""
+
+    def setUp(self) -> None:
+        """Set up a temporary directory holding the stores."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = pathlib.Path(tmp.name)
+        path = self.tmp / "users.csv"
+        path.write_text(CSV)
+        self.users, self.groups = userdb.load_source(path)
+
+    def _check(self, update, read, path: pathlib.Path) -> None:
+        results = update(path, self.users, self.groups, "add", "users.csv")
+        self.assertEqual(results["users"]["added"], 2)
+        self.assertEqual(read(path), (self.users, self.groups))
+        # Only the changed user is written
+        self.users[0]["mail"] = "new@example.com"
+        results = update(path, self.users, [], "add", "users.csv")
+        self.assertEqual((results["users"]["updated"], results["users"]["unchanged"]), (1, 1))
+        # Nothing is written if the store would be invalid
+        bad = dict(self.users[0], name="other")
+        with self.assertRaises(glauth_config.ConfigValidationError):
+            update(path, [bad], [], "add", "users.csv")
+        with self.assertRaises(glauth_config.ConfigValidationError):
+            update(path, [], [{"name": "superheros"}], "remove", "remove-users")
+        results = update(path, [{"name": "hackers"}, {"name": "nobody"}], [], "remove", "-")
+        self.assertEqual((results["users"]["removed"], results["users"]["not-found"]), (1, 1))
+        results = update(path, self.users[1:], self.groups, "sync", "users.csv")
+        self.assertFalse(results["changed"])
+        self.groups[1]["includegroups"] = []
+        self.users[1]["othergroups"].remove(5501)
+        results = update(path, self.users[1:], self.groups[1:], "sync", "users.csv")
+        self.assertEqual((results["groups"]["removed"], results["groups"]["updated"]), (1, 1))
+        self.assertEqual(results["users"]["updated"], 1)
+        self.assertEqual(read(path), (self.users[1:], self.groups[1:]))
+
+    def test_database(self) -> None:
+        """Test changes are applied to the database in place."""
+        self._check(userdb.update_database, userdb.read_database, self.tmp / "glauth.db")
+
+    def test_config(self) -> None:
+        """Test changes are applied to the managed config file, checked with its neighbours."""
+        (self.tmp / "resource.cfg").write_text('[[groups]]\nname = "ops"\ngidnumber = 5600\n')
+        self.users[1]["othergroups"].append(5600)
+        self._check(userdb.update_config, userdb.read_config, self.tmp / "charm-users.cfg")
+
+
+class TestImportUsersAction(unittest.TestCase):
+    """Test the import-users action."""
+
+    def setUp(self) -> None:
+        """Set up harness with the database in a temporary directory."""
+        self.harness = Harness(GlauthCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.begin()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = pathlib.Path(tmp.name)
+        for patcher in (
+            patch.object(glauth, "DATABASE_PATH", self.tmp / "glauth.db"),
+            patch("glauth.write_tuning", return_value=False),
+            patch("glauth.effective_tuning", return_value=TUNING),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @patch("glauth.restart")
+    @patch("glauth.active", return_value=True)
+    def test_import_users(self, _, restart) -> None:
+        """Test the users resource is compiled and GLAuth restarted to serve it."""
+        self.harness.update_config({"backend": "database", "ldap-search-base": "dc=glauth,dc=com"})
+        self.harness.add_resource("users", CSV)
+        output = self.harness.run_action("import-users", {"format": "csv"})
+        self.assertEqual(output.results["users"], 2)
+        restart.assert_called_once()
+        self.assertTrue(glauth.DATABASE_PATH.exists())
+
+    @patch("userdb.compile_database", side_effect=sqlite3.OperationalError("database is locked"))
+    def test_import_users_write_error(self, _) -> None:
+        """Test a database which cannot be written fails the action."""
+        self.harness.add_resource("users", CSV)
+        with self.assertRaises(ActionFailed) as e:
+            self.harness.run_action("import-users", {"format": "csv"})
+        self.assertEqual(
+            e.exception.message, "could not write the user database: database is locked"
+        )
+
+    @patch("userdb.update_database", side_effect=sqlite3.OperationalError("database is locked"))
+    def test_add_users_write_error(self, _) -> None:
+        """Test a user store which cannot be written fails the action."""
+        source = self.tmp / "users.csv"
+        source.write_text(CSV)
+        with self.harness.hooks_disabled():
+            self.harness.update_config(
+                {"backend": "database", "ldap-search-base": "dc=glauth,dc=com"}
+            )
+        with self.assertRaises(ActionFailed) as e:
+            self.harness.run_action("add-users", {"path": str(source)})
+        self.assertEqual(e.exception.message, "could not write the user store: database is locked")
+
+    @patch("glauth.restart")
+    @patch("glauth.active", return_value=True)
+    def test_add_remove_users(self, _, restart) -> None:
+        """Test users are added to and removed from the managed config file."""
+        source = self.tmp / "users.csv"
+        source.write_text(CSV)
+        with patch.object(glauth, "CONFIG_PATH", self.tmp / "glauth.cfg"), patch.object(
+            glauth, "USERS_CONFIG_PATH", self.tmp / "charm-users.cfg"
+        ):
+            glauth.create_default_config(api_port=5555)
+            output = self.harness.run_action("add-users", {"path": str(source)})
+            self.assertEqual(output.results["users"]["added"], 2)
+            output = self.harness.run_action("remove-users", {"users": "hackers, serviceuser"})
+            self.assertEqual(output.results["users"]["removed"], 2)
+            self.assertEqual(userdb.read_config(glauth.USERS_CONFIG_PATH)[0], [])
+        # GLAuth is restarted once to learn what it serves, then reloads the users file
+        restart.assert_called_once()
+        self.assertEqual(self.harness.charm.restarts_avoided, 1)
+        with self.assertRaises(ActionFailed):
+            self.harness.run_action("remove-users")
+        # Users of the ldap backend live upstream
+        self.harness.update_config(
+            {
+                "backend": "ldap",
+                "ldap-search-base": "dc=glauth,dc=com",
+                "ldap-upstream-servers": "ldaps://ldap1:636",
+            }
+        )
+        with self.assertRaises(ActionFailed):
+            self.harness.run_action("add-users", {"path": str(source)})